@@ -0,0 +1,843 @@
+import argparse
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from distance_filter import hampelMinSamples, madScale
+from sensor_inputs import SensorSnapshot
+from sensor_trace import ReplayBoard, ReplayClock
+from traffic_controller import (IntersectionConfig, TrafficController, dayLeds, nightLeds,
+                                s1OverrideLeds, s1ResetLeds, s2FinishLeds, s3FinishLeds, s4HoldLeds,
+                                s4ReleaseLeds, tl1Tl2Leds, tl4Leds, tl4RedLeds, wl1FlashLeds, wl2FlashLeds)
+
+# Columns of the debouncer arrays: the three sonars, then the two buttons
+us1Column, us3Column, us4Column, pb1AColumn, pb1BColumn = range(5)
+
+# Pedestrian red blinking during the call indication of each button
+callAckButtons = (0, 1)
+
+# Result of a conformance check, firstMismatch is (site, time, expected frame, batch frame,
+# expected buzzer, batch buzzer) or None
+ConformanceResult = namedtuple("ConformanceResult", ["sites", "ticks", "mismatches", "firstMismatch"])
+
+
+def word(mask):
+    """
+    Converts an LED mask into the dtype of the batch LED words.
+        Parameters:
+            mask (int): Bit mask over the LEDs
+        Returns:
+            numpy.uint32: The mask
+    """
+    return np.uint32(mask)
+
+
+class BatchSequence:
+    """
+    One PhaseSequence per site, held as an array of phase indexes and an array of
+    entry times. The phase table is read from the scalar controller's sequence, so
+    masks, durations and flash patterns cannot drift apart; its guards and computed
+    next phases call back into the scalar controller and are given again as functions
+    of the batch state, one per phase.
+    """
+
+    def __init__(self, controller, sequence, layer, guards=None, choosers=None, onFinish=None):
+        """
+        Creates the sequence idle at every site.
+            Parameters:
+                controller (BatchController): Controller owning the sequence and its layer
+                sequence (PhaseSequence): Scalar sequence whose table is evaluated
+                layer (int): Column of the layer the phases render into
+                guards (dict or None): Phase index -> function of now returning a bool per site
+                choosers (dict or None): Phase index -> function returning the next phase per site
+                onFinish (callable or None): Called with the finishing sites and the time
+            Returns:
+                None
+        """
+        self.controller = controller
+        self.name = sequence.name
+        self.layer = layer
+        self.guards = guards or {}
+        self.choosers = choosers or {}
+        self.onFinish = onFinish
+
+        phases = sequence.phases
+        for position, phase in enumerate(phases):
+            if (phase.guard is not None) != (position in self.guards):
+                raise ValueError(f"guard of phase {phase.name!r} of {self.name} is not mirrored")
+            if callable(phase.nextPhase) != (position in self.choosers):
+                raise ValueError(f"next phase of {phase.name!r} of {self.name} is not mirrored")
+            if phase.onEnter is not None:
+                raise ValueError(f"phase {phase.name!r} of {self.name} has an entry action")
+        self.phaseCount = len(phases)
+        self.setMasks = np.array([phase.setMask for phase in phases], dtype=np.uint32)
+        self.clearMasks = np.array([phase.clearMask for phase in phases], dtype=np.uint32)
+        self.durations = np.array([phase.duration for phase in phases], dtype=float)
+        # Next phase of every row, -1 for the following row or a computed one
+        self.nextPhases = np.array([phase.nextPhase if isinstance(phase.nextPhase, int) else -1
+                                    for phase in phases], dtype=np.int64)
+        self.flashMasks = np.array([phase.flashMask for phase in phases], dtype=np.uint32)
+        self.flashIntervals = np.array([phase.flashInterval for phase in phases], dtype=float)
+        self.flashes = bool(self.flashMasks.any())
+
+        # Index of the current phase of every site, -1 while idle
+        self.index = np.full(controller.count, -1, dtype=np.int64)
+        self.enteredAt = np.zeros(controller.count)
+
+    def enter(self, sites, index, now):
+        """
+        Enters a phase at some sites and applies its LED masks.
+            Parameters:
+                sites (numpy.ndarray): Bool per site, True where the phase is entered
+                index (int or numpy.ndarray): Phase to enter, or one per site
+                now (float): Current monotonic time
+            Returns:
+                None
+        """
+        self.index = np.where(sites, index, self.index)
+        self.enteredAt = np.where(sites, now, self.enteredAt)
+        self.controller.apply_mask(self.layer, sites, self.setMasks[index], self.clearMasks[index])
+
+    def stop(self, sites):
+        """
+        Makes the sequence idle at some sites without running its finish action.
+            Parameters:
+                sites (numpy.ndarray): Bool per site
+            Returns:
+                None
+        """
+        self.index = np.where(sites, -1, self.index)
+
+    def holding(self, now):
+        """
+        Checks at every site whether the current phase has run its duration.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                numpy.ndarray: Bool per site, False where the sequence is idle
+        """
+        index = self.index
+        return (index >= 0) & (now - self.enteredAt >= self.durations[np.maximum(index, 0)])
+
+    def update(self, sites, now):
+        """
+        Moves every given site through the transitions that are due, like PhaseSequence.update().
+            Parameters:
+                sites (numpy.ndarray): Bool per site, True where the sequence is updated
+                now (float): Current monotonic time
+            Returns:
+                None
+        """
+        while True:
+            index = self.index
+            due = sites & self.holding(now)
+            for position, guard in self.guards.items():
+                if (due & (index == position)).any():
+                    due &= (index != position) | guard(now)
+            if not due.any():
+                return
+
+            phase = np.maximum(index, 0)
+            nextPhase = self.nextPhases[phase]
+            nextPhase = np.where(nextPhase < 0, index + 1, nextPhase)
+            for position, chooser in self.choosers.items():
+                nextPhase = np.where(index == position, chooser(), nextPhase)
+            finishing = due & (nextPhase >= self.phaseCount)
+            entering = due & ~finishing
+            if finishing.any():
+                self.index = np.where(finishing, -1, self.index)
+                if self.onFinish is not None:
+                    self.onFinish(finishing, now)
+            if entering.any():
+                self.enter(entering, np.minimum(nextPhase, self.phaseCount - 1), now)
+            sites = entering
+
+    def render_flash(self, now):
+        """
+        Renders the half period of the flashing phases, like the BlinkEngine pattern they declare.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                None
+        """
+        if not self.flashes:
+            return
+        phase = np.maximum(self.index, 0)
+        flashMask = np.where(self.index >= 0, self.flashMasks[phase], 0).astype(np.uint32)
+        odd = (np.floor(now / self.flashIntervals[phase]).astype(np.int64) & 1).astype(bool)
+        flashing = flashMask != 0
+        self.controller.apply_mask(self.layer, flashing & ~odd, flashMask, 0)
+        self.controller.apply_mask(self.layer, flashing & odd, 0, flashMask)
+
+
+class BatchController:
+    """
+    The decision logic of many independent intersections, advanced together.
+
+    The state of every site is kept as arrays with one row per site (struct of arrays):
+    the filter windows of the sonars, the debouncers, the phase index and entry time of
+    every sequence, the subsystem flags and a 24-bit value and ownership word per LED
+    layer. step() advances all the sites by one tick with whole-array operations that
+    follow TrafficController.process() statement by statement, every branch turned
+    into a mask of the sites taking it, and resolves the layers into one LED word per
+    site. Every site uses the same configuration and is stepped at the same times.
+
+    Events, metrics and scheduling are left out: they do not change the LEDs or the
+    buzzer, and a batch is stepped at a fixed tick rather than woken at deadlines.
+    """
+
+    def __init__(self, count, config=None):
+        """
+        Creates count sites in the boot state of TrafficController after reset_layers().
+            Parameters:
+                count (int): Number of intersections
+                config (IntersectionConfig or None): Configuration of every site, the defaults if None
+            Returns:
+                None
+        """
+        self.count = count
+        self.config = config = config if config is not None else IntersectionConfig()
+
+        # Scalar controller providing the phase tables, the layer order and the boot frame
+        template = TrafficController(ReplayBoard(), ReplayClock(0.0), config=config)
+        template.reset_layers()
+        layers = template.compositor.layers
+        self.layerNames = [layer.name for layer in layers]
+        self.s1Layer, self.s3Layer, self.s4Layer, self.s2Layer, self.overrideLayer = (
+            self.layerNames.index(name) for name in ("s1", "s3", "s4", "s2", "override"))
+        # Value and ownership word of every layer, one row per layer
+        self.layerValues = np.repeat(np.array([[layer.value] for layer in layers], dtype=np.uint32), count, axis=1)
+        self.layerOwned = np.repeat(np.array([[layer.ownedMask] for layer in layers], dtype=np.uint32), count, axis=1)
+        self.s1AllRedPhase = template.s1AllRedPhase
+        self.s2ClearancePhase = template.s2ClearancePhase
+
+        # Filter windows of US1, US3 and US4, one (sites, 3) array per slot with the
+        # oldest sample first and the newest in the last slot; count samples are in the
+        # window, total is their running sum
+        self.windowSize = window = config.smoothingWindowSize
+        self.rawValues = np.zeros((window, count, 3))
+        self.values = np.zeros((window, count, 3))
+        self.times = np.zeros((window, count, 3))
+        self.sampleCount = np.zeros((count, 3), dtype=np.int64)
+        self.total = np.zeros((count, 3))
+
+        # Debouncers of US1, US3, US4, PB1A and PB1B, one row per debouncer
+        debouncers = template.debouncers
+        self.assertTimes = np.array([[debouncer.assertTime] for debouncer in debouncers])
+        self.releaseTimes = np.array([[debouncer.releaseTime] for debouncer in debouncers])
+        self.onThresholds = np.array([[debouncer.onThreshold] for debouncer in debouncers])
+        self.offThresholds = np.array([[debouncer.offThreshold] for debouncer in debouncers])
+        self.directions = np.array([[-1.0 if debouncer.below else 1.0] for debouncer in debouncers])
+        self.debounced = np.zeros((5, count), dtype=bool)
+        # Time each reading started to ask for the other state, NaN while it does not
+        self.pendingSince = np.full((5, count), np.nan)
+
+        # Subsystem flags and times, as in TrafficController
+        self.s1Active = np.zeros(count, dtype=bool)
+        self.wl1FlashActive = np.zeros(count, dtype=bool)
+        self.s1LastOccupied = np.full(count, -np.inf)
+        self.s2Active = np.zeros(count, dtype=bool)
+        self.sequenceRunning = np.zeros(count, dtype=bool)
+        self.lastCrossingTime = np.full(count, -np.inf)
+        # Time of the pedestrian call waiting to be served, NaN without a call
+        self.pedestrianCall = np.full(count, np.nan)
+        self.s3Active = np.zeros(count, dtype=bool)
+        self.s3SequenceComplete = np.zeros(count, dtype=bool)
+        self.s4Active = np.zeros(count, dtype=bool)
+        self.overrideSub2Overheight = np.zeros(count, dtype=bool)
+        self.overrideSub1BySub4 = np.zeros(count, dtype=bool)
+        self.s1SequenceCooldown = np.ones(count, dtype=bool)
+        # Frequency the buzzer plays, 0 while it is off
+        self.buzzerFreq = np.zeros(count, dtype=np.int64)
+
+        # Warning lights declared to the blink engine
+        self.wl1Flashing = np.zeros(count, dtype=bool)
+        self.wl2Flashing = np.zeros(count, dtype=bool)
+
+        self.s1Sequence = BatchSequence(self, template.s1Sequence, self.s1Layer,
+                                        guards={self.s1AllRedPhase: self.s1_red_released,
+                                                self.s1AllRedPhase + 1: self.us1_clear},
+                                        onFinish=self.finish_subsystem1)
+        self.s2Sequence = BatchSequence(self, template.s2Sequence, self.s2Layer, onFinish=self.finish_subsystem2)
+        self.callAck = BatchSequence(self, template.callAck, self.s2Layer, onFinish=self.finish_call_ack)
+        self.s3Sequence = BatchSequence(self, template.s3Sequence, self.s3Layer,
+                                        guards={2: self.us3_clear}, choosers={1: self.tl5_after_green},
+                                        onFinish=self.finish_subsystem3)
+        self.sequences = [self.s1Sequence, self.s2Sequence, self.callAck, self.s3Sequence]
+
+        # LED word of every site after the latest step
+        self.ledState = self.resolve()
+
+    def apply_mask(self, layer, sites, setMask, clearMask):
+        """
+        Takes ownership of LEDs of a layer at some sites and switches them on or off.
+            Parameters:
+                layer (int): Column of the layer
+                sites (numpy.ndarray): Bool per site
+                setMask (int or numpy.ndarray): LEDs to switch on, or one mask per site
+                clearMask (int or numpy.ndarray): LEDs to switch off, or one mask per site
+            Returns:
+                None
+        """
+        if not sites.any():
+            return
+        setMask = np.where(sites, np.asarray(setMask, dtype=np.uint32), word(0))
+        clearMask = np.where(sites, np.asarray(clearMask, dtype=np.uint32), word(0))
+        self.layerOwned[layer] |= setMask | clearMask
+        self.layerValues[layer] = (self.layerValues[layer] & ~clearMask) | setMask
+
+    def release(self, layer, sites, mask):
+        """
+        Hands LEDs of a layer back to the layers below at some sites.
+            Parameters:
+                layer (int): Column of the layer
+                sites (numpy.ndarray): Bool per site
+                mask (int): LEDs to stop driving
+            Returns:
+                None
+        """
+        if sites.any():
+            self.layerOwned[layer] &= np.where(sites, ~word(mask), ~word(0))
+
+    def resolve(self):
+        """
+        Combines the layers of every site into its LED word, like LedCompositor.resolve().
+            Parameters:
+                None
+            Returns:
+                numpy.ndarray: uint32 LED word per site
+        """
+        frame = np.zeros(self.count, dtype=np.uint32)
+        for layer in range(len(self.layerNames)):
+            owned = self.layerOwned[layer]
+            frame = (frame & ~owned) | (self.layerValues[layer] & owned)
+        return frame
+
+    def filter_readings(self, readings, now):
+        """
+        Feeds one reading per sonar and site through the filter windows, like DistanceFilter.update().
+            Parameters:
+                readings (numpy.ndarray): Raw distances in cm, shape (sites, 3), 0 or NaN if invalid
+                now (float): Current monotonic time
+            Returns:
+                numpy.ndarray: Filtered distances, NaN where no valid sample is left
+        """
+        config = self.config
+        window = self.windowSize
+        count = self.sampleCount
+        total = self.total
+        first = window - count
+
+        # Expire the samples older than readingMaxAge, oldest first so the running sum
+        # loses them in the same order as the ring buffer
+        if config.readingMaxAge is not None:
+            limit = now - config.readingMaxAge
+            stale = [(first <= slot) & (self.times[slot] < limit) for slot in range(window)]
+            if any(slotStale.any() for slotStale in stale):
+                for slot, slotStale in enumerate(stale):
+                    total = np.where(slotStale, total - self.values[slot], total)
+                    count = count - slotStale
+                total = np.where(count > 0, total, 0.0)
+
+        # Push the valid readings, dropping the oldest sample of a full window
+        valid = readings > 0
+        full = valid & (count == window)
+        total = np.where(full, total - self.values[0], total)
+        count = np.where(valid & ~full, count + 1, count)
+        first = window - count
+        value = np.where(valid, readings, 0.0)
+        self.shift(self.rawValues, value, valid)
+        self.shift(self.times, now, valid)
+
+        accepted = value
+        if config.hampelThreshold is not None:
+            with np.errstate(invalid="ignore"):
+                samples = [np.where(first <= slot, self.rawValues[slot], np.inf) for slot in range(window)]
+                centre = self.window_median(samples, count)
+                deviation = self.window_median([np.abs(sample - centre) for sample in samples], count)
+                outlier = (valid & (count >= hampelMinSamples)
+                           & (np.abs(value - centre) > config.hampelThreshold * madScale * deviation))
+            accepted = np.where(outlier, centre, value)
+        self.shift(self.values, accepted, valid)
+        total = np.where(valid, total + accepted, total)
+
+        self.sampleCount = count
+        self.total = total
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(count > 0, total / count, np.nan)
+
+    @staticmethod
+    def shift(slots, value, sites):
+        """
+        Moves the samples of some windows one slot towards the oldest and stores a new newest sample.
+            Parameters:
+                slots (numpy.ndarray): Window array, shape (windowSize, sites, 3), updated in place
+                value (float or numpy.ndarray): New sample, or one per window
+                sites (numpy.ndarray): Bool per window, True where the window takes the sample
+            Returns:
+                None
+        """
+        np.copyto(slots[:-1], slots[1:], where=sites)
+        np.copyto(slots[-1], value, where=sites)
+
+    def window_median(self, samples, count):
+        """
+        Takes the median of the samples of every window, like distance_filter.median().
+        The slots are sorted by an odd-even transposition network, which for windows of
+        a few samples costs less than sorting each window.
+            Parameters:
+                samples (list of numpy.ndarray): One array per slot, infinite in the unused slots
+                count (numpy.ndarray): Samples in each window
+            Returns:
+                numpy.ndarray: Median per window, meaningless for empty windows
+        """
+        ordered = list(samples)
+        for rank in range(len(ordered)):
+            for slot in range(rank % 2, len(ordered) - 1, 2):
+                low, high = ordered[slot], ordered[slot + 1]
+                ordered[slot], ordered[slot + 1] = np.minimum(low, high), np.maximum(low, high)
+        size = len(ordered)
+        lower, upper = ordered[(size - 1) // 2], ordered[size // 2]
+        partial = count < size
+        if partial.any():
+            lower = np.where(partial, np.choose(np.maximum(count - 1, 0) // 2, ordered), lower)
+            upper = np.where(partial, np.choose(np.minimum(count // 2, size - 1), ordered), upper)
+        return (lower + upper) / 2
+
+    def debounce(self, levels, now):
+        """
+        Feeds one reading per debouncer and site, like Debouncer.update().
+            Parameters:
+                levels (numpy.ndarray): Filtered distances and button levels, one row per debouncer,
+                    NaN if missing
+                now (float): Current monotonic time
+            Returns:
+                None
+        """
+        # Distances assert below their thresholds, negating them lets every row assert above
+        signed = levels * self.directions
+        present = (levels != 0) & (levels == levels)
+        asserting = present & (signed > self.onThresholds * self.directions)
+        releasing = ~present | (signed < self.offThresholds * self.directions)
+        active = self.debounced
+        changing = np.where(active, releasing, asserting)
+        window = np.where(active, self.releaseTimes, self.assertTimes)
+        # A pending change always started in the past, fmin keeps it and replaces NaN by now
+        pending = np.where(changing, np.fmin(self.pendingSince, now), np.nan)
+        flip = changing & (now - pending >= window)
+        self.debounced = active ^ flip
+        self.pendingSince = np.where(flip, np.nan, pending)
+
+    def us1_clear(self, now=None):
+        """
+        Checks at every site that US1 no longer sees an overheight vehicle.
+            Parameters:
+                now (float or None): Unused, guards are called with the time
+            Returns:
+                numpy.ndarray: Bool per site
+        """
+        return ~self.debounced[us1Column]
+
+    def us3_clear(self, now=None):
+        """
+        Checks at every site that US3 no longer sees an overheight vehicle.
+            Parameters:
+                now (float or None): Unused, guards are called with the time
+            Returns:
+                numpy.ndarray: Bool per site
+        """
+        return ~self.debounced[us3Column]
+
+    def s1_red_released(self, now):
+        """
+        Checks at every site whether TL1 and TL2 may leave the red hold, like
+        TrafficController.s1_red_released().
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                numpy.ndarray: Bool per site
+        """
+        maxOut = self.s1Sequence.enteredAt + self.config.s1MaxRedTime
+        occupied = self.debounced[us1Column] | self.debounced[us3Column]
+        deadline = np.where(occupied, maxOut, np.minimum(self.s1LastOccupied + self.config.s1GapTime, maxOut))
+        return now >= deadline
+
+    def tl5_after_green(self):
+        """
+        Chooses the phase following TL5 green at every site.
+            Parameters:
+                None
+            Returns:
+                numpy.ndarray: Flashing green where US3 still detects the vehicle, otherwise the end
+        """
+        return np.where(self.debounced[us3Column], 2, self.s3Sequence.phaseCount)
+
+    def reset_subsystem1(self, sites):
+        """
+        Resets Subsystem 1 to its initial state at some sites.
+            Parameters:
+                sites (numpy.ndarray): Bool per site
+            Returns:
+                None
+        """
+        self.s1Active &= ~sites
+        self.s1Sequence.stop(sites)
+        self.wl1Flashing &= ~sites
+        self.apply_mask(self.s1Layer, sites, *s1ResetLeds)
+
+    def finish_subsystem1(self, sites, now):
+        """
+        Releases TL1 and TL2 at the sites whose Subsystem 1 sequence finished.
+            Parameters:
+                sites (numpy.ndarray): Bool per site
+                now (float): Time the sequence finished
+            Returns:
+                None
+        """
+        self.apply_mask(self.s1Layer, sites, *s1ResetLeds)
+        self.wl1Flashing &= ~sites
+        self.buzzerFreq = np.where(sites, 0, self.buzzerFreq)
+        self.s1Active &= ~sites
+
+    def crossing_permitted(self, now):
+        """
+        Checks at every site whether a pedestrian crossing may start.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                numpy.ndarray: Bool per site
+        """
+        return (~self.s2Active & ~self.overrideSub2Overheight
+                & (now - self.lastCrossingTime >= self.config.crossingLockout))
+
+    def register_call(self, sites, button, now):
+        """
+        Latches a pedestrian call at the sites where a button was pressed.
+            Parameters:
+                sites (numpy.ndarray): Bool per site
+                button (int): 0 for PB1A, 1 for PB1B
+                now (float): Time of the press
+            Returns:
+                None
+        """
+        sites = sites & ~(self.s2Active & (self.s2Sequence.index < self.s2ClearancePhase))
+        self.pedestrianCall = np.where(sites & np.isnan(self.pedestrianCall), now, self.pedestrianCall)
+        acknowledged = sites & ~self.s2Active & ~self.crossing_permitted(now)
+        self.apply_mask(self.s2Layer, acknowledged, *s2FinishLeds)
+        self.callAck.enter(acknowledged, callAckButtons[button], now)
+
+    def start_subsystem2(self, sites, now):
+        """
+        Starts the pedestrian crossing sequence at the sites serving their latched call.
+            Parameters:
+                sites (numpy.ndarray): Bool per site
+                now (float): Current monotonic time
+            Returns:
+                None
+        """
+        self.callAck.stop(sites)
+        self.s2Active |= sites
+        self.sequenceRunning |= sites
+        waited = now - self.pedestrianCall >= self.config.s2GreenTime
+        self.s2Sequence.enter(sites, np.where(waited, 1, 0), now)
+        self.pedestrianCall = np.where(sites, np.nan, self.pedestrianCall)
+
+    def finish_call_ack(self, sites, now):
+        """
+        Returns the pedestrian reds to steady at the sites whose call indication ended.
+            Parameters:
+                sites (numpy.ndarray): Bool per site
+                now (float): Time the indication finished
+            Returns:
+                None
+        """
+        self.apply_mask(self.s2Layer, sites, *s2FinishLeds)
+
+    def finish_subsystem2(self, sites, now):
+        """
+        Hands TL4 back and starts the lockout at the sites whose crossing finished.
+            Parameters:
+                sites (numpy.ndarray): Bool per site
+                now (float): Time the sequence finished
+            Returns:
+                None
+        """
+        self.apply_mask(self.s2Layer, sites, *s2FinishLeds)
+        self.release(self.s2Layer, sites, tl4Leds)
+        self.sequenceRunning &= ~sites
+        self.lastCrossingTime = np.where(sites, now, self.lastCrossingTime)
+        self.s2Active &= ~sites
+
+    def finish_subsystem3(self, sites, now):
+        """
+        Returns TL5 to red at the sites whose Subsystem 3 sequence finished.
+            Parameters:
+                sites (numpy.ndarray): Bool per site
+                now (float): Time the sequence finished
+            Returns:
+                None
+        """
+        self.apply_mask(self.s3Layer, sites, *s3FinishLeds)
+        self.s3SequenceComplete |= sites
+        self.s1SequenceCooldown |= sites
+
+    def step(self, now, distances, buttons, ldrValues=None, presses=None):
+        """
+        Advances Subsystems 1-4 of every site for one set of readings and resolves the LED words.
+            Parameters:
+                now (float): Current monotonic time, shared by every site
+                distances (array-like): Raw US1, US3 and US4 distances in cm, shape (sites, 3),
+                    0 or NaN without an echo
+                buttons (array-like): PB1A and PB1B levels, shape (sites, 2)
+                ldrValues (array-like or None): LDR reading per site, NaN or None if unknown
+                presses (array-like or None): PB1A and PB1B presses latched since the previous
+                    step, shape (sites, 2), none if None
+            Returns:
+                numpy.ndarray: uint32 LED word per site, also kept in ledState
+        """
+        config = self.config
+        count = self.count
+        allSites = np.ones(count, dtype=bool)
+        ldrValues = np.full(count, np.nan) if ldrValues is None else np.asarray(ldrValues, dtype=float)
+
+        # Smoothen and debounce the readings, a press counts once the button is held down
+        distances = self.filter_readings(np.asarray(distances, dtype=float), now)
+        wasDown = self.debounced[pb1AColumn:]
+        self.debounce(np.concatenate([distances.T, np.asarray(buttons, dtype=float).T]), now)
+        pressed = self.debounced[pb1AColumn:] & ~wasDown
+        if presses is not None:
+            # As in TrafficController.process(), a latched press already released counts
+            # unless the button was down already, one still held is left to the debouncer
+            released = np.asarray(buttons).T == 0
+            pressed |= np.asarray(presses, dtype=bool).T & released & ~wasDown
+        us1 = self.debounced[us1Column]
+        us3 = self.debounced[us3Column]
+        us4 = self.debounced[us4Column]
+        self.s1LastOccupied = np.where(us1 | us3, now, self.s1LastOccupied)
+
+        # Subsystem 3 starts when US3 detects while Subsystem 1 runs
+        started = self.s1Active & ~self.s3Active & us3
+        self.s3Active |= started
+        self.s3Sequence.stop(started)
+        self.s3SequenceComplete &= ~started
+        self.s1SequenceCooldown |= started
+
+        # Subsystem 4 overrides Subsystem 1
+        overrideStart = ~self.overrideSub1BySub4 & us4
+        overrideRelease = self.overrideSub1BySub4 & ~us4
+        self.overrideSub1BySub4 = (self.overrideSub1BySub4 | overrideStart) & ~overrideRelease
+        self.wl1FlashActive = (self.wl1FlashActive | overrideStart) & ~overrideRelease
+        self.wl1Flashing &= ~(overrideRelease & ~self.s1Active)
+        self.reset_subsystem1((overrideStart | overrideRelease) & ~us1 & ~us3)
+        self.overrideSub2Overheight = us4.copy()
+
+        # Subsystem 1 is reset once US3 no longer detects
+        cooled = ~us3 & self.s3Active & self.s1SequenceCooldown
+        self.reset_subsystem1(cooled)
+        self.s1SequenceCooldown &= ~cooled
+
+        # Subsystem 1 sequence, frozen while overridden
+        normal = ~self.overrideSub1BySub4
+        detected = normal & us1 & ~self.s1Active
+        self.s1Active |= detected
+        self.s1Sequence.enter(detected, 0, now)
+        running = normal & self.s1Active
+        self.wl1Flashing |= running
+        self.s1Sequence.update(running, now)
+        self.release(self.overrideLayer, normal, tl1Tl2Leds)
+        running = normal & self.s1Active
+        alarm = (running & (self.s1Sequence.index >= self.s1AllRedPhase) & self.s1Sequence.holding(now) & us1)
+        frequency = np.where(alarm, config.alarmBuzzerFrequency, config.normalBuzzerFrequency)
+        self.buzzerFreq = np.where(normal, np.where(running, frequency, 0), config.overrideBuzzerFrequency)
+        overridden = ~normal
+        self.apply_mask(self.overrideLayer, overridden, *s1OverrideLeds)
+        self.wl1Flashing |= overridden & self.wl1FlashActive
+
+        # Subsystem 2: latch the calls and serve them when permitted
+        self.register_call(pressed[0], 0, now)
+        self.register_call(pressed[1], 1, now)
+        self.start_subsystem2(~np.isnan(self.pedestrianCall) & self.crossing_permitted(now), now)
+        self.s2Sequence.update(self.s2Active, now)
+        self.callAck.update(allSites, now)
+
+        # Subsystem 3
+        started = us3 & ~self.s3Active
+        self.s3Active |= started
+        self.s3Sequence.stop(started)
+        self.s3SequenceComplete &= ~started
+        self.s1SequenceCooldown |= started
+        left = ~us3 & self.s3Active & (self.s3SequenceComplete | (self.s3Sequence.index < 0))
+        self.s3Active &= ~left
+        cooled = left & self.s1SequenceCooldown
+        self.reset_subsystem1(cooled)
+        self.s1SequenceCooldown &= ~cooled
+
+        active = self.s3Active
+        night = active & us3 & (ldrValues < config.nightLdrValue)
+        self.apply_mask(self.s3Layer, night, *nightLeds)
+        self.apply_mask(self.s3Layer, active & ~night, *dayLeds)
+        restarted = active & (self.s3Sequence.index < 0)
+        self.s3SequenceComplete &= ~restarted
+        self.s3Sequence.enter(restarted, 0, now)
+        self.s3Sequence.update(active, now)
+
+        # Subsystem 4
+        hold = ~self.s4Active & us4
+        cleared = self.s4Active & ~us4
+        self.s4Active = (self.s4Active | hold) & ~cleared
+        self.wl2Flashing = (self.wl2Flashing | hold) & ~cleared
+        self.apply_mask(self.s4Layer, hold, *s4HoldLeds)
+        self.apply_mask(self.s4Layer, cleared, *s4ReleaseLeds)
+        tl4Red = self.overrideSub2Overheight | self.s4Active
+        self.apply_mask(self.overrideLayer, tl4Red, *tl4RedLeds)
+        self.release(self.overrideLayer, ~tl4Red, tl4Leds)
+
+        # Flashing LEDs for the current half period
+        odd = bool(int(np.floor(now / config.flashInterval)) & 1)
+        for flashing, layer, (evenMask, oddMask) in ((self.wl1Flashing, self.s1Layer, wl1FlashLeds),
+                                                      (self.wl2Flashing, self.s4Layer, wl2FlashLeds)):
+            if odd:
+                self.apply_mask(layer, flashing, oddMask, evenMask & ~oddMask)
+            else:
+                self.apply_mask(layer, flashing, evenMask, oddMask & ~evenMask)
+        for sequence in self.sequences:
+            sequence.render_flash(now)
+
+        self.ledState = self.resolve()
+        return self.ledState
+
+
+def random_readings(sites, interval, seed=0):
+    """
+    Generates random sensor readings for many sites: vehicles come and go under each
+    sonar, with readings inside the hysteresis band, missing echoes and outliers, the
+    buttons are pressed for random times, some too short to be sampled down but
+    latched by the inputs, and the LDR drifts between day and night.
+        Parameters:
+            sites (int): Number of intersections
+            interval (float): Seconds between two ticks
+            seed (int): Seed of the random generator
+        Returns:
+            iterator of tuple: (time, distances (sites, 3), buttons (sites, 2), ldr (sites,),
+                presses (sites, 2)) per tick
+    """
+    generator = np.random.default_rng(seed)
+    # Mean seconds between vehicles and under the sensor for US1, US3, US4, and for the buttons
+    meanGaps = np.array([30.0, 30.0, 40.0, 15.0, 15.0])
+    meanDwells = np.array([6.0, 6.0, 10.0, 0.3, 0.3])
+    present = np.zeros((sites, 5), dtype=bool)
+    ldr = generator.uniform(400, 1000, sites)
+    tick = 0
+    while True:
+        flip = generator.random((sites, 5)) < np.where(present, interval / meanDwells, interval / meanGaps)
+        wasPressed = present[:, 3:].copy()
+        present ^= flip
+        # The inputs latch every press, including ones released again between two ticks
+        taps = ~present[:, 3:] & (generator.random((sites, 2)) < interval / meanGaps[3:])
+        presses = (present[:, 3:] & ~wasPressed) | taps
+
+        near = generator.integers(5, 20, (sites, 3))
+        far = generator.integers(30, 150, (sites, 3))
+        distances = np.where(present[:, :3], near, far).astype(float)
+        noise = generator.random((sites, 3))
+        distances = np.where(noise < 0.1, generator.integers(18, 26, (sites, 3)), distances)
+        distances = np.where(noise > 0.97, generator.integers(1, 300, (sites, 3)), distances)
+        distances = np.where(noise > 0.995, 0.0, distances)
+
+        ldr = np.where(generator.random(sites) < 0.01, generator.uniform(400, 1000, sites), ldr)
+        ldrValues = np.where(generator.random(sites) < 0.01, np.nan, ldr)
+        yield tick * interval, distances, present[:, 3:].astype(int), ldrValues, presses
+        tick += 1
+
+
+def check_conformance(sites=50, duration=300.0, seed=0, config=None):
+    """
+    Runs random readings through a BatchController and through one TrafficController per
+    site, the way sensor_trace.replay() does, and compares their LED words and buzzers.
+        Parameters:
+            sites (int): Number of intersections
+            duration (float): Seconds of readings
+            seed (int): Seed of the random readings
+            config (IntersectionConfig or None): Configuration of every site, the defaults if None
+        Returns:
+            ConformanceResult: Number of ticks compared and of (site, tick) pairs that differ
+    """
+    config = config if config is not None else IntersectionConfig()
+    batch = BatchController(sites, config)
+    clock = ReplayClock(0.0)
+    controllers = []
+    for _ in range(sites):
+        controller = TrafficController(ReplayBoard(), clock, config=config)
+        controller.reset_layers()
+        controllers.append(controller)
+
+    ticks = int(duration / config.tickInterval)
+    mismatches = 0
+    firstMismatch = None
+    readings = random_readings(sites, config.tickInterval, seed)
+    for _ in range(ticks):
+        now, distances, buttons, ldrValues, presses = next(readings)
+        frames = batch.step(now, distances, buttons, ldrValues, presses)
+        clock.now = now
+        for site, controller in enumerate(controllers):
+            ldr = ldrValues[site]
+            snapshot = SensorSnapshot(now, distances[site, 0], distances[site, 1], distances[site, 2],
+                                      int(buttons[site, 0]), int(buttons[site, 1]),
+                                      bool(presses[site, 0]), bool(presses[site, 1]),
+                                      None if np.isnan(ldr) else ldr)
+            controller.process(snapshot)
+            frame = controller.compositor.resolve()
+            buzzer = controller.buzzerFreq if controller.buzzerOn else 0
+            if frame != frames[site] or buzzer != batch.buzzerFreq[site]:
+                mismatches += 1
+                if firstMismatch is None:
+                    firstMismatch = (site, now, frame, int(frames[site]), buzzer, int(batch.buzzerFreq[site]))
+    return ConformanceResult(sites, ticks, mismatches, firstMismatch)
+
+
+def measure_throughput(sites, duration, seed=0, config=None):
+    """
+    Times BatchController.step() on random readings, leaving out generating them.
+        Parameters:
+            sites (int): Number of intersections
+            duration (float): Seconds of readings
+            seed (int): Seed of the random readings
+            config (IntersectionConfig or None): Configuration of every site, the defaults if None
+        Returns:
+            float: Intersection-ticks per second
+    """
+    config = config if config is not None else IntersectionConfig()
+    batch = BatchController(sites, config)
+    readings = random_readings(sites, config.tickInterval, seed)
+    ticks = int(duration / config.tickInterval)
+    elapsed = 0.0
+    for _ in range(ticks):
+        now, distances, buttons, ldrValues, presses = next(readings)
+        start = time.perf_counter()
+        batch.step(now, distances, buttons, ldrValues, presses)
+        elapsed += time.perf_counter() - start
+    return sites * ticks / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks the batch controller against the scalar one and "
+                                                 "measures its throughput.")
+    parser.add_argument("--sites", type=int, default=100000, help="intersections of the throughput run")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds simulated by the throughput run")
+    parser.add_argument("--check-sites", type=int, default=50, help="intersections of the conformance check")
+    parser.add_argument("--check-duration", type=float, default=300.0,
+                        help="seconds simulated by the conformance check")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random readings")
+    args = parser.parse_args()
+
+    result = check_conformance(args.check_sites, args.check_duration, args.seed)
+    print(f"Conformance: {result.sites} sites x {result.ticks} ticks, {result.mismatches} mismatches")
+    if result.firstMismatch is not None:
+        site, now, expected, actual, expectedBuzzer, actualBuzzer = result.firstMismatch
+        print(f"  first at site {site}, t={now:.2f} s: scalar {expected:06x} buzzer {expectedBuzzer}, "
+              f"batch {actual:06x} buzzer {actualBuzzer}")
+    rate = measure_throughput(args.sites, args.duration, args.seed)
+    print(f"Throughput: {rate / 1e6:.2f} million intersection-ticks per second ({args.sites} sites)")
+    sys.exit(1 if result.mismatches else 0)
@@ -0,0 +1,235 @@
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+import traffic_controller
+from phase_table import led_mask
+from simulated_board import SimulatedBoard, VirtualClock, scenarios
+from traffic_controller import TrafficController
+
+# Serial link of the board, FirmataExpress runs at 115200 baud with 10 bits per byte
+baudRate = 115200
+bitsPerByte = 10
+
+# Stimulus and LED state marking the end of each subsystem's trigger-to-signal latency.
+# Latencies are measured on the virtual clock, so they cover the filtering, debouncing,
+# scheduling and sequence delays of the controller, the compute cost is in tickCpuUs
+latencyTriggers = {
+    "s1": (lambda board, at: board.set_distance(traffic_controller.trigPin1, 15, at=at),
+           led_mask(traffic_controller.tl1Red, traffic_controller.tl2Red)),
+    "s2": (lambda board, at: board.press_button(traffic_controller.pb1A, at=at),
+           led_mask(traffic_controller.pl1AGreen, traffic_controller.pl1BGreen)),
+    "s3": (lambda board, at: board.set_distance(traffic_controller.trigPin3, 12, at=at),
+           led_mask(traffic_controller.tl5Yellow)),
+    "s4": (lambda board, at: board.set_distance(traffic_controller.trigPin4, 10, at=at),
+           led_mask(traffic_controller.tl3Red, traffic_controller.tl4Red)),
+}
+
+# Longest wait for a trigger's LED state before the trial counts as a miss
+latencyTimeout = 15.0
+
+
+def percentile(values, percent):
+    """
+    Returns a nearest-rank percentile.
+        Parameters:
+            values (list of float): Samples, need not be sorted
+            percent (float): Percentile between 0 and 100
+        Returns:
+            float or None: The percentile, None if there are no samples
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def summarise(values, scale=1.0):
+    """
+    Summarises a list of samples.
+        Parameters:
+            values (list of float): Samples
+            scale (float): Factor applied to every statistic
+        Returns:
+            dict: "mean", "p50", "p90", "p99" and "max" of the samples
+    """
+    if not values:
+        return {"mean": None, "p50": None, "p90": None, "p99": None, "max": None}
+    return {
+        "mean": sum(values) / len(values) * scale,
+        "p50": percentile(values, 50) * scale,
+        "p90": percentile(values, 90) * scale,
+        "p99": percentile(values, 99) * scale,
+        "max": max(values) * scale,
+    }
+
+
+def create_controller(scenario):
+    """
+    Creates a controller on a simulated board and scripts a scenario against it.
+        Parameters:
+            scenario (callable): Function scripting the board and returning its duration
+        Returns:
+            tuple: The controller, the board and the scenario duration
+    """
+    clock = VirtualClock()
+    board = SimulatedBoard(clock)
+    controller = TrafficController(board, clock)
+    duration = scenario(board)
+    controller.setup_board()
+    controller.initialise_leds()
+    return controller, board, duration
+
+
+def measure_ticks(controller, board):
+    """
+    Wraps the controller's update() so the cost and serial traffic of every tick are recorded.
+        Parameters:
+            controller (TrafficController): Controller to instrument
+            board (SimulatedBoard): Board counting the outbound messages
+        Returns:
+            list of tuple: Filled with (seconds, messages, bytes, serial writes) per tick while the controller runs
+    """
+    ticks = []
+    update = controller.update
+
+    def timedUpdate():
+        messages, sent, writes = board.messagesSent, board.bytesSent, board.writes
+        startTime = time.perf_counter()
+        update()
+        elapsed = time.perf_counter() - startTime
+        ticks.append((elapsed, board.messagesSent - messages, board.bytesSent - sent, board.writes - writes))
+
+    controller.update = timedUpdate
+    return ticks
+
+
+def benchmark_scenario(scenario):
+    """
+    Runs a scenario and measures the cost and serial traffic of its ticks.
+        Parameters:
+            scenario (callable): Function scripting the board and returning its duration
+        Returns:
+            dict: Tick count, simulated time, per tick CPU time in microseconds and traffic
+    """
+    controller, board, duration = create_controller(scenario)
+    ticks = measure_ticks(controller, board)
+    controller.run(duration)
+
+    cpu = [tick[0] for tick in ticks]
+    messages = [tick[1] for tick in ticks]
+    sent = [tick[2] for tick in ticks]
+    writes = [tick[3] for tick in ticks]
+    driver = controller.outputDriver
+    return {
+        "ticks": len(ticks),
+        "simulatedSeconds": duration,
+        "tickCpuUs": summarise(cpu, 1e6),
+        "messagesPerTick": summarise(messages),
+        "bytesPerTick": summarise(sent),
+        "writesPerTick": summarise(writes),
+        "framesSent": driver.framesSent,
+        "ledMessages": driver.messagesSent,
+        "ledBytes": driver.bytesSent,
+        "totalCpuSeconds": sum(cpu),
+    }
+
+
+def measure_latency(trigger, target, onset):
+    """
+    Measures the time from a stimulus to the LEDs reaching a target state.
+        Parameters:
+            trigger (callable): Function scripting the stimulus on a board at a time
+            target (int): LEDs that must all be on
+            onset (float): Virtual time of the stimulus
+        Returns:
+            float or None: Latency in seconds, None if the state was not reached in time
+    """
+    def scenario(board):
+        trigger(board, onset)
+        return onset + latencyTimeout
+
+    controller, board, duration = create_controller(scenario)
+    controller.run(duration)
+    for frameTime, frame in board.frameLog:
+        if frameTime >= onset and frame & target == target:
+            return frameTime - onset
+    return None
+
+
+def benchmark_latency(trials, seed):
+    """
+    Measures trigger-to-signal latency for every subsystem with the stimulus at
+    random offsets from the controller's ticks.
+        Parameters:
+            trials (int): Number of runs per subsystem
+            seed (int): Seed of the random onsets, for repeatable results
+        Returns:
+            dict: Subsystem to latency statistics in seconds and the number of misses
+    """
+    generator = random.Random(seed)
+    results = {}
+    for name, (trigger, target) in latencyTriggers.items():
+        latencies = []
+        misses = 0
+        for _ in range(trials):
+            latency = measure_latency(trigger, target, 1.0 + generator.random())
+            if latency is None:
+                misses += 1
+            else:
+                latencies.append(latency)
+        results[name] = dict(summarise(latencies), trials=trials, misses=misses)
+    return results
+
+
+def run_benchmarks(trials=50, seed=0):
+    """
+    Runs the whole benchmark suite.
+        Parameters:
+            trials (int): Number of latency runs per subsystem
+            seed (int): Seed of the random latency onsets
+        Returns:
+            dict: Machine readable results
+    """
+    scenarioResults = {name: benchmark_scenario(scenario) for name, scenario in scenarios.items()}
+    latencyResults = benchmark_latency(trials, seed)
+
+    totalTicks = sum(result["ticks"] for result in scenarioResults.values())
+    totalCpu = sum(result["totalCpuSeconds"] for result in scenarioResults.values())
+    worstTick = max(result["tickCpuUs"]["max"] for result in scenarioResults.values()) / 1e6
+    worstBytes = max(result["bytesPerTick"]["max"] for result in scenarioResults.values())
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scenarios": scenarioResults,
+        "maxTickRate": {
+            # Ticks per second the decision logic sustains on average and in its worst tick
+            "cpuMean": totalTicks / totalCpu,
+            "cpuWorst": 1 / worstTick,
+            # Ticks per second the serial link sustains if every tick is as busy as the busiest one
+            "serialWorst": baudRate / bitsPerByte / worstBytes if worstBytes else None,
+        },
+        "latencySeconds": latencyResults,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the traffic controller against a simulated board.")
+    parser.add_argument("--trials", type=int, default=50, help="latency runs per subsystem")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random latency onsets")
+    parser.add_argument("--output", help="file to write the JSON results to instead of stdout")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.trials, args.seed)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,99 @@
+import math
+
+
+def half_period(now, interval):
+    """
+    Counts the half periods of a pattern from time zero.
+        Parameters:
+            now (float): Monotonic time
+            interval (float): Half period in seconds
+        Returns:
+            int: Index of the half period containing now
+    """
+    return math.floor(now / interval)
+
+
+class BlinkEngine:
+    """
+    Owns every flashing output on one phase-locked clock.
+
+    A subsystem declares that some LEDs of its layer are flashing with a pattern:
+    the LEDs lit in even half periods, the LEDs lit in odd ones and the half period.
+    Half periods are counted from time zero rather than from the declaration, so
+    every pattern with the same interval switches on the same instants and in step,
+    and faster patterns switch on every instant the slower ones do. update() renders
+    every declared pattern in one pass, so all the toggles due at an instant land in
+    the same frame and cost one flush and one wakeup instead of one per output.
+    """
+
+    def __init__(self):
+        """
+        Creates an engine without flashing outputs.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        # Name -> (layer, LEDs lit in even half periods, LEDs lit in odd ones, half period)
+        self.patterns = {}
+
+    def declare(self, name, layer, evenMask, oddMask, interval):
+        """
+        Makes LEDs of a layer flash, or keeps them flashing if the pattern is already declared.
+            Parameters:
+                name (str): Name of the pattern, e.g. the sequence declaring it
+                layer (LedLayer): Layer the LEDs are rendered into
+                evenMask (int): LEDs lit during even half periods
+                oddMask (int): LEDs lit during odd half periods
+                interval (float): Half period in seconds
+            Returns:
+                None
+        """
+        self.patterns[name] = (layer, evenMask, oddMask, interval)
+
+    def withdraw(self, name):
+        """
+        Stops a pattern, its LEDs keep the value they had and belong to their layer again.
+            Parameters:
+                name (str): Name of the pattern
+            Returns:
+                None
+        """
+        self.patterns.pop(name, None)
+
+    def flashing(self, name):
+        """
+        Checks whether a pattern is declared.
+            Parameters:
+                name (str): Name of the pattern
+            Returns:
+                bool: True while the pattern flashes
+        """
+        return name in self.patterns
+
+    def update(self, now):
+        """
+        Renders the half period every pattern is in at a given time into its layer.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                None
+        """
+        for layer, evenMask, oddMask, interval in self.patterns.values():
+            if half_period(now, interval) & 1:
+                layer.apply_mask(oddMask, evenMask & ~oddMask)
+            else:
+                layer.apply_mask(evenMask, oddMask & ~evenMask)
+
+    def next_deadline(self, now):
+        """
+        Returns the next instant at which a pattern switches.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                float or None: Monotonic time of the next half period boundary, None without patterns
+        """
+        if not self.patterns:
+            return None
+        return min((half_period(now, interval) + 1) * interval
+                   for _, _, _, interval in self.patterns.values())
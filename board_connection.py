@@ -0,0 +1,173 @@
+import json
+import os
+import time
+
+import serial
+from pymata4 import pymata4
+from pymata4.private_constants import PrivateConstants
+
+# File remembering the port and Firmata handshake of every intersection's board
+defaultCacheFile = "board_cache.json"
+
+# Seconds between identity queries while a board finishes its reset
+probeInterval = 0.1
+
+
+class BoardCache:
+    """
+    Remembers, per intersection, the serial port its board answered on and the
+    results of the Firmata handshake, so that the next connection can skip the
+    port scan and the analog map query.
+    """
+
+    def __init__(self, path=defaultCacheFile):
+        """
+        Loads the cache, starting empty if the file is missing or unreadable.
+            Parameters:
+                path (str): JSON file holding the cache
+            Returns:
+                None
+        """
+        self.path = path
+        try:
+            with open(path) as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, name):
+        """
+        Returns what is known about an intersection's board.
+            Parameters:
+                name (str): Intersection name
+            Returns:
+                dict or None: "comPort", "firmware" and "analogMap", None if never connected
+        """
+        return self.entries.get(name)
+
+    def store(self, name, board):
+        """
+        Records the port and handshake of a connected board and saves the cache.
+            Parameters:
+                name (str): Intersection name
+                board (Pymata4): Connected board
+            Returns:
+                None
+        """
+        self.entries[name] = {
+            "comPort": board.serial_port.port,
+            "firmware": board.query_reply_data.get(PrivateConstants.REPORT_FIRMWARE),
+            "analogMap": board.query_reply_data.get(PrivateConstants.ANALOG_MAPPING_RESPONSE),
+        }
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.entries, file, indent=2)
+        os.replace(temporary, self.path)
+
+
+class CachedPymata4(pymata4.Pymata4):
+    """
+    Pymata4 connection that opens a known port without waiting a fixed time.
+
+    Pymata4 sleeps arduino_wait seconds after opening a port before asking the board
+    for its identity. This connection asks every probeInterval instead and goes on as
+    soon as the board answers, which is immediately when the board was not reset by
+    the port being opened. The port is opened with DTR released so that reopening it
+    does not reset the board where the USB adapter allows it. The analog map is taken
+    from the cache when the board reports the cached firmware.
+    """
+
+    def __init__(self, com_port, arduino_instance_id=1, arduino_wait=4, analogMap=None,
+                 firmware=None, **kwargs):
+        """
+        Opens the port and runs the Firmata handshake.
+            Parameters:
+                com_port (str): Serial port of the board
+                arduino_instance_id (int): Identifier compiled into the board's FirmataExpress
+                arduino_wait (float): Longest wait in seconds for the board to answer
+                analogMap (list of int or None): Cached analog map of the board
+                firmware (str or None): Firmware the cached analog map belongs to
+                kwargs: Further Pymata4 arguments
+            Returns:
+                None
+        """
+        self.cachedAnalogMap = analogMap
+        self.cachedFirmware = firmware
+        super().__init__(com_port=com_port, arduino_instance_id=arduino_instance_id,
+                         arduino_wait=arduino_wait, **kwargs)
+
+    def _manual_open(self):
+        """
+        Opens the port and polls for the board's identity until it answers or arduino_wait passes.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        port = serial.Serial()
+        port.port = self.com_port
+        port.baudrate = self.baud_rate
+        port.timeout = probeInterval
+        port.write_timeout = 0
+        port.dtr = False
+        port.open()
+        self.serial_port = port
+
+        deadline = time.monotonic() + self.arduino_wait
+        while True:
+            port.reset_input_buffer()
+            self._send_sysex(PrivateConstants.ARE_YOU_THERE)
+            reply = list(port.read_until(b'\xf7'))
+            if len(reply) == 4 and reply[1] == PrivateConstants.I_AM_HERE:
+                if reply[2] != self.arduino_instance_id:
+                    port.close()
+                    raise RuntimeError('Invalid Arduino identifier retrieved')
+                port.timeout = 1
+                return
+            if time.monotonic() >= deadline:
+                port.close()
+                raise RuntimeError(f'No answer from the Arduino on {self.com_port}')
+
+    def get_analog_map(self):
+        """
+        Returns the cached analog map if the board runs the cached firmware, else queries it.
+            Parameters:
+                None
+            Returns:
+                list of int: Analog channel of every pin
+        """
+        firmware = self.query_reply_data.get(PrivateConstants.REPORT_FIRMWARE)
+        if self.cachedAnalogMap and firmware == self.cachedFirmware:
+            self.query_reply_data[PrivateConstants.ANALOG_MAPPING_RESPONSE] = self.cachedAnalogMap
+            return self.cachedAnalogMap
+        return super().get_analog_map()
+
+
+def connect_cached(config, cache):
+    """
+    Connects to an intersection's board, trying the cached port first and falling
+    back to the configured port or a port scan, then updates the cache.
+    Communication errors are raised rather than shutting the board down, so that a
+    supervisor can reconnect.
+        Parameters:
+            config (IntersectionConfig): Intersection to connect to
+            cache (BoardCache): Ports and handshakes of earlier connections
+        Returns:
+            Pymata4: The connected board
+    """
+    entry = cache.get(config.name)
+    board = None
+    if entry is not None and config.comPort in (None, entry["comPort"]):
+        try:
+            board = CachedPymata4(entry["comPort"], config.arduinoInstanceId, config.connectTimeout,
+                                  entry.get("analogMap"), entry.get("firmware"), shutdown_on_exception=False)
+        except (RuntimeError, OSError):
+            board = None
+    if board is None:
+        if config.comPort is not None:
+            board = CachedPymata4(config.comPort, config.arduinoInstanceId, config.connectTimeout,
+                                  shutdown_on_exception=False)
+        else:
+            board = pymata4.Pymata4(arduino_instance_id=config.arduinoInstanceId, shutdown_on_exception=False)
+    cache.store(config.name, board)
+    return board
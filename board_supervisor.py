@@ -0,0 +1,132 @@
+def board_alive(board):
+    """
+    Checks that a board's serial port is still open and present.
+        Parameters:
+            board (Pymata4): Board to check
+        Returns:
+            bool: False if the port was closed or the device has gone
+    """
+    if getattr(board, "shutdown_flag", False):
+        return False
+    port = getattr(board, "serial_port", None)
+    if port is None:
+        return True
+    try:
+        # Raises once the USB device has disappeared
+        port.in_waiting
+    except OSError:
+        return False
+    return port.is_open
+
+
+class BoardSupervisor:
+    """
+    Runs a controller and reconnects its board when the connection is lost.
+
+    A lost board shows as a failed write in the control loop, or, while the loop
+    only sleeps between deadlines, as a failed port check made every checkInterval.
+    The supervisor then opens a new connection and hands it to the controller,
+    which configures the pins again and immediately latches its current LED word
+    and buzzer tone. The sequences, timers and sensor filters carry on as they were.
+    """
+
+    # Errors raised by pymata4 and pyserial when the board stops answering
+    connectionErrors = (RuntimeError, OSError)
+
+    def __init__(self, controller, connect, checkInterval=0.25, retryInterval=0.2, probe=board_alive):
+        """
+        Creates a supervisor for a controller whose board is already connected.
+            Parameters:
+                controller (TrafficController): Controller to run
+                connect (callable): Opens and returns a new connection to the board
+                checkInterval (float): Seconds between port checks
+                retryInterval (float): Seconds between connection attempts
+                probe (callable): Returns False for a board whose connection is lost
+            Returns:
+                None
+        """
+        self.controller = controller
+        self.connect = connect
+        self.clock = controller.clock
+        self.checkInterval = checkInterval
+        self.retryInterval = retryInterval
+        self.probe = probe
+        self.nextCheck = 0.0
+
+        self.recoveries = 0
+        self.lastRecoveryTime = None
+
+        controller.metrics.add_source("traffic_board_recoveries_total", "counter",
+                                      "Reconnections to the board after it was lost", None,
+                                      lambda: self.recoveries)
+
+    def check(self):
+        """
+        Raises if the board's port has gone, at most once per checkInterval.
+        Installed as the controller's health check.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        now = self.clock.monotonic()
+        if now >= self.nextCheck:
+            self.nextCheck = now + self.checkInterval
+            if not self.probe(self.controller.board):
+                raise ConnectionError("board connection lost")
+
+    def run(self, duration=None):
+        """
+        Runs the controller, reconnecting the board whenever it is lost.
+            Parameters:
+                duration (float or None): Seconds of clock time to run for, forever if None
+            Returns:
+                None
+        """
+        controller = self.controller
+        controller.healthCheck = self.check
+        endTime = None if duration is None else self.clock.monotonic() + duration
+        while True:
+            try:
+                controller.run(None if endTime is None else endTime - self.clock.monotonic())
+                return
+            except self.connectionErrors as error:
+                if not self.recover(error):
+                    return
+
+    def recover(self, error):
+        """
+        Reconnects the board and restores the controller's outputs on it.
+            Parameters:
+                error (Exception): Error that showed the connection was lost
+            Returns:
+                bool: True once reconnected, False if the controller was stopped meanwhile
+        """
+        controller = self.controller
+        controller.events.log("boardLost", "board", str(error))
+        startTime = self.clock.monotonic()
+        try:
+            controller.board.shutdown()
+        except Exception:
+            pass
+
+        while controller.running:
+            board = None
+            try:
+                board = self.connect()
+                controller.attach_board(board)
+                break
+            except self.connectionErrors:
+                if board is not None:
+                    try:
+                        board.shutdown()
+                    except Exception:
+                        pass
+                self.clock.sleep(self.retryInterval)
+        else:
+            return False
+
+        self.recoveries += 1
+        self.lastRecoveryTime = self.clock.monotonic() - startTime
+        controller.events.log("boardRecovered", "board", round(self.lastRecoveryTime, 3))
+        return True
@@ -0,0 +1,240 @@
+import threading
+
+# Firmata command bytes the transport tells apart
+startSysex = 0xF0
+endSysex = 0xF7
+digitalMessage = 0x90
+reportAnalog = 0xC0
+setDigitalPinValue = 0xF5
+toneData = 0x5F
+samplingIntervalCommand = 0x7A
+
+# Length in bytes of the non-sysex Firmata messages, by command byte with the
+# channel nibble cleared for the channel messages
+messageLengths = {
+    0x90: 3,  # digital port message
+    0xC0: 2,  # report analog
+    0xD0: 2,  # report digital
+    0xE0: 3,  # analog (PWM) message
+    0xF4: 3,  # set pin mode
+    0xF5: 3,  # set digital pin value
+    0xF9: 1,  # report protocol version
+    0xFF: 1,  # system reset
+}
+
+
+def message_length(data, position):
+    """
+    Returns the length of the Firmata message starting at a position of a byte stream.
+        Parameters:
+            data (bytes): Byte stream
+            position (int): Index of the message's command byte
+        Returns:
+            int: Bytes in the message, the rest of the stream for an unknown or unterminated one
+    """
+    command = data[position]
+    if command == startSysex:
+        end = data.find(bytes([endSysex]), position)
+        return len(data) - position if end < 0 else end + 1 - position
+    length = messageLengths.get(command if command >= 0xF0 else command & 0xF0)
+    return len(data) - position if length is None else length
+
+
+def split_messages(data):
+    """
+    Splits a byte stream into Firmata messages.
+        Parameters:
+            data (bytes): Byte stream as written to the serial port
+        Returns:
+            list of bytes: The messages in order
+    """
+    messages = []
+    position = 0
+    while position < len(data):
+        length = message_length(data, position)
+        messages.append(data[position:position + length])
+        position += length
+    return messages
+
+
+def message_key(message, streamedPorts):
+    """
+    Names the output state a Firmata message sets, so a later message with the same
+    name supersedes it. Port messages to a streamed port are clock edges rather than
+    states and, like every other message, are never superseded.
+        Parameters:
+            message (bytes): One Firmata message
+            streamedPorts (set of int): Ports whose every message must reach the board
+        Returns:
+            tuple or None: Name of the state, None if the message must always be sent
+    """
+    command = message[0]
+    if command == startSysex and len(message) > 3:
+        if message[1] == toneData:
+            return ("tone", message[3])
+        if message[1] == samplingIntervalCommand:
+            return ("sampling",)
+        return None
+    channel = command & 0x0F
+    if command & 0xF0 == digitalMessage and channel not in streamedPorts:
+        return ("port", channel)
+    if command & 0xF0 == reportAnalog:
+        return ("reportAnalog", channel)
+    if command == setDigitalPinValue and len(message) > 1 and message[1] // 8 not in streamedPorts:
+        return ("pin", message[1])
+    return None
+
+
+class CoalescingTransport:
+    """
+    Stands in for the board's serial port and turns the writes of a tick into one.
+
+    Pymata4 writes every Firmata message to its serial port as soon as it is made, so
+    one tick of the controller costs a system call per pin toggle, tone and setting.
+    While the transport holds, it keeps the messages instead and flush() writes them
+    all with a single call, so every frame reaches the board at once. A message that
+    sets a state (a tone, the sampling interval, analog reporting or the level of a
+    port outside the shift register chain) replaces an earlier one for the same
+    state still waiting in the tick; messages on the shift register's port are clock
+    edges and are kept, in order. Outside a tick writes go straight to the port.
+
+    Pymata4's own threads write too, for instance while the actuation stage of a
+    pipeline flushes, so the kept messages and the port are only touched under a lock.
+    """
+
+    def __init__(self, streamedPorts=()):
+        """
+        Creates a transport without a port.
+            Parameters:
+                streamedPorts (iterable of int): Ports whose every message must reach the board
+            Returns:
+                None
+        """
+        # Serial port written to, None until attached to a board
+        self.serialPort = None
+        self.streamedPorts = set(streamedPorts)
+
+        # Messages of the current tick, None where a later one superseded it, and the
+        # position of the latest message for each state
+        self.pending = []
+        self.latest = {}
+        self.holding = False
+        self.lock = threading.Lock()
+
+        # Outbound traffic counters
+        self.messagesQueued = 0
+        self.messagesSuperseded = 0
+        self.messagesSent = 0
+        self.bytesSent = 0
+        self.writes = 0
+        self.flushes = 0
+
+    def attach(self, board):
+        """
+        Puts the transport between a board and its serial port. Messages of the
+        previous connection still waiting are dropped.
+            Parameters:
+                board (Pymata4): Board whose serial_port is wrapped, left alone if it has none
+            Returns:
+                None
+        """
+        self.discard()
+        port = getattr(board, "serial_port", None)
+        if port is None or port is self:
+            return
+        self.serialPort = port
+        board.serial_port = self
+
+    def hold(self):
+        """
+        Starts a tick: writes are kept until flush(), which must follow even if the
+        tick fails.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        with self.lock:
+            self.holding = True
+
+    def write(self, data):
+        """
+        Takes the bytes pymata4 writes to the serial port.
+            Parameters:
+                data (bytes): One or more Firmata messages
+            Returns:
+                int: Number of bytes accepted
+        """
+        messages = split_messages(data)
+        with self.lock:
+            if not self.holding:
+                self.send(data, len(messages))
+                return len(data)
+            for message in messages:
+                self.messagesQueued += 1
+                key = message_key(message, self.streamedPorts)
+                if key is not None:
+                    previous = self.latest.get(key)
+                    if previous is not None:
+                        self.pending[previous] = None
+                        self.messagesSuperseded += 1
+                    self.latest[key] = len(self.pending)
+                self.pending.append(message)
+        return len(data)
+
+    def flush(self):
+        """
+        Ends a tick: writes the messages kept since hold() in one call.
+            Parameters:
+                None
+            Returns:
+                int: Number of bytes written
+        """
+        with self.lock:
+            messages = [message for message in self.pending if message is not None]
+            self.pending = []
+            self.latest = {}
+            self.holding = False
+            if not messages:
+                return 0
+            self.flushes += 1
+            data = b"".join(messages)
+            try:
+                self.send(data, len(messages))
+            except OSError as error:
+                raise RuntimeError("write fail in flush") from error
+        return len(data)
+
+    def discard(self):
+        """
+        Drops the messages of the current tick and stops holding.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        with self.lock:
+            self.pending = []
+            self.latest = {}
+            self.holding = False
+
+    def send(self, data, messages):
+        """
+        Writes bytes to the serial port with one call.
+            Parameters:
+                data (bytes): Bytes to write
+                messages (int): Firmata messages in the bytes
+            Returns:
+                None
+        """
+        self.serialPort.write(data)
+        self.writes += 1
+        self.messagesSent += messages
+        self.bytesSent += len(data)
+
+    def __getattr__(self, name):
+        # Reads, port checks and settings go to the serial port itself
+        serialPort = self.__dict__.get("serialPort")
+        if serialPort is None:
+            raise AttributeError(name)
+        return getattr(serialPort, name)
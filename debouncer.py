@@ -0,0 +1,96 @@
+class Debouncer:
+    """
+    Turns a noisy reading into an on/off state with hysteresis in value and in time.
+
+    A reading asserts when it passes the on threshold and releases when it passes
+    the off threshold; readings between the two keep the current state. The state
+    only changes once the reading has kept asserting, or releasing, for the whole
+    assert or release window. The windows are measured on the clock rather than in
+    loop iterations, so the detection latency does not depend on how often the
+    loop runs, and next_deadline() tells the loop when to look again.
+    """
+
+    def __init__(self, assertMs, releaseMs, onThreshold, offThreshold, below=True):
+        """
+        Creates a debouncer in the released state.
+            Parameters:
+                assertMs (float): Milliseconds a reading must keep asserting to turn the state on
+                releaseMs (float): Milliseconds a reading must keep releasing to turn the state off
+                onThreshold (float): Value the reading must pass to assert
+                offThreshold (float): Value the reading must pass the other way to release
+                below (bool): True if readings under onThreshold assert, as for a distance,
+                    False if readings over it do, as for a button level
+            Returns:
+                None
+        """
+        self.assertTime = assertMs / 1000.0
+        self.releaseTime = releaseMs / 1000.0
+        self.onThreshold = onThreshold
+        self.offThreshold = offThreshold
+        self.below = below
+
+        self.active = False
+        # Time the reading started to ask for the other state, None while it does not
+        self.pendingSince = None
+        self.transitions = 0
+
+    def asserting(self, value):
+        """
+        Checks whether a reading asks for the on state. Missing readings and sonar
+        readings without an echo (0) never do.
+            Parameters:
+                value (float or None): Reading
+            Returns:
+                bool: True if the reading passes the on threshold
+        """
+        if not value:
+            return False
+        return value < self.onThreshold if self.below else value > self.onThreshold
+
+    def releasing(self, value):
+        """
+        Checks whether a reading asks for the off state.
+            Parameters:
+                value (float or None): Reading
+            Returns:
+                bool: True if the reading passes the off threshold or is missing
+        """
+        if not value:
+            return True
+        return value > self.offThreshold if self.below else value < self.offThreshold
+
+    def update(self, value, now):
+        """
+        Feeds a reading and returns the debounced state.
+            Parameters:
+                value (float or None): Latest reading
+                now (float): Current monotonic time
+            Returns:
+                bool: True while the state is on
+        """
+        if self.active:
+            changing, window = self.releasing(value), self.releaseTime
+        else:
+            changing, window = self.asserting(value), self.assertTime
+        if not changing:
+            self.pendingSince = None
+        else:
+            if self.pendingSince is None:
+                self.pendingSince = now
+            if now - self.pendingSince >= window:
+                self.active = not self.active
+                self.pendingSince = None
+                self.transitions += 1
+        return self.active
+
+    def next_deadline(self):
+        """
+        Returns the time at which a pending change of state completes.
+            Parameters:
+                None
+            Returns:
+                float or None: Monotonic time, None if no change is pending
+        """
+        if self.pendingSince is None:
+            return None
+        return self.pendingSince + (self.releaseTime if self.active else self.assertTime)
@@ -0,0 +1,324 @@
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import traffic_controller
+from simulated_board import SimulatedBoard, VirtualClock
+from traffic_controller import IntersectionConfig, TrafficController
+
+# Arrival rates and vehicle behaviour used unless overridden
+defaultDemand = {
+    # Vehicles per hour arriving at each approach
+    "roadVehiclesPerHour": 600.0,
+    "crossingVehiclesPerHour": 300.0,
+    # Share of the road vehicles that are overheight and drive past US1, US3 and US4
+    "overheightFraction": 0.01,
+    # Pedestrian button calls per hour, shared between PB1A and PB1B
+    "pedestriansPerHour": 30.0,
+    # Seconds between two vehicles leaving a queue on green
+    "saturationHeadway": 2.0,
+}
+
+# Signal whose green light serves each approach's queue
+approachSignals = {
+    "road": traffic_controller.tl1Green,
+    "crossing": traffic_controller.tl4Green,
+}
+
+# Path of an overheight vehicle: (trigger pin, seconds after reaching US1, seconds under the sensor),
+# every vehicle's times are scaled by a random factor between 0.5 and 1.5
+overheightPath = (
+    (traffic_controller.trigPin1, 0.0, 4.0),
+    (traffic_controller.trigPin3, 5.0, 10.0),
+    (traffic_controller.trigPin4, 16.0, 13.0),
+)
+
+# Sonar readings in cm of an overheight vehicle and of the empty road
+overheightCm = 12
+emptyRoadCm = 80
+
+# Longest sleep of the simulated controller, every input arrives as a callback and
+# every timing is a scheduler deadline so it need not wake up more often
+simulationIdleTimeout = 5.0
+
+# Resolution in seconds of the queue computation
+queueStep = 1.0
+
+
+def poisson_arrivals(generator, ratePerHour, duration):
+    """
+    Draws the times of a Poisson arrival process.
+        Parameters:
+            generator (numpy.random.Generator): Random source
+            ratePerHour (float): Mean arrivals per hour
+            duration (float): Seconds covered
+        Returns:
+            numpy.ndarray: Sorted arrival times in seconds
+    """
+    if ratePerHour <= 0:
+        return np.empty(0)
+    rate = ratePerHour / 3600.0
+    # Draw a few more gaps than expected and cut at the end of the period
+    count = int(rate * duration + 6 * np.sqrt(rate * duration) + 10)
+    times = np.cumsum(generator.exponential(1.0 / rate, count))
+    return times[times < duration]
+
+
+def generate_demand(demand, duration, seed):
+    """
+    Draws every vehicle and pedestrian of a simulated period.
+        Parameters:
+            demand (dict): Arrival rates and behaviour, see defaultDemand
+            duration (float): Seconds covered
+            seed (int): Seed of the random source
+        Returns:
+            dict: Arrival times per approach, the overheight vehicles with their time
+                scale, and the pedestrian calls with the button pressed
+    """
+    generator = np.random.default_rng(seed)
+    road = poisson_arrivals(generator, demand["roadVehiclesPerHour"], duration)
+    crossing = poisson_arrivals(generator, demand["crossingVehiclesPerHour"], duration)
+    overheight = road[generator.random(len(road)) < demand["overheightFraction"]]
+    pedestrians = poisson_arrivals(generator, demand["pedestriansPerHour"], duration)
+    return {
+        "arrivals": {"road": road, "crossing": crossing},
+        "overheight": overheight,
+        "overheightScale": generator.uniform(0.5, 1.5, len(overheight)),
+        "pedestrians": pedestrians,
+        "pedestrianButtons": generator.integers(0, 2, len(pedestrians)),
+    }
+
+
+def script_demand(board, demand):
+    """
+    Scripts the sensor changes of the overheight vehicles and pedestrian calls on a board.
+    Ordinary vehicles are invisible to the controller and only enter the queue model.
+        Parameters:
+            board (SimulatedBoard): Board to script
+            demand (dict): Demand drawn by generate_demand()
+        Returns:
+            None
+    """
+    for arrival, scale in zip(demand["overheight"].tolist(), demand["overheightScale"].tolist()):
+        for trigger, offset, dwell in overheightPath:
+            board.set_distance(trigger, overheightCm, at=arrival + offset * scale)
+            board.set_distance(trigger, emptyRoadCm, at=arrival + (offset + dwell) * scale)
+    buttons = (traffic_controller.pb1A, traffic_controller.pb1B)
+    for call, button in zip(demand["pedestrians"].tolist(), demand["pedestrianButtons"].tolist()):
+        board.press_button(buttons[button], at=call)
+
+
+def signal_timeline(frameLog, index, grid):
+    """
+    Samples one LED of the latched frames on a time grid.
+        Parameters:
+            frameLog (list of tuple): (time, frame) latched by the board
+            index (int): LED index
+            grid (numpy.ndarray): Sample times
+        Returns:
+            numpy.ndarray: 1 where the LED was lit, else 0
+    """
+    times = np.array([entry[0] for entry in frameLog])
+    frames = np.array([entry[1] for entry in frameLog], dtype=np.int64)
+    lit = (frames >> index) & 1
+    positions = np.searchsorted(times, grid, side="right") - 1
+    return np.where(positions >= 0, lit[np.maximum(positions, 0)], 0)
+
+
+def queue_kpis(arrivals, green, step, headway, duration):
+    """
+    Computes the queue of one approach served at saturation flow while its light is green.
+    The queue follows Lindley's recursion q[n] = max(0, q[n-1] + a[n] - c[n]), which has
+    the closed form q[n] = s[n] - min(0, min(s[:n+1])) over the running sum s of a - c.
+        Parameters:
+            arrivals (numpy.ndarray): Arrival times in seconds
+            green (numpy.ndarray): 1 for every grid step the light is green
+            step (float): Grid resolution in seconds
+            headway (float): Seconds between departures on green
+            duration (float): Seconds covered
+        Returns:
+            dict: Vehicle counts, delay and queue statistics
+    """
+    counts = np.bincount((arrivals // step).astype(np.int64), minlength=len(green))[:len(green)]
+    capacity = green * (step / headway)
+    total = np.cumsum(counts - capacity)
+    queue = total - np.minimum(np.minimum.accumulate(total), 0)
+    arrived = len(arrivals)
+    served = arrived - queue[-1] if len(queue) else 0.0
+    delay = queue.sum() * step
+    hours = duration / 3600.0
+    return {
+        "arrived": arrived,
+        "served": float(served),
+        "servedPerHour": float(served / hours),
+        "meanDelay": float(delay / arrived) if arrived else 0.0,
+        "meanQueue": float(queue.mean()) if len(queue) else 0.0,
+        "maxQueue": float(queue.max()) if len(queue) else 0.0,
+        "greenShare": float(green.mean()) if len(green) else 0.0,
+    }
+
+
+def pedestrian_kpis(calls, walkOnsets, walkEnds, duration):
+    """
+    Computes how long pedestrians wait for a walk phase after calling. A call made
+    while the walk lights are green is served by that walk phase without waiting.
+        Parameters:
+            calls (numpy.ndarray): Call times in seconds
+            walkOnsets (numpy.ndarray): Times the walk lights turned green
+            walkEnds (numpy.ndarray): Times they turned off again
+            duration (float): Seconds covered
+        Returns:
+            dict: Calls, pedestrians served and waiting time statistics
+    """
+    positions = np.searchsorted(walkOnsets, calls)
+    served = positions < len(walkOnsets)
+    waits = np.zeros(len(calls))
+    waits[served] = walkOnsets[positions[served]] - calls[served]
+
+    # End of each walk phase, infinite for one still running when the period ends
+    ends = np.append(walkEnds, np.inf)[np.searchsorted(walkEnds, walkOnsets)]
+    walking = positions > 0
+    walking[walking] = calls[walking] < ends[positions[walking] - 1]
+    waits[walking] = 0.0
+    served |= walking
+    waits = waits[served]
+    return {
+        "calls": len(calls),
+        "served": int(served.sum()),
+        "walkPhasesPerHour": len(walkOnsets) / (duration / 3600.0),
+        "meanWait": float(waits.mean()) if len(waits) else 0.0,
+        "p95Wait": float(np.percentile(waits, 95)) if len(waits) else 0.0,
+        "maxWait": float(waits.max()) if len(waits) else 0.0,
+    }
+
+
+def simulate(overrides=None, demand=None, hours=24.0, seed=0):
+    """
+    Drives the controller with a period of random traffic and measures the service it gives.
+        Parameters:
+            overrides (dict or None): IntersectionConfig fields to change, e.g. {"crossingLockout": 20}
+            demand (dict or None): Demand settings overriding defaultDemand
+            hours (float): Simulated period in hours
+            seed (int): Seed of the random traffic, equal seeds give equal traffic
+        Returns:
+            dict: Configuration, demand, KPIs per approach, pedestrian KPIs and run cost
+    """
+    overrides = overrides or {}
+    demand = dict(defaultDemand, **(demand or {}))
+    duration = hours * 3600.0
+    config = IntersectionConfig(**overrides)
+
+    clock = VirtualClock()
+    board = SimulatedBoard(clock)
+    controller = TrafficController(board, clock, config=config)
+    controller.scheduler.idleTimeout = simulationIdleTimeout
+    traffic = generate_demand(demand, duration, seed)
+    script_demand(board, traffic)
+
+    startTime = time.perf_counter()
+    controller.setup_board()
+    controller.initialise_leds()
+    controller.run(duration)
+    wallTime = time.perf_counter() - startTime
+
+    grid = np.arange(0.0, duration, queueStep)
+    approaches = {}
+    for name, signal in approachSignals.items():
+        green = signal_timeline(board.frameLog, signal, grid)
+        approaches[name] = queue_kpis(traffic["arrivals"][name], green, queueStep,
+                                      demand["saturationHeadway"], duration)
+
+    walk = signal_timeline(board.frameLog, traffic_controller.pl1AGreen, grid)
+    walkOnsets = grid[1:][np.diff(walk) > 0]
+    walkEnds = grid[1:][np.diff(walk) < 0]
+    return {
+        "overrides": overrides,
+        "demand": demand,
+        "hours": hours,
+        "seed": seed,
+        "overheightVehicles": len(traffic["overheight"]),
+        "approaches": approaches,
+        "pedestrians": pedestrian_kpis(traffic["pedestrians"], walkOnsets, walkEnds, duration),
+        "wallSeconds": wallTime,
+        "ticks": controller.scheduler.wakeups,
+    }
+
+
+def run_job(job):
+    """
+    Runs one simulation of a sweep, a top level function so worker processes can load it.
+        Parameters:
+            job (tuple): (overrides, demand, hours, seed)
+        Returns:
+            dict: Result of simulate()
+    """
+    return simulate(*job)
+
+
+def sweep(configurations, demand=None, hours=24.0, seed=0, processes=None):
+    """
+    Simulates several configurations in parallel on the same random traffic.
+        Parameters:
+            configurations (list of dict): IntersectionConfig overrides, one per run
+            demand (dict or None): Demand settings overriding defaultDemand
+            hours (float): Simulated period per run in hours
+            seed (int): Seed of the random traffic shared by every run
+            processes (int or None): Worker processes, one per CPU if None
+        Returns:
+            list of dict: Results in the order of the configurations
+    """
+    jobs = [(overrides, demand, hours, seed) for overrides in configurations]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(run_job, jobs))
+
+
+def parse_sweep(specs):
+    """
+    Expands "name=value,value" parameter lists into every combination of values.
+        Parameters:
+            specs (list of str): Parameter specifications, e.g. ["crossingLockout=10,20,30"]
+        Returns:
+            list of dict: IntersectionConfig overrides
+    """
+    configurations = [{}]
+    for spec in specs:
+        name, values = spec.split("=", 1)
+        if name not in IntersectionConfig._fields:
+            raise ValueError(f"unknown configuration field: {name}")
+        parsed = [json.loads(value) for value in values.split(",")]
+        configurations = [dict(configuration, **{name: value})
+                          for configuration in configurations for value in parsed]
+    return configurations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulates random traffic against the controller and "
+                                                 "reports throughput and delay.")
+    parser.add_argument("--hours", type=float, default=24.0, help="simulated period per configuration")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random traffic")
+    parser.add_argument("--demand", action="append", default=[], metavar="NAME=VALUE",
+                        help="demand setting, e.g. pedestriansPerHour=60")
+    parser.add_argument("--sweep", action="append", default=[], metavar="FIELD=V1,V2",
+                        help="configuration values to sweep, e.g. crossingLockout=10,20,30")
+    parser.add_argument("--processes", type=int, help="worker processes, one per CPU by default")
+    parser.add_argument("--output", help="file to write the JSON results to instead of stdout")
+    args = parser.parse_args()
+
+    demandOverrides = {}
+    for setting in args.demand:
+        name, value = setting.split("=", 1)
+        if name not in defaultDemand:
+            parser.error(f"unknown demand setting: {name}")
+        demandOverrides[name] = float(value)
+
+    results = sweep(parse_sweep(args.sweep), demandOverrides, args.hours, args.seed, args.processes)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,277 @@
+# Scale factor turning the median absolute deviation into a standard deviation estimate
+madScale = 1.4826
+
+# Smallest window on which the Hampel test is applied
+hampelMinSamples = 3
+
+
+def is_valid_distance(value):
+    """
+    Checks whether a sonar reading is a distance, pymata4 reports 0 when no echo came back.
+        Parameters:
+            value (float or None): Raw reading in cm
+        Returns:
+            bool: True if the reading can be filtered
+    """
+    return value is not None and value > 0
+
+
+def median(values):
+    """
+    Returns the median of a short list of numbers.
+        Parameters:
+            values (list of float): Numbers to take the median of, must not be empty
+        Returns:
+            float: The middle value, or the mean of the two middle values
+    """
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+class DistanceFilter:
+    """
+    Moving average over the last valid readings of one sonar.
+
+    Samples are kept in a fixed-size ring buffer with a running sum, so adding a sample
+    and reading the average cost the same whatever the window size. Samples older than
+    maxAge are expired, so a sensor that stops returning valid readings stops reporting
+    its last average after maxAge seconds. With a hampelThreshold, a sample further than
+    that many standard deviations (estimated from the median absolute deviation) from the
+    median of the window is replaced by the median before it enters the average.
+
+    observe() takes readings with the time the sensor reported them and only feeds
+    each report once, so the samples of a sensor that stopped reporting age out
+    instead of being fed again with the current time.
+    """
+
+    def __init__(self, windowSize=5, maxAge=None, hampelThreshold=None):
+        """
+        Creates an empty filter.
+            Parameters:
+                windowSize (int): Number of samples averaged
+                maxAge (float or None): Seconds after which a sample is dropped, never if None
+                hampelThreshold (float or None): Outlier threshold in standard deviations, disabled if None
+            Returns:
+                None
+        """
+        self.windowSize = windowSize
+        self.maxAge = maxAge
+        self.hampelThreshold = hampelThreshold
+
+        # Ring buffer of raw readings, the values entering the average and their times
+        self.rawValues = [0.0] * windowSize
+        self.values = [0.0] * windowSize
+        self.times = [0.0] * windowSize
+        self.head = 0
+        self.count = 0
+        self.total = 0.0
+
+        # Number of consecutive samples equal to the last one
+        self.lastRaw = None
+        self.runLength = 0
+
+        # Report time of the last reading fed through observe()
+        self.readingTime = None
+
+    def tail(self):
+        """
+        Returns the slot of the oldest sample.
+            Parameters:
+                None
+            Returns:
+                int: Index into the ring buffer
+        """
+        return (self.head - self.count) % self.windowSize
+
+    def expire(self, now):
+        """
+        Drops the samples older than maxAge.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                None
+        """
+        if self.maxAge is None:
+            return
+        limit = now - self.maxAge
+        while self.count and self.times[self.tail()] < limit:
+            self.total -= self.values[self.tail()]
+            self.count -= 1
+        if not self.count:
+            self.total = 0.0
+            self.lastRaw = None
+            self.runLength = 0
+
+    def push(self, value, now):
+        """
+        Adds a valid reading to the window.
+            Parameters:
+                value (float): Distance in cm
+                now (float): Time of the reading
+            Returns:
+                None
+        """
+        self.expire(now)
+        head = self.head
+        if self.count == self.windowSize:
+            self.total -= self.values[head]
+        else:
+            self.count += 1
+        self.rawValues[head] = value
+        self.times[head] = now
+
+        accepted = value
+        if self.hampelThreshold is not None and self.count >= hampelMinSamples:
+            window = [self.rawValues[(head - i) % self.windowSize] for i in range(self.count)]
+            centre = median(window)
+            deviation = median([abs(sample - centre) for sample in window])
+            if abs(value - centre) > self.hampelThreshold * madScale * deviation:
+                accepted = centre
+
+        self.values[head] = accepted
+        self.total += accepted
+        self.head = (head + 1) % self.windowSize
+
+        self.runLength = self.runLength + 1 if value == self.lastRaw else 1
+        self.lastRaw = value
+
+    def update(self, rawValue, now):
+        """
+        Feeds one reading through the filter, invalid readings only age the window.
+            Parameters:
+                rawValue (float or None): Latest reading from the sensor
+                now (float): Current monotonic time
+            Returns:
+                float or None: The filtered distance, or None if no valid sample is left
+        """
+        if is_valid_distance(rawValue):
+            self.push(rawValue, now)
+        else:
+            self.expire(now)
+        return self.mean()
+
+    def observe(self, rawValue, readingTime, now):
+        """
+        Feeds a reading the sensor reported at a given time, unless that report was
+        already fed, and ages the window to the current time.
+            Parameters:
+                rawValue (float or None): Latest reading from the sensor
+                readingTime (float): Time the sensor reported the reading
+                now (float): Current monotonic time
+            Returns:
+                float or None: The filtered distance, or None if no valid sample is left
+        """
+        if readingTime != self.readingTime:
+            self.readingTime = readingTime
+            if is_valid_distance(rawValue):
+                self.push(rawValue, readingTime)
+        self.expire(now)
+        return self.mean()
+
+    def mean(self):
+        """
+        Returns the average of the samples in the window.
+            Parameters:
+                None
+            Returns:
+                float or None: The filtered distance, or None if the window is empty
+        """
+        return self.total / self.count if self.count else None
+
+    def settled(self, rawValue):
+        """
+        Checks whether feeding the same reading again would leave the output unchanged.
+            Parameters:
+                rawValue (float or None): Latest reading from the sensor
+            Returns:
+                bool: True if every sample in the window is this reading, or the window is
+                    empty for an invalid one
+        """
+        if not is_valid_distance(rawValue):
+            return self.count == 0
+        if self.lastRaw != rawValue or self.runLength < self.count:
+            return False
+        # Outlier rejection may have replaced the first readings of the run by the median
+        return all(self.values[(self.head - 1 - i) % self.windowSize] == rawValue for i in range(self.count))
+
+    def next_expiry(self):
+        """
+        Returns the time at which the oldest sample leaves the window.
+            Parameters:
+                None
+            Returns:
+                float or None: Monotonic time, None if nothing expires
+        """
+        if self.maxAge is None or not self.count:
+            return None
+        return self.times[self.tail()] + self.maxAge
+
+
+    def next_change(self):
+        """
+        Returns the time at which expiry next changes the filtered distance: when the
+        newest sample leaves the window if every sample in it has the same value, since
+        the others leaving do not move the average, when the oldest leaves otherwise.
+            Parameters:
+                None
+            Returns:
+                float or None: Monotonic time, None if nothing expires
+        """
+        if self.maxAge is None or not self.count:
+            return None
+        newest = (self.head - 1) % self.windowSize
+        if all(self.values[(newest - i) % self.windowSize] == self.values[newest] for i in range(self.count)):
+            return self.times[newest] + self.maxAge
+        return self.times[self.tail()] + self.maxAge
+
+
+def filter_trace(values, times, windowSize=5, maxAge=None, hampelThreshold=None):
+    """
+    Filters a whole recorded trace of one sonar in one call with NumPy. Gives the same
+    output as feeding every reading through DistanceFilter.update() in order.
+        Parameters:
+            values (array-like of float): Raw readings in cm, 0 or NaN for invalid readings
+            times (array-like of float): Time of each reading, non-decreasing
+            windowSize (int): Number of samples averaged
+            maxAge (float or None): Seconds after which a sample is dropped, never if None
+            hampelThreshold (float or None): Outlier threshold in standard deviations, disabled if None
+        Returns:
+            numpy.ndarray: Filtered distance after each reading, NaN where no valid sample is left
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    values = np.asarray(values, dtype=float)
+    times = np.asarray(times, dtype=float)
+    valid = values > 0
+    samples = values[valid]
+    sampleTimes = times[valid]
+
+    accepted = samples
+    if hampelThreshold is not None and len(samples):
+        # Trailing window of raw samples for every sample, padded at the start
+        window = sliding_window_view(np.concatenate([np.full(windowSize - 1, np.nan), samples]), windowSize)
+        if maxAge is not None:
+            windowTimes = sliding_window_view(
+                np.concatenate([np.full(windowSize - 1, -np.inf), sampleTimes]), windowSize)
+            window = np.where(windowTimes >= (sampleTimes - maxAge)[:, None], window, np.nan)
+        counts = np.count_nonzero(~np.isnan(window), axis=1)
+        centre = np.nanmedian(window, axis=1)
+        deviation = np.nanmedian(np.abs(window - centre[:, None]), axis=1)
+        outlier = (counts >= hampelMinSamples) & (np.abs(samples - centre) > hampelThreshold * madScale * deviation)
+        accepted = np.where(outlier, centre, samples)
+
+    filtered = np.full(len(values), np.nan)
+    if len(samples):
+        sums = np.concatenate([[0.0], np.cumsum(accepted)])
+        end = np.cumsum(valid)
+        start = np.maximum(end - windowSize, 0)
+        if maxAge is not None:
+            start = np.maximum(start, np.searchsorted(sampleTimes, times - maxAge, side="left"))
+        count = end - start
+        present = count > 0
+        filtered[present] = (sums[end[present]] - sums[start[present]]) / count[present]
+    return filtered
@@ -0,0 +1,217 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+# Records waiting for the writer beyond which new records are dropped rather than queued
+defaultMaxPending = 10000
+
+# Records written to the file in one batch
+defaultBatchSize = 256
+
+
+class EventLog:
+    """
+    Structured event log that never blocks the control loop.
+
+    The loop calls log() with an event type, the subsystem and an optional value.
+    The call only takes the two clock readings and puts a tuple on a queue. A
+    background thread formats the records as JSON lines, writes them in batches to
+    a size-rotated file and optionally echoes the messages to the console.
+
+    Event types listed in rateLimits are written at most once per interval while
+    they repeat with the same value; the next record written says how many were
+    suppressed. With an event_store.EventStore, the writer thread also appends
+    every record to it, including records logged for the store only.
+    """
+
+    def __init__(self, clock, path=None, echo=False, messages=None, rateLimits=None,
+                 maxBytes=1000000, backupCount=5, maxPending=defaultMaxPending, batchSize=defaultBatchSize,
+                 source=None, store=None):
+        """
+        Creates the log and starts its writer thread if it has anywhere to write.
+            Parameters:
+                clock (RealClock or VirtualClock): Clock providing time() and monotonic()
+                path (str or None): File to write JSON lines to, no file if None
+                echo (bool): Also print each message to the console
+                messages (dict or None): (event type, subsystem) to message template, the
+                    template may use {value} and {wall}
+                rateLimits (dict or None): Event type to minimum seconds between repeated records
+                maxBytes (int): Size at which the file is rotated
+                backupCount (int): Number of rotated files kept
+                maxPending (int): Queued records beyond which new records are dropped
+                batchSize (int): Largest number of records written at once
+                source (str or None): Name of the intersection, added to every record and message
+                store (EventStore or None): Columnar store receiving every record
+            Returns:
+                None
+        """
+        self.clock = clock
+        self.path = path
+        self.echo = echo
+        self.messages = messages if messages is not None else {}
+        self.rateLimits = rateLimits if rateLimits is not None else {}
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.maxPending = maxPending
+        self.batchSize = batchSize
+        self.source = source
+        self.store = store
+
+        self.queue = queue.SimpleQueue()
+        self.enabled = path is not None or echo or store is not None
+
+        # (event type, subsystem) to [time last written, value, records suppressed since]
+        self.lastWritten = {}
+
+        self.logged = 0
+        self.suppressed = 0
+        self.dropped = 0
+
+        self.file = None
+        self.thread = None
+        if self.enabled:
+            if path is not None:
+                self.file = open(path, "a")
+            self.thread = threading.Thread(target=self.write_loop, name="eventLog", daemon=True)
+            self.thread.start()
+
+    def log(self, eventType, subsystem, value=None, storeOnly=False):
+        """
+        Queues an event for the writer thread.
+            Parameters:
+                eventType (str): Kind of event, e.g. "overheightDetected"
+                subsystem (str): Subsystem reporting the event, e.g. "s1"
+                value (float, str or None): Measurement or detail attached to the event
+                storeOnly (bool): Only append the event to the store, for events too
+                    frequent for the file and the console such as phase changes
+            Returns:
+                None
+        """
+        if not self.enabled or (storeOnly and self.store is None):
+            return
+        now = self.clock.monotonic()
+        suppressedBefore = 0
+        interval = self.rateLimits.get(eventType)
+        if interval is not None:
+            key = (eventType, subsystem)
+            last = self.lastWritten.get(key)
+            if last is not None and last[1] == value and now - last[0] < interval:
+                last[2] += 1
+                self.suppressed += 1
+                return
+            if last is not None:
+                suppressedBefore = last[2]
+            self.lastWritten[key] = [now, value, 0]
+
+        if self.queue.qsize() >= self.maxPending:
+            self.dropped += 1
+            return
+        self.logged += 1
+        self.queue.put((eventType, subsystem, value, now, self.clock.time(), suppressedBefore, storeOnly))
+
+    def format_record(self, record):
+        """
+        Formats a record as a JSON line and a console message.
+            Parameters:
+                record (tuple): Record queued by log()
+            Returns:
+                tuple: The JSON line and the message
+        """
+        eventType, subsystem, value, monotonic, wall, suppressedBefore = record[:6]
+        wallText = time.strftime("%H:%M:%S on %d-%m-%Y", time.localtime(wall))
+        template = self.messages.get((eventType, subsystem), "{type} ({subsystem})")
+        message = template.format(value=value, wall=wallText, type=eventType, subsystem=subsystem)
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(wall)) + f".{int(wall % 1 * 1000):03d}",
+            "monotonic": round(monotonic, 6),
+            "type": eventType,
+            "subsystem": subsystem,
+            "message": message,
+        }
+        if self.source is not None:
+            entry["source"] = self.source
+            message = f"[{self.source}] {message}"
+        if value is not None:
+            entry["value"] = value
+        if suppressedBefore:
+            entry["suppressed"] = suppressedBefore
+        return json.dumps(entry), message
+
+    def write_loop(self):
+        """
+        Writer thread: waits for records and writes them in batches until closed.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            for record in batch:
+                if record is None:
+                    running = False
+                    continue
+                if self.store is not None:
+                    self.store.append(record[4], record[0], record[1], record[2])
+                    if record[6]:
+                        continue
+                line, message = self.format_record(record)
+                lines.append(line)
+                if self.echo:
+                    print(message)
+
+            if self.file is not None and lines:
+                self.file.write("\n".join(lines) + "\n")
+                self.file.flush()
+                if self.file.tell() >= self.maxBytes:
+                    self.rotate()
+        if self.echo:
+            sys.stdout.flush()
+
+    def rotate(self):
+        """
+        Moves the current file to path.1, shifting older files up to backupCount.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.file.close()
+        for index in range(self.backupCount - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backupCount > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "a")
+
+    def close(self):
+        """
+        Writes every queued record and stops the writer thread.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.store is not None:
+            self.store.close()
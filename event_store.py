@@ -0,0 +1,436 @@
+import argparse
+import glob
+import json
+import math
+import mmap
+import os
+import struct
+import time
+
+# Partition file header: magic, format version, capacity in records, partition start in
+# seconds since the epoch, then the number of records written, updated after each append
+headerStruct = struct.Struct("<8sHId")
+countStruct = struct.Struct("<I")
+storeMagic = b"TREVSTOR"
+storeVersion = 1
+countOffset = headerStruct.size
+headerSize = 64
+
+# Columns of a partition file, stored one after the other: wall clock time, numeric value
+# (NaN without one), event type code, subsystem code and label code of a text value (0
+# without one), codes index the catalog
+columns = (("time", "<f8", 8), ("value", "<f8", 8), ("type", "<u2", 2), ("subsystem", "<u1", 1),
+           ("label", "<u2", 2))
+
+# Seconds covered by a partition and records a partition file holds before another
+# segment of the same partition is started
+defaultPartitionSeconds = 86400
+defaultCapacity = 65536
+
+# File holding the names behind the type, subsystem and label codes
+catalogFile = "catalog.json"
+
+
+def column_offsets(capacity):
+    """
+    Returns where each column starts in a partition file.
+        Parameters:
+            capacity (int): Records per partition file
+        Returns:
+            dict: Column name to (offset, NumPy dtype)
+    """
+    offsets = {}
+    offset = headerSize
+    for name, dtype, size in columns:
+        offsets[name] = (offset, dtype)
+        offset += size * capacity
+    return offsets
+
+
+def partition_size(capacity):
+    """
+    Returns the size of a partition file.
+        Parameters:
+            capacity (int): Records per partition file
+        Returns:
+            int: Size in bytes
+    """
+    return headerSize + sum(size for _, _, size in columns) * capacity
+
+
+class EventStore:
+    """
+    Append-only columnar store of controller events, memory mapped and partitioned by time.
+
+    Each partition covers partitionSeconds of wall clock time and is a file of
+    fixed capacity holding every column in one contiguous block, so appending
+    writes a few bytes into the mapping and a query maps the files it needs and
+    reads whole columns without parsing. The partition file names are the coarse
+    time index; within a partition the time column is sorted, so a time window is
+    two binary searches. Event types, subsystems and text values are stored as
+    codes listed in a small catalog next to the partitions.
+
+    One process appends, normally the event log's writer thread; any number of
+    readers may query at the same time.
+    """
+
+    def __init__(self, root, partitionSeconds=defaultPartitionSeconds, capacity=defaultCapacity):
+        """
+        Opens a store, creating its directory if needed.
+            Parameters:
+                root (str): Directory holding the partitions and the catalog
+                partitionSeconds (int): Wall clock seconds covered by a partition
+                capacity (int): Records per partition file
+            Returns:
+                None
+        """
+        self.root = root
+        self.partitionSeconds = partitionSeconds
+        self.capacity = capacity
+        os.makedirs(root, exist_ok=True)
+
+        self.catalogPath = os.path.join(root, catalogFile)
+        self.catalog = self.load_catalog()
+        self.codes = {kind: {name: code for code, name in enumerate(names)}
+                      for kind, names in self.catalog.items()}
+
+        # Partition file being appended to
+        self.file = None
+        self.map = None
+        self.partitionStart = None
+        self.segment = 0
+        self.records = 0
+        self.offsets = column_offsets(capacity)
+        self.lastTime = float("-inf")
+
+        self.appended = 0
+
+    def load_catalog(self):
+        """
+        Reads the catalog of codes, starting empty if there is none yet.
+            Parameters:
+                None
+            Returns:
+                dict: "types", "subsystems" and "labels" to the list of names, the
+                    position in the list is the code; label code 0 means no label
+        """
+        try:
+            with open(self.catalogPath) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {"types": [], "subsystems": [], "labels": [None]}
+
+    def code(self, kind, name):
+        """
+        Returns the code of a name, adding it to the catalog if it is new.
+            Parameters:
+                kind (str): "types", "subsystems" or "labels"
+                name (str): Name to encode
+            Returns:
+                int: The code
+        """
+        codes = self.codes[kind]
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(self.catalog[kind])
+            self.catalog[kind].append(name)
+            temporary = self.catalogPath + ".tmp"
+            with open(temporary, "w") as file:
+                json.dump(self.catalog, file)
+            os.replace(temporary, self.catalogPath)
+        return code
+
+    def partition_path(self, partitionStart, segment):
+        """
+        Returns the file name of a partition segment.
+            Parameters:
+                partitionStart (int): Start of the partition in seconds since the epoch
+                segment (int): Segment number within the partition
+            Returns:
+                str: Path of the file
+        """
+        return os.path.join(self.root, f"events-{partitionStart:010d}-{segment:03d}.col")
+
+    def create_partition(self, partitionStart, segment):
+        """
+        Creates an empty partition segment, sparse until records are written.
+            Parameters:
+                partitionStart (int): Start of the partition in seconds since the epoch
+                segment (int): Segment number within the partition
+            Returns:
+                None
+        """
+        with open(self.partition_path(partitionStart, segment), "wb") as file:
+            file.write(headerStruct.pack(storeMagic, storeVersion, self.capacity, partitionStart))
+            file.write(countStruct.pack(0))
+            file.truncate(partition_size(self.capacity))
+
+    def open_partition(self, partitionStart):
+        """
+        Maps the last segment of a partition for appending, creating it if needed.
+            Parameters:
+                partitionStart (int): Start of the partition in seconds since the epoch
+            Returns:
+                None
+        """
+        self.close()
+        segment = 0
+        while os.path.exists(self.partition_path(partitionStart, segment + 1)):
+            segment += 1
+        path = self.partition_path(partitionStart, segment)
+        if not os.path.exists(path):
+            self.create_partition(partitionStart, segment)
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, version, capacity, _ = headerStruct.unpack_from(self.map, 0)
+        if magic != storeMagic or version != storeVersion:
+            raise ValueError(f"{path} is not a version {storeVersion} event store partition")
+        self.capacity = capacity
+        self.offsets = column_offsets(capacity)
+        self.partitionStart = partitionStart
+        self.segment = segment
+        self.records = countStruct.unpack_from(self.map, countOffset)[0]
+        if self.records:
+            self.lastTime = max(self.lastTime, struct.unpack_from(
+                "<d", self.map, self.offsets["time"][0] + 8 * (self.records - 1))[0])
+
+    def append(self, wall, eventType, subsystem, value=None):
+        """
+        Appends one event. Times are kept in order, an event stamped before the
+        previous one, as after a wall clock step back, is stored at the previous time.
+            Parameters:
+                wall (float): Wall clock time of the event in seconds since the epoch
+                eventType (str): Kind of event, e.g. "overheightDetected"
+                subsystem (str): Subsystem reporting the event, e.g. "s1"
+                value (float, str or None): Measurement or detail attached to the event
+            Returns:
+                None
+        """
+        wall = max(wall, self.lastTime)
+        partitionStart = int(wall // self.partitionSeconds * self.partitionSeconds)
+        if partitionStart != self.partitionStart:
+            self.open_partition(partitionStart)
+            wall = max(wall, self.lastTime)
+        if self.records >= self.capacity:
+            self.create_partition(partitionStart, self.segment + 1)
+            self.open_partition(partitionStart)
+
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            number, label = float(value), 0
+        elif value is None:
+            number, label = math.nan, 0
+        else:
+            number, label = math.nan, self.code("labels", str(value))
+
+        index = self.records
+        offsets = self.offsets
+        struct.pack_into("<d", self.map, offsets["time"][0] + 8 * index, wall)
+        struct.pack_into("<d", self.map, offsets["value"][0] + 8 * index, number)
+        struct.pack_into("<H", self.map, offsets["type"][0] + 2 * index, self.code("types", eventType))
+        struct.pack_into("<B", self.map, offsets["subsystem"][0] + index, self.code("subsystems", subsystem))
+        struct.pack_into("<H", self.map, offsets["label"][0] + 2 * index, label)
+        # The count is written last, so a reader never sees a record being written
+        self.records += 1
+        countStruct.pack_into(self.map, countOffset, self.records)
+        self.lastTime = wall
+        self.appended += 1
+
+    def close(self):
+        """
+        Flushes and unmaps the partition being appended to.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.partitionStart = None
+
+    def partitions(self, start=None, end=None):
+        """
+        Lists the partition files overlapping a time window, oldest first.
+            Parameters:
+                start (float or None): Window start in seconds since the epoch, unbounded if None
+                end (float or None): Window end, exclusive, unbounded if None
+            Returns:
+                list of str: Paths of the partition files
+        """
+        paths = []
+        for path in sorted(glob.glob(os.path.join(self.root, "events-*-*.col"))):
+            partitionStart = int(os.path.basename(path).split("-")[1])
+            if end is not None and partitionStart >= end:
+                continue
+            if start is not None and partitionStart + self.partitionSeconds <= start:
+                continue
+            paths.append(path)
+        return paths
+
+    def window(self, start=None, end=None):
+        """
+        Reads every column of the events in a time window.
+            Parameters:
+                start (float or None): Window start in seconds since the epoch, unbounded if None
+                end (float or None): Window end, exclusive, unbounded if None
+            Returns:
+                dict: Column name to NumPy array, one entry per event in time order
+        """
+        import numpy as np
+
+        parts = {name: [] for name, _, _ in columns}
+        for path in self.partitions(start, end):
+            with open(path, "rb") as file:
+                if os.fstat(file.fileno()).st_size < partition_size(1):
+                    continue
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            _, _, capacity, _ = headerStruct.unpack_from(mapped, 0)
+            count = countStruct.unpack_from(mapped, countOffset)[0]
+            offsets = column_offsets(capacity)
+            times = np.frombuffer(mapped, dtype="<f8", count=count, offset=offsets["time"][0])
+            low = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+            high = count if end is None else int(np.searchsorted(times, end, side="left"))
+            del times
+            # Copy the window out of the mapping so it can be closed
+            for name, (offset, dtype) in offsets.items():
+                itemSize = np.dtype(dtype).itemsize
+                parts[name].append(np.frombuffer(mapped, dtype=dtype, count=high - low,
+                                                 offset=offset + low * itemSize).copy())
+            mapped.close()
+        return {name: np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+                for (name, dtype, _), arrays in zip(columns, parts.values())}
+
+    def select(self, eventType, subsystem=None, start=None, end=None):
+        """
+        Reads the events of one type in a time window.
+            Parameters:
+                eventType (str): Kind of event
+                subsystem (str or None): Subsystem reporting it, any if None
+                start (float or None): Window start in seconds since the epoch, unbounded if None
+                end (float or None): Window end, exclusive, unbounded if None
+            Returns:
+                dict: Column name to NumPy array of the matching events
+        """
+        self.catalog = self.load_catalog()
+        data = self.window(start, end)
+        if eventType not in self.catalog["types"]:
+            return {name: column[:0] for name, column in data.items()}
+        match = data["type"] == self.catalog["types"].index(eventType)
+        if subsystem is not None:
+            code = self.catalog["subsystems"].index(subsystem) if subsystem in self.catalog["subsystems"] else -1
+            match &= data["subsystem"] == code
+        return {name: column[match] for name, column in data.items()}
+
+    def count(self, eventType, subsystem=None, start=None, end=None):
+        """
+        Counts the events of one type in a time window.
+            Parameters:
+                eventType (str): Kind of event
+                subsystem (str or None): Subsystem reporting it, any if None
+                start (float or None): Window start in seconds since the epoch, unbounded if None
+                end (float or None): Window end, exclusive, unbounded if None
+            Returns:
+                int: Number of events
+        """
+        return len(self.select(eventType, subsystem, start, end)["time"])
+
+    def count_per(self, eventType, bucketSeconds, start, end, subsystem=None):
+        """
+        Counts the events of one type in consecutive buckets, e.g. per hour.
+            Parameters:
+                eventType (str): Kind of event
+                bucketSeconds (float): Length of a bucket
+                start (float): Start of the first bucket in seconds since the epoch
+                end (float): End of the last bucket, exclusive
+                subsystem (str or None): Subsystem reporting it, any if None
+            Returns:
+                tuple: NumPy arrays of the bucket starts and of the counts
+        """
+        import numpy as np
+
+        times = self.select(eventType, subsystem, start, end)["time"]
+        buckets = int(math.ceil((end - start) / bucketSeconds))
+        counts = np.bincount(((times - start) // bucketSeconds).astype(np.int64), minlength=buckets)[:buckets]
+        return start + np.arange(buckets) * bucketSeconds, counts
+
+    def values(self, eventType, subsystem=None, start=None, end=None):
+        """
+        Reads the measurements attached to the events of one type, e.g. vehicle heights.
+            Parameters:
+                eventType (str): Kind of event
+                subsystem (str or None): Subsystem reporting it, any if None
+                start (float or None): Window start in seconds since the epoch, unbounded if None
+                end (float or None): Window end, exclusive, unbounded if None
+            Returns:
+                tuple: NumPy arrays of the event times and of the values
+        """
+        selected = self.select(eventType, subsystem, start, end)
+        return selected["time"], selected["value"]
+
+    def durations(self, startType, endType, subsystem=None, start=None, end=None):
+        """
+        Measures intervals opened by one event type and closed by the next event of
+        another, e.g. from "overrideStart" to "overrideRelease".
+            Parameters:
+                startType (str): Event opening an interval
+                endType (str): Event closing it
+                subsystem (str or None): Subsystem reporting both, any if None
+                start (float or None): Window start in seconds since the epoch, unbounded if None
+                end (float or None): Window end, exclusive, unbounded if None
+            Returns:
+                numpy.ndarray: Seconds of every interval that opened in the window and closed
+        """
+        import numpy as np
+
+        opened = self.select(startType, subsystem, start, end)["time"]
+        closed = self.select(endType, subsystem, start, None)["time"]
+        following = np.searchsorted(closed, opened, side="right")
+        complete = following < len(closed)
+        return closed[following[complete]] - opened[complete]
+
+    def phase_durations(self, sequence, phase, start=None, end=None):
+        """
+        Measures how long a light sequence stayed in a phase each time it entered it,
+        from the "phaseEntered" events the controller records.
+            Parameters:
+                sequence (str): Sequence name, e.g. "s1"
+                phase (int): Phase index, e.g. 2 for the all-red hold of Subsystem 1
+                start (float or None): Window start in seconds since the epoch, unbounded if None
+                end (float or None): Window end, exclusive, unbounded if None
+            Returns:
+                numpy.ndarray: Seconds of every stay that began in the window and ended
+        """
+        selected = self.select("phaseEntered", sequence, start, None)
+        times, phases = selected["time"], selected["value"]
+        stays = (phases[:-1] == phase)
+        if end is not None:
+            stays &= times[:-1] < end
+        return times[1:][stays] - times[:-1][stays]
+
+
+if __name__ == "__main__":
+    # Summarises a store for operations: overheight vehicles per hour, Subsystem 1
+    # closures and pedestrian calls held back by the crossing lockout
+    parser = argparse.ArgumentParser(description="Summarises the events of an intersection's event store.")
+    parser.add_argument("root", help="directory of the event store")
+    parser.add_argument("--days", type=float, default=1.0, help="days before now to summarise")
+    args = parser.parse_args()
+
+    store = EventStore(args.root)
+    end = time.time()
+    start = end - args.days * 86400
+    _, perHour = store.count_per("overheightDetected", 3600, start, end, "s1")
+    _, heights = store.values("overheightDetected", "s1", start, end)
+    closures = store.phase_durations("s1", 2, start, end)
+    print(f"Overheight vehicles: {int(perHour.sum())}, at most {int(perHour.max(initial=0))} in an hour")
+    if len(heights):
+        print(f"Vehicle height: mean {heights.mean():.2f} m, max {heights.max():.2f} m")
+    if len(closures):
+        print(f"Subsystem 1 closures: {len(closures)}, mean {closures.mean():.1f} s, max {closures.max():.1f} s")
+    print(f"Tunnel holds: {store.count('tunnelHold', 's4', start, end)}")
+    print(f"Pedestrian calls: {store.count('buttonPressed', 's2', start, end)}, "
+          f"{store.count('callLatched', 's2', start, end)} held back by the lockout")
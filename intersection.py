@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+
+from board_supervisor import BoardSupervisor
+from event_store import EventStore
+from metrics import MetricsServer
+from sensor_trace import TraceRecorder
+from state_stream import StateStreamServer
+from traffic_controller import IntersectionConfig, RealClock, TrafficController, create_event_log
+
+
+def load_configs(path):
+    """
+    Reads the intersections of a deployment from a JSON file holding a list of
+    objects, each overriding any of the IntersectionConfig defaults, for example
+    [{"name": "north", "comPort": "/dev/ttyACM0", "metricsPort": 9108, "maxHeight": 0.25}].
+        Parameters:
+            path (str): Configuration file
+        Returns:
+            list of IntersectionConfig: One configuration per intersection
+    """
+    with open(path) as file:
+        entries = json.load(file)
+    configs = [IntersectionConfig(**entry) for entry in entries]
+    names = [config.name for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{path}: intersection names must be unique")
+    ports = [config.metricsPort for config in configs if config.metricsPort]
+    if len(set(ports)) != len(ports):
+        raise ValueError(f"{path}: every intersection needs its own metricsPort, or 0 to disable it")
+    streams = [config.streamPort for config in configs if config.streamPort]
+    streams += [config.streamSocket for config in configs if config.streamSocket]
+    if len(set(streams)) != len(streams):
+        raise ValueError(f"{path}: every intersection needs its own streamPort or streamSocket")
+    return configs
+
+
+def connect_board(config):
+    """
+    Opens the Firmata connection to an intersection's board, on the port it was last
+    found on if it is in the board cache.
+        Parameters:
+            config (IntersectionConfig): Intersection to connect to
+        Returns:
+            Pymata4: The connected board
+    """
+    from board_connection import BoardCache, connect_cached
+
+    return connect_cached(config, BoardCache(config.boardCacheFile))
+
+
+class Intersection:
+    """
+    One controller with its board, event log, event store, trace recorder, metrics endpoint
+    and state stream.
+    The controller runs under a BoardSupervisor, so a board that is unplugged or
+    resets is reconnected without restarting the intersection.
+    """
+
+    def __init__(self, config, board=None, clock=None, record=True, echo=True, connect=None):
+        """
+        Creates the controller of an intersection, connecting to its board if none is given.
+            Parameters:
+                config (IntersectionConfig): Pins, thresholds and timings of the intersection
+                board (Pymata4 or None): Connected board, opened from the configuration if None
+                clock (RealClock or VirtualClock or None): Time source, defaults to the wall clock
+                record (bool): Write the event log and a sensor trace to files named after the intersection
+                echo (bool): Print the intersection's events to the console
+                connect (callable or None): Opens a new connection to the board after it was
+                    lost, connect_board() with the configuration if None
+            Returns:
+                None
+        """
+        self.config = config
+        self.clock = clock if clock is not None else RealClock()
+        self.connect = connect if connect is not None else lambda: connect_board(config)
+        self.board = board if board is not None else self.connect()
+        store = EventStore(os.path.join(config.eventStoreDir, config.name)) \
+            if record and config.eventStoreDir else None
+        self.events = create_event_log(self.clock, f"{config.name}_events.log" if record else None,
+                                       echo, config.name, store)
+        self.controller = TrafficController(self.board, self.clock, self.events, config)
+        if record:
+            self.controller.recorder = TraceRecorder(
+                f"{config.name}_trace-{time.strftime('%Y%m%d-%H%M%S')}.bin", self.clock, config)
+        self.supervisor = BoardSupervisor(self.controller, self.connect, config.healthCheckInterval,
+                                          config.reconnectInterval)
+        self.metricsServer = MetricsServer(self.controller.metrics, port=config.metricsPort) \
+            if config.metricsPort else None
+        self.streamServer = None
+        if config.streamPort or config.streamSocket:
+            self.streamServer = StateStreamServer(self.controller, config.streamPort, config.streamSocket)
+            self.controller.monitor = self.streamServer
+        self.thread = None
+
+    def start(self, duration=None):
+        """
+        Configures the board and runs the controller in its own thread.
+            Parameters:
+                duration (float or None): Seconds of clock time to run for, forever if None
+            Returns:
+                None
+        """
+        self.controller.setup_board()
+        self.controller.initialise_leds()
+        if self.metricsServer is not None:
+            self.metricsServer.start()
+        if self.streamServer is not None:
+            self.streamServer.start()
+        self.thread = threading.Thread(target=self.supervisor.run, args=(duration,),
+                                       name=self.config.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the controller thread, then switches the outputs off and releases the board.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.controller.stop()
+        if self.thread is not None:
+            self.thread.join()
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+        if self.streamServer is not None:
+            self.streamServer.stop()
+        self.controller.shutdown()
+
+
+class IntersectionRunner:
+    """
+    Drives several intersections from one process, one thread per board. Each
+    controller waits on its own sensor callbacks and deadlines, so an idle
+    intersection costs a sleeping thread and its controller's state.
+    """
+
+    def __init__(self, intersections):
+        """
+        Creates a runner for already created intersections.
+            Parameters:
+                intersections (list of Intersection): Intersections to drive
+            Returns:
+                None
+        """
+        self.intersections = intersections
+
+    def start(self, duration=None):
+        """
+        Starts every intersection.
+            Parameters:
+                duration (float or None): Seconds of clock time to run for, forever if None
+            Returns:
+                None
+        """
+        for intersection in self.intersections:
+            intersection.start(duration)
+
+    def join(self, timeout=None):
+        """
+        Waits until every controller thread has ended. Waiting in short steps keeps the
+        main thread responsive to KeyboardInterrupt.
+            Parameters:
+                timeout (float or None): Seconds to wait per join step, a second if None
+            Returns:
+                None
+        """
+        for intersection in self.intersections:
+            while intersection.thread is not None and intersection.thread.is_alive():
+                intersection.thread.join(timeout if timeout is not None else 1.0)
+
+    def stop(self):
+        """
+        Stops every intersection.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        for intersection in self.intersections:
+            intersection.stop()
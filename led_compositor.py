@@ -0,0 +1,103 @@
+# Priorities of the layers, a higher priority layer wins every LED it drives
+normalPriority = 0
+pedestrianPriority = 1
+overridePriority = 2
+
+
+class LedLayer:
+    """
+    The LEDs one subsystem currently drives and the values it wants them to show.
+    Bits the layer does not own are left to the layers below it.
+    """
+
+    def __init__(self, name, priority):
+        """
+        Creates an empty layer.
+            Parameters:
+                name (str): Name of the subsystem rendering into the layer
+                priority (int): normalPriority, pedestrianPriority or overridePriority
+            Returns:
+                None
+        """
+        self.name = name
+        self.priority = priority
+        self.ownedMask = 0
+        self.value = 0
+
+    def apply_mask(self, setMask, clearMask):
+        """
+        Takes ownership of the given LEDs and switches them on or off.
+            Parameters:
+                setMask (int): LEDs to switch on
+                clearMask (int): LEDs to switch off
+            Returns:
+                None
+        """
+        self.ownedMask |= setMask | clearMask
+        self.value = (self.value & ~clearMask) | setMask
+
+    def release(self, mask):
+        """
+        Hands the given LEDs back to the layers below.
+            Parameters:
+                mask (int): LEDs to stop driving
+            Returns:
+                None
+        """
+        self.ownedMask &= ~mask
+
+
+class LedCompositor:
+    """
+    Resolves the layers of all subsystems into the single frame sent to the shift
+    registers. Layers are applied from lowest to highest priority, so override beats
+    pedestrian and pedestrian beats the normal sequences on any contested LED.
+    """
+
+    def __init__(self):
+        """
+        Creates a compositor without layers.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.layers = []
+
+        # Number of resolved frames in which two layers disagreed on an LED
+        self.contestedFrames = 0
+
+    def add_layer(self, name, priority):
+        """
+        Creates a layer and inserts it according to its priority.
+            Parameters:
+                name (str): Name of the subsystem rendering into the layer
+                priority (int): normalPriority, pedestrianPriority or overridePriority
+            Returns:
+                LedLayer: The new layer
+        """
+        layer = LedLayer(name, priority)
+        self.layers.append(layer)
+        self.layers.sort(key=lambda item: item.priority)
+        return layer
+
+    def resolve(self):
+        """
+        Combines every layer into one frame.
+            Parameters:
+                None
+            Returns:
+                int: LED word to latch
+        """
+        frame = 0
+        covered = 0
+        contested = False
+        for layer in self.layers:
+            owned = layer.ownedMask
+            if owned & covered & (frame ^ layer.value):
+                contested = True
+            frame = (frame & ~owned) | (layer.value & owned)
+            covered |= owned
+        if contested:
+            self.contestedFrames += 1
+        return frame
@@ -0,0 +1,302 @@
+from bisect import bisect_left
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the loop timing histogram buckets
+defaultBuckets = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+# Port of the local metrics endpoint
+defaultPort = 9108
+
+
+def format_labels(labels):
+    """
+    Formats a label set for the Prometheus text format.
+        Parameters:
+            labels (dict): Label name to value
+        Returns:
+            str: '{name="value",...}', or an empty string without labels
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, recording a value is a binary search and two additions.
+    """
+
+    def __init__(self, buckets=defaultBuckets):
+        """
+        Creates an empty histogram.
+            Parameters:
+                buckets (tuple of float): Sorted upper bounds of the buckets
+            Returns:
+                None
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        """
+        Records one value.
+            Parameters:
+                value (float): Value to record
+            Returns:
+                None
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def samples(self, name, labels):
+        """
+        Renders the histogram as Prometheus samples.
+            Parameters:
+                name (str): Metric name
+                labels (dict): Labels shared by every sample
+            Returns:
+                list of str: Bucket, sum and count lines
+        """
+        counts = list(self.counts)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{format_labels(dict(labels, le=le))} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {self.total!r}")
+        lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+class LoopMetrics:
+    """
+    Timers, counters and gauges of the control loop.
+
+    The loop records the duration of each of its phases and counts events as they
+    happen. Values that other objects already count, such as the messages sent by
+    the shift register driver, are registered as sources and only read when the
+    metrics are rendered, so they cost nothing on the control path.
+    """
+
+    def __init__(self, budget, timer=time.perf_counter, buckets=defaultBuckets):
+        """
+        Creates the metrics of one controller.
+            Parameters:
+                budget (float): Longest acceptable loop iteration in seconds
+                timer (callable): High resolution timer used to measure the phases
+                buckets (tuple of float): Upper bounds of the timing histogram buckets
+            Returns:
+                None
+        """
+        self.budget = budget
+        self.timer = timer
+        self.buckets = buckets
+
+        # Acquire, decide and flush phases of a loop iteration, then the whole iteration
+        self.phases = {phase: Histogram(buckets) for phase in ("acquire", "decide", "flush")}
+        self.ticks = Histogram(buckets)
+        self.histograms = list(self.phases.values()) + [self.ticks]
+        self.overruns = 0
+
+        # Stage name to histogram of the time items wait between two pipeline stages
+        self.latencies = {}
+
+        # (name, label value) to count, for events counted by the loop itself
+        self.counters = {}
+
+        # Metric name to (type, help, label name, callable returning {label value: number})
+        self.sources = {}
+
+    def tick(self, start, acquired, decided, flushed):
+        """
+        Records the timing of one loop iteration. The histograms are updated inline
+        since this runs on every iteration.
+            Parameters:
+                start (float): Timer reading at the start of the iteration
+                acquired (float): Timer reading once the sensor readings were taken
+                decided (float): Timer reading once the subsystems were advanced
+                flushed (float): Timer reading once the frame was flushed
+            Returns:
+                None
+        """
+        buckets = self.buckets
+        for histogram, elapsed in zip(self.histograms, (acquired - start, decided - acquired,
+                                                        flushed - decided, flushed - start)):
+            histogram.counts[bisect_left(buckets, elapsed)] += 1
+            histogram.total += elapsed
+        if flushed - start > self.budget:
+            self.overruns += 1
+
+    def observe(self, phase, elapsed):
+        """
+        Records the duration of one phase run on its own, as the stages of the
+        threaded pipeline do instead of timing whole iterations with tick().
+            Parameters:
+                phase (str): "acquire", "decide" or "flush"
+                elapsed (float): Seconds spent in the phase
+            Returns:
+                None
+        """
+        self.phases[phase].observe(elapsed)
+
+    def latency(self, stage, elapsed):
+        """
+        Records how long an item waited before a pipeline stage took it up.
+            Parameters:
+                stage (str): Stage receiving the item, e.g. "decide"
+                elapsed (float): Seconds since the previous stage handed it over
+            Returns:
+                None
+        """
+        histogram = self.latencies.get(stage)
+        if histogram is None:
+            histogram = self.latencies[stage] = Histogram(self.buckets)
+        histogram.observe(elapsed)
+
+    def count(self, name, label):
+        """
+        Increments a counter.
+            Parameters:
+                name (str): Counter name without prefix, e.g. "override_activations"
+                label (str): Value of the counter's label
+            Returns:
+                None
+        """
+        key = (name, label)
+        self.counters[key] = self.counters.get(key, 0) + 1
+
+    def add_source(self, name, metricType, helpText, labelName, read):
+        """
+        Registers values read from other objects when the metrics are rendered.
+            Parameters:
+                name (str): Full metric name
+                metricType (str): "counter" or "gauge"
+                helpText (str): Description of the metric
+                labelName (str or None): Label distinguishing the values
+                read (callable): Returns {label value: number}, or a number without a label
+            Returns:
+                None
+        """
+        self.sources[name] = (metricType, helpText, labelName, read)
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+            Parameters:
+                None
+            Returns:
+                str: The exposition text
+        """
+        lines = [
+            "# HELP traffic_loop_phase_seconds Time spent in each phase of a loop iteration",
+            "# TYPE traffic_loop_phase_seconds histogram",
+        ]
+        for phase, histogram in self.phases.items():
+            lines.extend(histogram.samples("traffic_loop_phase_seconds", {"phase": phase}))
+        lines.extend([
+            "# HELP traffic_loop_seconds Time spent in a whole loop iteration",
+            "# TYPE traffic_loop_seconds histogram",
+        ])
+        lines.extend(self.ticks.samples("traffic_loop_seconds", {}))
+        lines.extend([
+            "# HELP traffic_loop_overruns_total Loop iterations longer than the budget",
+            "# TYPE traffic_loop_overruns_total counter",
+            f"traffic_loop_overruns_total {self.overruns}",
+        ])
+        if self.latencies:
+            lines.extend([
+                "# HELP traffic_pipeline_latency_seconds Time from one pipeline stage handing an item over "
+                "to the next taking it up",
+                "# TYPE traffic_pipeline_latency_seconds histogram",
+            ])
+            for stage, histogram in list(self.latencies.items()):
+                lines.extend(histogram.samples("traffic_pipeline_latency_seconds", {"stage": stage}))
+
+        grouped = {}
+        for (name, label), value in list(self.counters.items()):
+            grouped.setdefault(name, []).append((label, value))
+        for name, values in sorted(grouped.items()):
+            lines.append(f"# HELP traffic_{name}_total Events of type {name} counted by the control loop")
+            lines.append(f"# TYPE traffic_{name}_total counter")
+            for label, value in values:
+                lines.append(f"traffic_{name}_total{format_labels({'event': label})} {value}")
+
+        for name, (metricType, helpText, labelName, read) in list(self.sources.items()):
+            lines.append(f"# HELP {name} {helpText}")
+            lines.append(f"# TYPE {name} {metricType}")
+            values = read()
+            if labelName is None:
+                lines.append(f"{name} {values!r}")
+            else:
+                for label, value in values.items():
+                    lines.append(f"{name}{format_labels({labelName: label})} {value!r}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves a LoopMetrics object on a local HTTP endpoint from a background thread.
+    """
+
+    def __init__(self, metrics, host="127.0.0.1", port=defaultPort):
+        """
+        Creates the server without starting it.
+            Parameters:
+                metrics (LoopMetrics): Metrics to expose
+                host (str): Address to listen on, local only by default
+                port (int): Port to listen on
+            Returns:
+                None
+        """
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        """
+        Starts serving /metrics in a daemon thread.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the server.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,213 @@
+def led_mask(*positions):
+    """
+    Builds a bit mask over the LED word from LED indexes.
+        Parameters:
+            positions (int): LED indexes to include
+        Returns:
+            int: Mask with the bit of every given LED set
+    """
+    mask = 0
+    for pos in positions:
+        mask |= 1 << pos
+    return mask
+
+
+class Phase:
+    """
+    One row of a transition table: the LEDs shown while the phase is active, how long
+    it lasts and the condition that must hold before the sequence may leave it.
+    """
+
+    def __init__(self, name, on=(), off=(), duration=0, guard=None, onHold=None, onEnter=None,
+                 nextPhase=None, flash=(), flashInterval=0.5):
+        """
+        Creates a phase with precomputed LED masks.
+            Parameters:
+                name (str): Human readable name of the phase
+                on (tuple of int): LEDs switched on when the phase is entered
+                off (tuple of int): LEDs switched off when the phase is entered
+                duration (float): Minimum time spent in the phase in seconds
+                guard (callable or None): Must return True before the phase may be left
+                onHold (callable or None): Called while the duration is over but the guard fails
+                onEnter (callable or None): Called when the phase is entered
+                nextPhase (int, callable or None): Index of the following phase, or a function
+                    returning it; None means the next row, an index past the table ends the sequence
+                flash (tuple of int): LEDs flashing while the phase is active, lit in even half periods
+                flashInterval (float): Flash half period in seconds
+            Returns:
+                None
+        """
+        self.name = name
+        self.setMask = led_mask(*on)
+        self.clearMask = led_mask(*off)
+        self.duration = duration
+        self.guard = guard
+        self.onHold = onHold
+        self.onEnter = onEnter
+        self.nextPhase = nextPhase
+        self.flashMask = led_mask(*flash)
+        self.flashInterval = flashInterval
+
+
+class PhaseSequence:
+    """
+    Evaluates a transition table. Entering a phase applies its set and clear masks to
+    the target in one operation; while nothing is due, update() only compares times.
+    A flashing phase declares its LEDs to a BlinkEngine for as long as it is active.
+    """
+
+    def __init__(self, name, phases, target, onFinish=None, cyclic=False, blinker=None):
+        """
+        Creates an idle sequence.
+            Parameters:
+                name (str): Name used for deadlines and reporting
+                phases (list of Phase): The transition table
+                target (object): Object with apply_mask(setMask, clearMask), e.g. an LedLayer
+                onFinish (callable or None): Called with the time the last phase was left
+                cyclic (bool): Restart from the first phase instead of finishing
+                blinker (BlinkEngine or None): Engine flashing the LEDs of flashing phases,
+                    required if a phase flashes
+            Returns:
+                None
+        """
+        self.name = name
+        self.phases = phases
+        self.target = target
+        self.onFinish = onFinish
+        self.cyclic = cyclic
+        self.blinker = blinker
+
+        # Index of the current phase, None while the sequence is idle
+        self.index = None
+        self.enteredAt = 0
+
+        # Number of phases entered, read by the loop metrics
+        self.transitions = 0
+
+        # Optional callable receiving the sequence and the phase index on every change,
+        # -1 when the sequence becomes idle
+        self.observer = None
+
+    @property
+    def active(self):
+        """True while the sequence is in one of its phases."""
+        return self.index is not None
+
+    def holding(self, now):
+        """
+        Checks whether the current phase has run its duration but is kept by its guard.
+            Parameters:
+                now (float): Current monotonic time, after update() has run
+            Returns:
+                bool: True if the sequence is waiting on its guard
+        """
+        return self.index is not None and now - self.enteredAt >= self.phases[self.index].duration
+
+    def start(self, now):
+        """
+        Enters the first phase.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                None
+        """
+        self.enter(0, now)
+
+    def stop(self):
+        """
+        Makes the sequence idle without running its finish action.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        if self.index is not None and self.observer is not None:
+            self.observer(self, -1)
+        self.end_flash()
+        self.index = None
+
+    def end_flash(self):
+        """
+        Withdraws the current phase's flashing LEDs from the blink engine.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        if self.index is not None and self.phases[self.index].flashMask:
+            self.blinker.withdraw(self.name)
+
+    def enter(self, index, now):
+        """
+        Enters a phase and applies its LED masks.
+            Parameters:
+                index (int): Row of the table to enter
+                now (float): Current monotonic time
+            Returns:
+                None
+        """
+        phase = self.phases[index]
+        self.end_flash()
+        self.index = index
+        self.enteredAt = now
+        self.transitions += 1
+        self.target.apply_mask(phase.setMask, phase.clearMask)
+        if phase.flashMask:
+            self.blinker.declare(self.name, self.target, phase.flashMask, 0, phase.flashInterval)
+        if self.observer is not None:
+            self.observer(self, index)
+        if phase.onEnter is not None:
+            phase.onEnter()
+
+    def update(self, now):
+        """
+        Moves through every transition that is due.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                bool: True if the sequence changed phase or finished
+        """
+        changed = False
+        while self.index is not None:
+            phase = self.phases[self.index]
+            if now - self.enteredAt < phase.duration:
+                break
+            if phase.guard is not None and not phase.guard():
+                if phase.onHold is not None:
+                    phase.onHold()
+                break
+
+            nextPhase = phase.nextPhase() if callable(phase.nextPhase) else phase.nextPhase
+            if nextPhase is None:
+                nextPhase = self.index + 1
+            changed = True
+            if nextPhase >= len(self.phases):
+                if not self.cyclic:
+                    self.end_flash()
+                    self.index = None
+                    if self.observer is not None:
+                        self.observer(self, -1)
+                    if self.onFinish is not None:
+                        self.onFinish(now)
+                    break
+                nextPhase = 0
+            self.enter(nextPhase, now)
+        return changed
+
+    def next_deadline(self, now):
+        """
+        Returns the time at which update() next has something to do. A phase whose
+        duration is over but whose guard still fails waits for a sensor change instead.
+        Flashing is timed by the blink engine.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                float or None: Monotonic time of the next transition, None if nothing is due
+        """
+        if self.index is None:
+            return None
+        phase = self.phases[self.index]
+        phaseEnd = self.enteredAt + phase.duration
+        if phaseEnd > now or phase.guard is None:
+            return phaseEnd
+        return None
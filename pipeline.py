@@ -0,0 +1,443 @@
+import threading
+from collections import deque
+
+
+class SnapshotBuffer:
+    """
+    Hands the newest sensor snapshot from the acquisition thread to the decision stage.
+
+    The buffer has two slots. The writer fills the slot the reader is not pointed at
+    and then flips the front index, a single assignment, so neither side ever takes
+    a lock or waits for the other. Snapshots are immutable, so the reader can keep
+    using one after the writer has moved on. A snapshot replaced before the decision
+    stage read it is counted as superseded: decisions always use the newest readings,
+    but the button presses latched in it are carried into the snapshot replacing it.
+    If the reader takes the replaced snapshot while it is being replaced, its presses
+    are seen twice, which only repeats a call, rather than lost. The decision stage
+    also wakes up for deadlines with no new snapshot, so a snapshot taken again is
+    returned with its presses cleared and each press is acted on once.
+    """
+
+    def __init__(self):
+        """
+        Creates an empty buffer.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.slots = [None, None]
+        self.front = 0
+        self.changed = threading.Event()
+
+        # Snapshots published and taken, the difference is the queue depth
+        self.published = 0
+        self.taken = 0
+        self.superseded = 0
+
+    def publish(self, snapshot):
+        """
+        Makes a snapshot the newest one, called from the acquisition thread only.
+            Parameters:
+                snapshot (SensorSnapshot): Readings just taken
+            Returns:
+                None
+        """
+        previous = self.slots[self.front]
+        if (previous is not None and self.taken < self.published
+                and (previous.pb1APressed or previous.pb1BPressed)):
+            snapshot = snapshot._replace(pb1APressed=snapshot.pb1APressed or previous.pb1APressed,
+                                         pb1BPressed=snapshot.pb1BPressed or previous.pb1BPressed)
+        back = 1 - self.front
+        self.slots[back] = snapshot
+        self.front = back
+        self.published += 1
+        self.changed.set()
+
+    def latest(self):
+        """
+        Takes the newest snapshot, called from the decision stage only.
+            Parameters:
+                None
+            Returns:
+                SensorSnapshot or None: Newest readings, None before the first snapshot
+        """
+        self.changed.clear()
+        published = self.published
+        snapshot = self.slots[self.front]
+        if published == self.taken and snapshot is not None and (snapshot.pb1APressed or snapshot.pb1BPressed):
+            # Taken before, its presses have already been acted on
+            snapshot = snapshot._replace(pb1APressed=False, pb1BPressed=False)
+        if published - self.taken > 1:
+            self.superseded += published - self.taken - 1
+        self.taken = published
+        return snapshot
+
+    def depth(self):
+        """
+        Returns the number of snapshots published since the decision stage last took one.
+            Parameters:
+                None
+            Returns:
+                int: Snapshots waiting, only the newest of them will be used
+        """
+        return self.published - self.taken
+
+
+class ActuationStage:
+    """
+    Owns the output side of the board on a thread of its own.
+
+    The decision stage queues board commands, such as buzzer tones and sampling
+    settings, and hands over resolved LED frames. The thread runs every command in
+    the order it was queued but only shifts out the newest frame of each batch, so a
+    slow serial write delays the lights without delaying the decisions, and frames
+    that were already stale when the port became free are never sent.
+    """
+
+    def __init__(self, driver, metrics, name="actuate", transport=None):
+        """
+        Creates the stage without starting its thread.
+            Parameters:
+                driver (ShiftRegisterDriver): Driver latching the LED frames
+                metrics (LoopMetrics): Metrics receiving the flush timings
+                name (str): Name of the thread
+                transport (CoalescingTransport or None): Serial transport written to once per batch
+            Returns:
+                None
+        """
+        self.driver = driver
+        self.metrics = metrics
+        self.name = name
+        self.transport = transport
+
+        # (callable or None for a frame, arguments, timer reading when queued)
+        self.items = deque()
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+
+        # Exception raised by a board write, re-raised on the decision stage
+        self.error = None
+
+        self.framesSubmitted = 0
+        self.framesSuperseded = 0
+        self.commandsRun = 0
+
+    def submit(self, function, *args):
+        """
+        Queues a board command.
+            Parameters:
+                function (callable): Board method to call
+                *args: Arguments of the call
+            Returns:
+                None
+        """
+        self.items.append((function, args, self.metrics.timer()))
+        self.wake.set()
+
+    def submit_frame(self, frame):
+        """
+        Queues an LED frame, replacing any frame not flushed yet.
+            Parameters:
+                frame (int): LED word, bit i drives shift register output i
+            Returns:
+                None
+        """
+        self.framesSubmitted += 1
+        self.items.append((None, frame, self.metrics.timer()))
+        self.wake.set()
+
+    def depth(self):
+        """
+        Returns the number of commands and frames waiting for the thread.
+            Parameters:
+                None
+            Returns:
+                int: Queued items
+        """
+        return len(self.items)
+
+    def start(self):
+        """
+        Starts the thread.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.error = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the thread, then sends whatever is still queued from the calling thread.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.running = False
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is None:
+            self.drain()
+
+    def run(self):
+        """
+        Thread body, drains the queue whenever items arrive.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        while self.running:
+            self.wake.wait()
+            self.wake.clear()
+            try:
+                self.drain()
+            except Exception as error:
+                self.error = error
+                return
+
+    def drain(self):
+        """
+        Runs the queued commands in order and flushes the newest queued frame, all
+        in one serial write if there is a transport.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        timer = self.metrics.timer
+        transport = self.transport
+        if transport is not None:
+            transport.hold()
+        frame = None
+        items = self.items
+        try:
+            while items:
+                function, args, queuedAt = items.popleft()
+                if function is None:
+                    if frame is not None:
+                        self.framesSuperseded += 1
+                    frame, frameQueuedAt = args, queuedAt
+                    continue
+                function(*args)
+                self.commandsRun += 1
+            start = timer()
+            if frame is not None:
+                self.metrics.latency("actuate", start - frameQueuedAt)
+                self.driver.flush(frame)
+        finally:
+            # Also sends what the batch wrote before a command failed, and stops holding writes
+            if transport is not None:
+                transport.flush()
+        if frame is not None:
+            self.metrics.observe("flush", timer() - start)
+
+
+class QueuedBoard:
+    """
+    Stands in for the board on the decision stage: every method call is queued
+    on the actuation stage instead of being written to the serial port.
+    """
+
+    def __init__(self, board, stage):
+        """
+        Wraps a board.
+            Parameters:
+                board (Pymata4): Board the calls are meant for
+                stage (ActuationStage): Stage running the calls
+            Returns:
+                None
+        """
+        self.board = board
+        self.stage = stage
+
+    def __getattr__(self, name):
+        function = getattr(self.board, name)
+
+        def queue(*args):
+            self.stage.submit(function, *args)
+        return queue
+
+
+class AcquisitionStage:
+    """
+    Takes sensor snapshots on a thread of its own and publishes them to a SnapshotBuffer.
+
+    The thread wakes up when a sensor callback delivers a reading, or after the
+    given interval so readings that pymata4 never calls back for are still picked
+    up, and the decision stage is never held up by reading the board's caches.
+    """
+
+    def __init__(self, controller, buffer, interval, name="acquire"):
+        """
+        Creates the stage without starting its thread.
+            Parameters:
+                controller (TrafficController): Controller whose inputs are read
+                buffer (SnapshotBuffer): Buffer receiving the snapshots
+                interval (float): Longest time between two snapshots in seconds
+                name (str): Name of the thread
+            Returns:
+                None
+        """
+        self.controller = controller
+        self.buffer = buffer
+        self.interval = interval
+        self.name = name
+        self.running = False
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        """
+        Starts the thread.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.error = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the thread.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.running = False
+        self.controller.inputs.changed.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        Thread body, publishes a snapshot whenever a reading arrives or the interval passes.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        controller = self.controller
+        timer = controller.metrics.timer
+        while self.running:
+            controller.inputs.wait(self.interval)
+            if not self.running:
+                return
+            try:
+                start = timer()
+                snapshot = controller.acquire()
+                controller.metrics.observe("acquire", timer() - start)
+            except Exception as error:
+                self.error = error
+                self.buffer.changed.set()
+                return
+            self.buffer.publish(snapshot)
+
+
+class Pipeline:
+    """
+    Runs a controller as three stages: acquisition and actuation on threads of their
+    own, and the decisions on the thread calling run().
+
+    The decision stage wakes up for a new snapshot or a phase deadline, advances
+    Subsystems 1-4 on the newest readings stamped with the current time, and hands
+    the resolved frame to the actuation stage. While the pipeline runs, the
+    controller's buzzer and sampling commands are queued through a QueuedBoard, so
+    the actuation thread is the only one writing to the serial port.
+    """
+
+    def __init__(self, controller):
+        """
+        Creates the stages of a controller.
+            Parameters:
+                controller (TrafficController): Controller to run
+            Returns:
+                None
+        """
+        self.controller = controller
+        name = controller.config.name
+        self.buffer = SnapshotBuffer()
+        self.acquisition = AcquisitionStage(controller, self.buffer, controller.tickInterval, f"{name}-acquire")
+        self.actuation = ActuationStage(controller.outputDriver, controller.metrics, f"{name}-actuate",
+                                        controller.transport)
+        self.stages = (self.acquisition, self.actuation)
+
+    def start(self):
+        """
+        Routes the controller's outputs through the actuation stage and starts both threads.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        controller = self.controller
+        controller.output = QueuedBoard(controller.board, self.actuation)
+        controller.sampling.board = controller.output
+        controller.actuation = self.actuation
+        self.actuation.start()
+        self.acquisition.start()
+
+    def stop(self):
+        """
+        Stops both threads and gives the outputs back to the controller.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        controller = self.controller
+        self.acquisition.stop()
+        try:
+            self.actuation.stop()
+        finally:
+            controller.actuation = None
+            controller.output = controller.board
+            controller.sampling.board = controller.board
+
+    def run(self, duration=None):
+        """
+        Runs the decision stage until the controller is stopped or, if given, for a fixed time.
+        An error raised by a stage thread is raised here, so a BoardSupervisor sees it.
+            Parameters:
+                duration (float or None): Seconds of clock time to run for, forever if None
+            Returns:
+                None
+        """
+        controller = self.controller
+        clock = controller.clock
+        metrics = controller.metrics
+        timer = metrics.timer
+        controller.running = True
+        endTime = None if duration is None else clock.monotonic() + duration
+        self.start()
+        try:
+            while controller.running and (endTime is None or clock.monotonic() < endTime):
+                for stage in self.stages:
+                    if stage.error is not None:
+                        raise stage.error
+                snapshot = self.buffer.latest()
+                if snapshot is not None:
+                    start = timer()
+                    now = clock.monotonic()
+                    metrics.latency("decide", now - snapshot.time)
+                    controller.decide(snapshot._replace(time=now))
+                    controller.toggle_led()
+                    metrics.observe("decide", timer() - start)
+                if controller.healthCheck is not None:
+                    controller.healthCheck()
+                controller.scheduler.wait(self.buffer.changed)
+        finally:
+            self.stop()
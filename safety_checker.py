@@ -0,0 +1,471 @@
+import argparse
+import json
+import sys
+import time
+from collections import deque, namedtuple
+
+from phase_table import led_mask
+from sensor_inputs import SensorSnapshot
+from sensor_trace import ReplayBoard, ReplayClock
+from traffic_controller import (IntersectionConfig, TrafficController, pl1AGreen, pl1ARed, pl1BGreen, pl1BRed,
+                                tl1Green, tl1Red, tl1Yellow, tl2Green, tl2Red, tl2Yellow, tl3Green, tl3Red,
+                                tl4Green, tl4Red, tl4Yellow, tl5Green, tl5Red, tl5Yellow, wl1A, wl1B, wl2A, wl2B)
+
+# Sonar predicates switched by the checker, in the order of a state's inputs
+sonarNames = ("US1", "US3", "US4")
+
+# Buttons the checker presses, a press is the button going down and up again since
+# only the press itself reaches the controller's logic
+buttonNames = ("PB1A", "PB1B")
+
+# Raw sonar readings standing for a sensor that detects a vehicle and one that does not
+detectingCm = 1
+clearCm = 400
+
+# Debounce windows, zeroed since the checker switches the debounced predicates directly
+debounceFields = ("us1AssertMs", "us1ReleaseMs", "us3AssertMs", "us3ReleaseMs", "us4AssertMs", "us4ReleaseMs",
+                  "buttonAssertMs", "buttonReleaseMs")
+
+# The flood lights play no part in the safety properties, every state is in daylight
+dayLdrValue = 1023
+
+# LEDs exchanged by the symmetry between PB1A and PB1B
+mirroredLeds = ((pl1AGreen, pl1BGreen), (pl1ARed, pl1BRed))
+pedestrianLeds = led_mask(pl1AGreen, pl1BGreen, pl1ARed, pl1BRed)
+
+# Warning lights left out of the state, they blink without affecting anything else
+flasherLeds = led_mask(wl1A, wl1B, wl2A, wl2B)
+
+# Lights of every signal head, a head may show one of them at a time
+signalHeads = {
+    "TL1": {"green": tl1Green, "yellow": tl1Yellow, "red": tl1Red},
+    "TL2": {"green": tl2Green, "yellow": tl2Yellow, "red": tl2Red},
+    "TL3": {"green": tl3Green, "red": tl3Red},
+    "TL4": {"green": tl4Green, "yellow": tl4Yellow, "red": tl4Red},
+    "TL5": {"green": tl5Green, "yellow": tl5Yellow, "red": tl5Red},
+    "PL1A": {"green": pl1AGreen, "red": pl1ARed},
+    "PL1B": {"green": pl1BGreen, "red": pl1BRed},
+}
+
+# State reached by the search: the saved controller attributes and the sonar predicates
+ModelState = namedtuple("ModelState", ["memento", "inputs"])
+
+# Property that failed, the shortest sequence of actions reaching the failure and the lights then
+Violation = namedtuple("Violation", ["name", "description", "trace", "frame"])
+
+# Outcome of a search
+CheckResult = namedtuple("CheckResult", ["states", "transitions", "depth", "seconds", "complete", "violations"])
+
+
+def lit(frame, index):
+    """
+    Checks whether an LED is on in a frame.
+        Parameters:
+            frame (int): LED word
+            index (int): LED index
+        Returns:
+            bool: True if the LED is on
+    """
+    return bool(frame >> index & 1)
+
+
+def crossing_conflict(controller, frame):
+    """TL4 green or yellow while a pedestrian light is green."""
+    return ((lit(frame, tl4Green) or lit(frame, tl4Yellow))
+            and (lit(frame, pl1AGreen) or lit(frame, pl1BGreen)))
+
+
+def override_conflict(controller, frame):
+    """TL1 green while US4 asserts the override of Subsystem 1."""
+    return lit(frame, tl1Green) and controller.us4_detected()
+
+
+def tl4_override_conflict(controller, frame):
+    """TL4 not steady red while an overheight vehicle holds it."""
+    held = controller.us4_detected() or controller.s4Active
+    return held and (lit(frame, tl4Green) or lit(frame, tl4Yellow) or not lit(frame, tl4Red))
+
+
+def tunnel_conflict(controller, frame):
+    """TL3 green while Subsystem 4 holds the tunnel."""
+    return lit(frame, tl3Green) and controller.s4Active
+
+
+def aspect_conflict(controller, frame):
+    """A signal head showing more than one light."""
+    return any(sum(lit(frame, index) for index in head.values()) > 1 for head in signalHeads.values())
+
+
+# Properties checked in every reachable state: (name, description, predicate true on a violation)
+safetyProperties = [
+    ("crossingConflict", "TL4 shows green or yellow while a pedestrian light is green", crossing_conflict),
+    ("overrideConflict", "TL1 shows green while US4 asserts the override", override_conflict),
+    ("tl4Override", "TL4 is not steady red while US4 or the tunnel hold overrides it", tl4_override_conflict),
+    ("tunnelConflict", "TL3 shows green while Subsystem 4 holds the tunnel", tunnel_conflict),
+    ("aspectConflict", "A signal head shows more than one light", aspect_conflict),
+]
+
+
+def describe_frame(frame):
+    """
+    Lists the signal lights that are on in a frame.
+        Parameters:
+            frame (int): LED word
+        Returns:
+            str: e.g. "TL1 red, TL2 red, TL4 green"
+    """
+    return ", ".join(f"{head} {colour}" for head, lights in signalHeads.items()
+                     for colour, index in lights.items() if lit(frame, index)) or "dark"
+
+
+def mirror_leds(value):
+    """
+    Exchanges the PL1A and PL1B lights of an LED word.
+        Parameters:
+            value (int): LED word or mask
+        Returns:
+            int: The word with the two pedestrian lights swapped
+    """
+    if not value & pedestrianLeds:
+        return value
+    for first, second in mirroredLeds:
+        bits = (value >> first & 1) << second | (value >> second & 1) << first
+        value = value & ~(1 << first | 1 << second) | bits
+    return value
+
+
+class PredicateFilter:
+    """
+    Stands in for a DistanceFilter: the checker switches each sonar between a
+    detecting and a clear reading, so a reading is its own smoothed distance and
+    never expires.
+    """
+
+    def update(self, rawValue, now):
+        """
+        Takes a reading as its own smoothed distance.
+            Parameters:
+                rawValue (float or None): Reading chosen by the checker
+                now (float): Time of the reading
+            Returns:
+                float or None: The reading
+        """
+        return rawValue
+
+    def settled(self, rawValue):
+        """
+        Checks whether feeding the same reading again would leave the output unchanged.
+            Parameters:
+                rawValue (float or None): Reading chosen by the checker
+            Returns:
+                bool: Always True
+        """
+        return True
+
+    def next_change(self):
+        """
+        Returns the time at which expiry next changes the output.
+            Parameters:
+                None
+            Returns:
+                None: Readings never expire
+        """
+        return None
+
+
+class SafetyModel:
+    """
+    Transition system of the controller's decision logic, for exhaustive checking.
+
+    A state is the controller together with the sonar predicates it sees, whether
+    US1, US3 and US4 detect a vehicle, already debounced. A button press is a single
+    action, since the controller only reacts to the press. Time is abstracted away:
+    the clock stands still and every timer that is running can expire next, in any
+    order, whatever its duration. A phase ends, the red hold of Subsystem 1 gaps out
+    or maxes out, the crossing lockout ends or a latched call reaches s2GreenTime by
+    moving the time the timer started back by its duration. This explores every order
+    of sensor changes and timer expiries, a superset of the timings the controller can
+    meet, so a property that holds here holds for any phase durations. Flashing only
+    darkens lights a phase has lit and cannot create a conflict, so it costs nothing
+    that the blink patterns stay in their first half period, and the WL1 and WL2
+    warning lights are left out of the key.
+
+    A state's key keeps the discrete state of every subsystem, LED layer and sonar
+    and which timers have expired. PB1A and PB1B are interchangeable, so a state and
+    its mirror image with the pedestrian lights exchanged share one key.
+
+    There is one controller, states are saved and restored as copies of the
+    attributes of its stateful parts, which is much cheaper than copying it.
+    """
+
+    def __init__(self, config=None):
+        """
+        Creates the controller in its boot state with every sensor clear.
+            Parameters:
+                config (IntersectionConfig or None): Configuration to check, the defaults if None
+            Returns:
+                None
+        """
+        config = config if config is not None else IntersectionConfig()
+        self.config = config = config._replace(**{field: 0 for field in debounceFields})
+        self.clock = ReplayClock(0.0)
+        self.controller = controller = TrafficController(ReplayBoard(), self.clock, config=config)
+        controller.us1Filter = PredicateFilter()
+        controller.us3Filter = PredicateFilter()
+        controller.us4Filter = PredicateFilter()
+        controller.reset_layers()
+
+        self.parts = ([controller, controller.compositor] + controller.sequences + controller.debouncers
+                      + controller.compositor.layers)
+        inputs = (False,) * len(sonarNames)
+        self.step(inputs)
+        self.initial = ModelState(self.save(), inputs)
+
+    def save(self):
+        """
+        Copies the attributes of the controller's stateful parts and its flashing patterns.
+            Parameters:
+                None
+            Returns:
+                tuple of dict: Memento for restore()
+        """
+        return tuple(vars(part).copy() for part in self.parts) + (self.controller.blinker.patterns.copy(),)
+
+    def restore(self, memento):
+        """
+        Puts the controller back into a saved state.
+            Parameters:
+                memento (tuple of dict): Attributes returned by save()
+            Returns:
+                None
+        """
+        for part, attributes in zip(self.parts, memento):
+            vars(part).update(attributes)
+        self.controller.blinker.patterns = memento[-1].copy()
+
+    def step(self, inputs, pressed=None):
+        """
+        Runs the decision logic for a set of predicates, twice if a button is pressed:
+        once with the button down and once with it up again.
+            Parameters:
+                inputs (tuple of bool): US1, US3 and US4 predicates
+                pressed (int or None): Index of the button pressed in buttonNames, None for no press
+            Returns:
+                tuple of bool: The predicates, the controller is left in the state reached
+        """
+        controller = self.controller
+        distances = [detectingCm if detecting else clearCm for detecting in inputs]
+        if pressed is not None:
+            levels = [int(button == pressed) for button in range(len(buttonNames))]
+            controller.process(SensorSnapshot(self.clock.now, *distances, *levels, False, False, dayLdrValue))
+        controller.process(SensorSnapshot(self.clock.now, *distances, 0, 0, False, False, dayLdrValue))
+        controller.ledState = controller.compositor.resolve()
+        return inputs
+
+    def timers(self):
+        """
+        Lists the timers running in the current state.
+            Parameters:
+                None
+            Returns:
+                list of tuple: (action, callable expiring the timer)
+        """
+        controller = self.controller
+        config = self.config
+        now = self.clock.now
+        timers = []
+        for sequence in controller.sequences:
+            if sequence.index is None:
+                continue
+            phase = sequence.phases[sequence.index]
+            if now - sequence.enteredAt < phase.duration:
+                timers.append((f"{phase.name} ends", setattr, sequence, "enteredAt", now - phase.duration))
+        s1Sequence = controller.s1Sequence
+        if s1Sequence.index == controller.s1AllRedPhase and s1Sequence.holding(now):
+            if now - s1Sequence.enteredAt < config.s1MaxRedTime:
+                timers.append(("red hold maxes out", setattr, s1Sequence, "enteredAt", now - config.s1MaxRedTime))
+        if now - controller.s1LastOccupied < config.s1GapTime:
+            timers.append(("US1 and US3 gap ends", setattr, controller, "s1LastOccupied", now - config.s1GapTime))
+        if now - controller.lastCrossingTime < config.crossingLockout:
+            timers.append(("crossing lockout ends", setattr, controller, "lastCrossingTime",
+                           now - config.crossingLockout))
+        if controller.pedestrianCall is not None and now - controller.pedestrianCall < config.s2GreenTime:
+            timers.append(("call waited s2GreenTime", setattr, controller, "pedestrianCall",
+                           now - config.s2GreenTime))
+        return timers
+
+    def successors(self, state):
+        """
+        Generates the states one action away: a sonar predicate flips, a button is
+        pressed or a timer expires. The controller is left in each state until the
+        next one is generated, so it can be keyed and saved.
+            Parameters:
+                state (ModelState): State to expand
+            Returns:
+                iterator of tuple: (action, predicates of the state reached)
+        """
+        for position, name in enumerate(sonarNames):
+            inputs = state.inputs[:position] + (not state.inputs[position],) + state.inputs[position + 1:]
+            self.restore(state.memento)
+            yield f"{name} {'detects' if inputs[position] else 'clear'}", self.step(inputs)
+        for button, name in enumerate(buttonNames):
+            self.restore(state.memento)
+            yield f"{name} pressed", self.step(state.inputs, button)
+        self.restore(state.memento)
+        for action, function, target, name, value in self.timers():
+            self.restore(state.memento)
+            function(target, name, value)
+            yield action, self.step(state.inputs)
+
+    def key(self, inputs):
+        """
+        Builds the hashable abstraction of the state the controller is in, the same for
+        the state and its mirror image.
+            Parameters:
+                inputs (tuple of bool): Sonar predicates of the state
+            Returns:
+                tuple: Equal for states the controller cannot tell apart
+        """
+        controller = self.controller
+        config = self.config
+        now = self.clock.now
+
+        sequences = []
+        ackIndex = None
+        for sequence in controller.sequences:
+            if sequence.index is None:
+                sequences.append(None)
+            elif sequence is controller.callAck:
+                ackIndex = sequence.index
+                sequences.append(now - sequence.enteredAt >= sequence.phases[ackIndex].duration)
+            else:
+                elapsed = now - sequence.enteredAt
+                sequences.append((sequence.index, elapsed >= sequence.phases[sequence.index].duration,
+                                  elapsed >= config.s1MaxRedTime))
+
+        call = controller.pedestrianCall
+        common = (
+            tuple(sequences), tuple(sorted(controller.blinker.patterns)),
+            controller.s1Active, controller.wl1FlashActive, controller.s2Active, controller.sequenceRunning,
+            controller.s3Active, controller.s3SequenceComplete, controller.s4Active,
+            controller.overrideSub2Overheight, controller.overrideSub1BySub4, controller.s1SequenceCooldown,
+            controller.buzzerFreq if controller.buzzerOn else 0,
+            now - controller.s1LastOccupied >= config.s1GapTime,
+            now - controller.lastCrossingTime >= config.crossingLockout,
+            None if call is None else now - call >= config.s2GreenTime,
+        )
+        layers = tuple((layer.value & ~flasherLeds, layer.ownedMask) for layer in controller.compositor.layers)
+        mirrored = tuple((mirror_leds(value), mirror_leds(mask)) for value, mask in layers)
+        return (inputs,) + min((layers, ackIndex), (mirrored, None if ackIndex is None else 1 - ackIndex)) \
+            + common
+
+
+def trace_to(visited, key):
+    """
+    Follows the parents of a visited state back to the initial state.
+        Parameters:
+            visited (dict): Key -> (parent key, action), None for the initial state
+            key (tuple): Key of the last state
+        Returns:
+            list of str: Actions leading from the initial state to the state
+    """
+    trace = []
+    while visited[key] is not None:
+        key, action = visited[key]
+        trace.append(action)
+    trace.reverse()
+    return trace
+
+
+def check(config=None, properties=None, maxStates=1000000, maxDepth=None):
+    """
+    Explores every reachable state breadth first and checks the safety properties in
+    each. Breadth first order makes the first trace found to a violation a shortest one.
+        Parameters:
+            config (IntersectionConfig or None): Configuration to check, the defaults if None
+            properties (list of tuple or None): (name, description, predicate) checked, safetyProperties if None
+            maxStates (int): Distinct states after which the search stops
+            maxDepth (int or None): Actions after which a path is no longer extended, unbounded if None
+        Returns:
+            CheckResult: Size of the search and the first violation of each property
+    """
+    properties = properties if properties is not None else safetyProperties
+    start = time.perf_counter()
+    model = SafetyModel(config)
+    controller = model.controller
+    violations = {}
+
+    def inspect(key):
+        for name, description, predicate in properties:
+            if name not in violations and predicate(controller, controller.ledState):
+                violations[name] = Violation(name, description, trace_to(visited, key), controller.ledState)
+
+    rootKey = model.key(model.initial.inputs)
+    visited = {rootKey: None}
+    inspect(rootKey)
+    queue = deque([(model.initial, rootKey, 0)])
+    transitions = 0
+    depth = 0
+    complete = True
+    while queue:
+        state, key, stateDepth = queue.popleft()
+        depth = stateDepth
+        if maxDepth is not None and stateDepth >= maxDepth:
+            complete = False
+            continue
+        for action, inputs in model.successors(state):
+            transitions += 1
+            childKey = model.key(inputs)
+            if childKey in visited:
+                continue
+            visited[childKey] = (key, action)
+            inspect(childKey)
+            queue.append((ModelState(model.save(), inputs), childKey, stateDepth + 1))
+        if len(visited) >= maxStates:
+            complete = False
+            break
+    return CheckResult(len(visited), transitions, depth, time.perf_counter() - start, complete,
+                       list(violations.values()))
+
+
+def parse_overrides(specs):
+    """
+    Parses "name=value" configuration overrides.
+        Parameters:
+            specs (list of str): Overrides, e.g. ["crossingLockout=10"]
+        Returns:
+            dict: IntersectionConfig fields to change
+    """
+    overrides = {}
+    for spec in specs:
+        name, value = spec.split("=", 1)
+        if name not in IntersectionConfig._fields:
+            raise ValueError(f"unknown configuration field: {name}")
+        overrides[name] = json.loads(value)
+    return overrides
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks every reachable state of the controller for "
+                                                 "conflicting signal outputs.")
+    parser.add_argument("--set", action="append", default=[], metavar="FIELD=VALUE",
+                        help="configuration value to check with, e.g. crossingLockout=10")
+    parser.add_argument("--max-states", type=int, default=1000000, help="distinct states explored at most")
+    parser.add_argument("--max-depth", type=int, help="actions per path explored at most")
+    args = parser.parse_args()
+
+    try:
+        checkConfig = IntersectionConfig(**parse_overrides(args.set))
+    except ValueError as error:
+        parser.error(str(error))
+    result = check(checkConfig, maxStates=args.max_states, maxDepth=args.max_depth)
+    print(f"{result.states} states, {result.transitions} transitions, depth {result.depth}, "
+          f"{result.seconds:.1f} s{'' if result.complete else ' (search cut short)'}")
+    for violation in result.violations:
+        print(f"\n{violation.name}: {violation.description}")
+        for number, action in enumerate(violation.trace, 1):
+            print(f"  {number:3d}. {action}")
+        print(f"  lights: {describe_frame(violation.frame)}")
+    if not result.violations:
+        print("No property violated")
+    sys.exit(1 if result.violations else 0)
@@ -0,0 +1,140 @@
+# Firmata command byte enabling or disabling the reports of an analog pin, the pin is added to it
+reportAnalog = 0xC0
+
+# Shortest sampling interval in milliseconds that Firmata accepts
+minimumInterval = 10
+
+# Bytes sent to the board by a sampling interval sysex and an analog reporting message
+intervalBytes = 5
+reportingBytes = 2
+
+# Bytes received from the board per report: a FirmataExpress sonar sysex and an analog message
+sonarReportBytes = 6
+analogReportBytes = 3
+
+
+class SamplingManager:
+    """
+    Sets how often the board samples its sensors from the activity on the road.
+
+    Firmata has one sampling interval for the whole board. On every interval
+    FirmataExpress pings the next sonar in turn and sends every reporting analog
+    input, so the sonars are never triggered together and each one is pinged once
+    per interval times the number of sonars. The sampling interval is therefore the
+    only per-sonar rate there is: it is shortened while any sonar wants the fast
+    rate and lengthened once all of them have been idle for holdTime.
+
+    A sonar wants the fast rate while it, or a sonar upstream of it, shows
+    activity, so a vehicle seen by US1 already speeds up US3 and US4 before it gets
+    there. The LDR is only reported while its reading is needed.
+    """
+
+    def __init__(self, sensors, ldrPin, idleInterval=100, activeInterval=15, holdTime=5.0):
+        """
+        Creates a manager for the sonars of one board.
+            Parameters:
+                sensors (list of str): Sonar names from upstream to downstream, e.g. ["us1", "us3", "us4"]
+                ldrPin (int): Analog pin of the light dependant resistor
+                idleInterval (int): Sampling interval in milliseconds while the road is empty
+                activeInterval (int): Sampling interval in milliseconds while a vehicle is around
+                holdTime (float): Seconds a sonar stays at the fast rate after its last activity
+            Returns:
+                None
+        """
+        self.sensors = sensors
+        self.ldrPin = ldrPin
+        self.idleInterval = max(idleInterval, minimumInterval)
+        self.activeInterval = max(activeInterval, minimumInterval)
+        self.holdTime = holdTime
+
+        # Time each sonar last showed activity, itself or upstream
+        self.lastActive = {name: float("-inf") for name in sensors}
+
+        # Settings applied to the board, None until sent
+        self.board = None
+        self.interval = None
+        self.ldrReporting = None
+
+        # Outbound traffic counters
+        self.intervalChanges = 0
+        self.messagesSent = 0
+        self.bytesSent = 0
+
+    def attach(self, board):
+        """
+        Uses a newly configured board, the settings are sent again on the next update.
+            Parameters:
+                board (Pymata4): Board the sensors are attached to
+            Returns:
+                None
+        """
+        self.board = board
+        self.interval = None
+        self.ldrReporting = None
+
+    def sensor_active(self, name, now):
+        """
+        Checks whether a sonar currently wants the fast rate.
+            Parameters:
+                name (str): Sonar name
+                now (float): Current monotonic time
+            Returns:
+                bool: True within holdTime of the sonar's last activity
+        """
+        return now - self.lastActive[name] < self.holdTime
+
+    def update(self, now, activity, ldrNeeded):
+        """
+        Records the activity of the latest readings and updates the board's settings if they change.
+            Parameters:
+                now (float): Current monotonic time
+                activity (list of bool): Whether each sonar shows activity, in the order of sensors
+                ldrNeeded (bool): Whether the LDR reading is needed
+            Returns:
+                None
+        """
+        upstream = False
+        for name, active in zip(self.sensors, activity):
+            upstream = upstream or active
+            if upstream:
+                self.lastActive[name] = now
+
+        fast = any(now - last < self.holdTime for last in self.lastActive.values())
+        interval = self.activeInterval if fast else self.idleInterval
+        if interval != self.interval:
+            self.board.set_sampling_interval(interval)
+            self.interval = interval
+            self.intervalChanges += 1
+            self.messagesSent += 1
+            self.bytesSent += intervalBytes
+
+        if ldrNeeded != self.ldrReporting:
+            self.board._send_command((reportAnalog + self.ldrPin, 1 if ldrNeeded else 0))
+            self.ldrReporting = ldrNeeded
+            self.messagesSent += 1
+            self.bytesSent += reportingBytes
+
+    def next_change(self):
+        """
+        Returns the time at which the board goes back to the idle rate if nothing else happens.
+            Parameters:
+                None
+            Returns:
+                float or None: Monotonic time, None while already idle
+        """
+        if self.interval != self.activeInterval:
+            return None
+        return max(self.lastActive.values()) + self.holdTime
+
+    def received_rate(self):
+        """
+        Estimates the bytes per second the board sends with the current settings.
+            Parameters:
+                None
+            Returns:
+                float: Bytes per second
+        """
+        if self.interval is None:
+            return 0.0
+        perInterval = sonarReportBytes + (analogReportBytes if self.ldrReporting else 0)
+        return perInterval * 1000 / self.interval
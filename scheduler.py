@@ -0,0 +1,118 @@
+import heapq
+
+
+class DeadlineScheduler:
+    """
+    Keeps the pending phase deadlines of the controller in a priority queue and
+    sleeps exactly until the earliest one, or until an input event arrives.
+
+    Deadlines are identified by a tag such as "s1" or "wl2Flash". Scheduling a tag
+    again replaces its previous deadline. When a deadline is reached the delay
+    between the deadline and the actual wakeup is recorded per tag.
+    """
+
+    def __init__(self, clock, idleTimeout=0.5, resolution=0.001):
+        """
+        Creates an empty scheduler.
+            Parameters:
+                clock (RealClock or VirtualClock): Clock providing monotonic() and wait()
+                idleTimeout (float): Longest sleep when no deadline is pending
+                resolution (float): Shortest sleep, deadlines in the past are moved to now plus this
+            Returns:
+                None
+        """
+        self.clock = clock
+        self.idleTimeout = idleTimeout
+        self.resolution = resolution
+
+        self.heap = []
+        self.pending = {}
+        self.count = 0
+
+        # Lateness statistics per tag: [deadlines reached, total lateness, worst lateness]
+        self.lateness = {}
+        self.wakeups = 0
+
+    def schedule(self, tag, when):
+        """
+        Sets or replaces the deadline for a tag.
+            Parameters:
+                tag (str): Name of the timer
+                when (float): Monotonic time the timer expires
+            Returns:
+                None
+        """
+        if self.pending.get(tag) == when:
+            return
+        self.pending[tag] = when
+        heapq.heappush(self.heap, (when, self.count, tag))
+        self.count += 1
+
+    def cancel(self, tag):
+        """
+        Removes the deadline for a tag, if any.
+            Parameters:
+                tag (str): Name of the timer
+            Returns:
+                None
+        """
+        self.pending.pop(tag, None)
+
+    def next_deadline(self):
+        """
+        Returns the earliest pending deadline.
+            Parameters:
+                None
+            Returns:
+                float or None: Monotonic time of the next deadline, None if nothing is pending
+        """
+        heap = self.heap
+        while heap and self.pending.get(heap[0][2]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def wait(self, event):
+        """
+        Sleeps until the next deadline or until the event is set, then records the
+        lateness of every deadline that has been reached.
+            Parameters:
+                event (threading.Event): Set by the input layer when a reading arrives
+            Returns:
+                list of str: Tags of the deadlines that expired
+        """
+        now = self.clock.monotonic()
+        deadline = self.next_deadline()
+        if deadline is None:
+            timeout = self.idleTimeout
+        else:
+            # Overshoot by a microsecond so that 'now - timer >= duration' holds on wakeup
+            timeout = min(max(deadline - now + 1e-6, self.resolution), self.idleTimeout)
+        self.clock.wait(event, timeout)
+        self.wakeups += 1
+
+        now = self.clock.monotonic()
+        expired = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            when, _, tag = heapq.heappop(heap)
+            if self.pending.get(tag) != when:
+                continue
+            del self.pending[tag]
+            expired.append(tag)
+            stats = self.lateness.setdefault(tag, [0, 0.0, 0.0])
+            late = now - when
+            stats[0] += 1
+            stats[1] += late
+            stats[2] = max(stats[2], late)
+        return expired
+
+    def report(self):
+        """
+        Summarises the lateness measured for every tag.
+            Parameters:
+                None
+            Returns:
+                dict: Tag to {"count", "meanLateness", "maxLateness"} in seconds
+        """
+        return {tag: {"count": count, "meanLateness": total / count, "maxLateness": worst}
+                for tag, (count, total, worst) in self.lateness.items()}
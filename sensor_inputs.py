@@ -0,0 +1,234 @@
+import threading
+from collections import namedtuple
+
+# Firmata sysex command of a sonar report, the sysex data starts with the trigger pin
+sonarDataCommand = 0x63
+
+# Firmata command of an analog report as keyed in pymata4's report dispatch, which
+# passes the pin first
+analogMessageCommand = 0xE0
+
+# Readings taken at one point in time, handed to the controller's decision logic. The
+# report times are the monotonic times each sonar last reported its distance, None if
+# the board does not tell, in which case the distance counts as just reported
+SensorSnapshot = namedtuple("SensorSnapshot", [
+    "time",
+    "distanceCm1", "distanceCm3", "distanceCm4",
+    "pb1AState", "pb1BState",
+    "pb1APressed", "pb1BPressed",
+    "ldrValue",
+    "reportTime1", "reportTime3", "reportTime4",
+], defaults=(None, None, None))
+
+
+class SensorInputs:
+    """
+    Collects sensor readings pushed by pymata4 callbacks instead of polling the board.
+
+    Each callback stores the new value with the time it arrived, latches button
+    presses so a press and release between two loop iterations is not lost, and
+    sets the 'changed' event so the control loop can wake up immediately.
+
+    Pymata4 only calls back when a sonar's distance changes, so a sensor holding a
+    distance and a sensor that stopped reporting look the same to the callbacks. The
+    sonar reports are therefore also timestamped in pymata4's report dispatch, and
+    every snapshot carries the time each sonar last reported. The LDR is only
+    reported while it is needed, so its reading is forgotten when reporting resumes
+    and is None until the board reports it again.
+    """
+
+    def __init__(self, board, clock, sonarPins, buttonPins, ldrPin, ldrDifferential=1):
+        """
+        Creates the acquisition layer for one board.
+            Parameters:
+                board (Pymata4): Board the sensors are attached to
+                clock (RealClock or VirtualClock): Monotonic time source used to timestamp readings
+                sonarPins (list of tuple): (trigger pin, echo pin, timeout or None) for US1, US3 and US4
+                buttonPins (list of int): Digital pins of PB1A and PB1B
+                ldrPin (int): Analog pin of the light dependant resistor
+                ldrDifferential (int): Smallest change of the LDR reading that pymata4 calls back for
+            Returns:
+                None
+        """
+        self.board = board
+        self.clock = clock
+        self.sonarPins = sonarPins
+        self.buttonPins = buttonPins
+        self.ldrPin = ldrPin
+        self.ldrDifferential = ldrDifferential
+
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+
+        # Latest value and arrival time per input
+        self.sonarValues = {trig: [0, 0] for trig, _, _ in sonarPins}
+        self.buttonValues = {pin: [0, 0] for pin in buttonPins}
+        self.ldrValue = [0, 0]
+
+        # Rising edges seen since the last snapshot
+        self.buttonPresses = {pin: 0 for pin in buttonPins}
+
+        # Last report of each sonar as [distance, time], taken together so they always
+        # match, None until the sonar first reports or if the board's reports are not
+        # timestamped
+        self.sonarReports = {trig: None for trig, _, _ in sonarPins}
+        self.hookedDispatch = None
+        self.sonarHooked = False
+        self.ldrHooked = False
+
+    def attach(self):
+        """
+        Configures the input pins on the board with this object's callbacks.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        for trig, echo, timeout in self.sonarPins:
+            if timeout is None:
+                self.board.set_pin_mode_sonar(trig, echo, callback=self.on_sonar)
+            else:
+                self.board.set_pin_mode_sonar(trig, echo, callback=self.on_sonar, timeout=timeout)
+        for pin in self.buttonPins:
+            self.board.set_pin_mode_digital_input(pin, callback=self.on_button)
+        self.board.set_pin_mode_analog_input(self.ldrPin, callback=self.on_ldr, differential=self.ldrDifferential)
+        self.hook_reports()
+
+    def hook_reports(self):
+        """
+        Sees every sonar and analog report the board sends, changed or not, by wrapping
+        the handlers of pymata4's report dispatch. Boards without one are left alone.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        dispatch = getattr(self.board, "report_dispatch", None)
+        if dispatch is None or dispatch is self.hookedDispatch:
+            return
+        self.hookedDispatch = dispatch
+
+        sonarEntry = dispatch.get(sonarDataCommand)
+        self.sonarHooked = sonarEntry is not None
+        if sonarEntry is not None:
+            def on_sonar_report(data):
+                sonarEntry[0](data)
+                if data[0] in self.sonarReports:
+                    self.sonarReports[data[0]] = [(data[2] << 7) + data[1], self.clock.monotonic()]
+            dispatch[sonarDataCommand] = [on_sonar_report] + sonarEntry[1:]
+
+        analogEntry = dispatch.get(analogMessageCommand)
+        self.ldrHooked = analogEntry is not None
+        if analogEntry is not None:
+            def on_analog_report(data):
+                analogEntry[0](data)
+                # Later changes come through on_ldr, past the pin's differential
+                if data[0] == self.ldrPin and self.ldrValue[0] is None:
+                    self.ldrValue = [(data[2] << 7) + data[1], self.clock.monotonic()]
+                    self.changed.set()
+            dispatch[analogMessageCommand] = [on_analog_report] + analogEntry[1:]
+
+    def forget_ldr(self):
+        """
+        Forgets the LDR reading when the board starts reporting it again, the reading
+        cached before reporting stopped may be stale. Boards whose reports are not
+        seen keep it, since an unchanged level would never be called back.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        if self.ldrHooked:
+            self.ldrValue = [None, self.clock.monotonic()]
+
+    def on_sonar(self, data):
+        """
+        Sonar callback, data is [pin type, trigger pin, distance in cm, time stamp].
+            Parameters:
+                data (list): Callback data from pymata4
+            Returns:
+                None
+        """
+        self.sonarValues[data[1]] = [data[2], self.clock.monotonic()]
+        self.changed.set()
+
+    def on_button(self, data):
+        """
+        Digital input callback, data is [pin type, pin, value, time stamp].
+            Parameters:
+                data (list): Callback data from pymata4
+            Returns:
+                None
+        """
+        pin, value = data[1], data[2]
+        with self.lock:
+            if value == 1 and self.buttonValues[pin][0] == 0:
+                self.buttonPresses[pin] += 1
+            self.buttonValues[pin] = [value, self.clock.monotonic()]
+        self.changed.set()
+
+    def on_ldr(self, data):
+        """
+        Analog input callback, data is [pin type, pin, value, time stamp].
+            Parameters:
+                data (list): Callback data from pymata4
+            Returns:
+                None
+        """
+        self.ldrValue = [data[2], self.clock.monotonic()]
+        self.changed.set()
+
+    def wait(self, timeout):
+        """
+        Blocks until a new reading arrives or the timeout expires.
+            Parameters:
+                timeout (float): Maximum time to wait in seconds
+            Returns:
+                bool: True if a reading arrived
+        """
+        return self.clock.wait(self.changed, timeout)
+
+    def snapshot(self):
+        """
+        Returns the latest readings and consumes the latched button presses.
+            Parameters:
+                None
+            Returns:
+                SensorSnapshot: Readings at the current time
+        """
+        self.changed.clear()
+        # pymata4 does not call back when a sonar stops getting an echo (reads 0),
+        # so the sonar values are reconciled against the board's own cache
+        for trig in self.sonarValues:
+            cached = self.board.sonar_read(trig)
+            if cached is not None and cached[0] != self.sonarValues[trig][0]:
+                self.sonarValues[trig] = [cached[0], self.clock.monotonic()]
+        if self.ldrValue[0] is None:
+            # A board delivering its reports when read, as the simulated one does, has the chance to
+            self.board.analog_read(self.ldrPin)
+
+        with self.lock:
+            pressed = [self.buttonPresses[pin] > 0 for pin in self.buttonPins]
+            for pin in self.buttonPins:
+                self.buttonPresses[pin] = 0
+
+        # Take each distance with the time it was reported if the reports are timestamped,
+        # a sonar that never reported counts as reporting long ago
+        distances = []
+        reportTimes = []
+        for trig, _, _ in self.sonarPins:
+            report = self.sonarReports[trig]
+            if report is None:
+                report = [self.sonarValues[trig][0], float("-inf") if self.sonarHooked else None]
+            distances.append(report[0])
+            reportTimes.append(report[1])
+
+        pinA, pinB = self.buttonPins
+        return SensorSnapshot(
+            self.clock.monotonic(),
+            *distances,
+            self.buttonValues[pinA][0], self.buttonValues[pinB][0],
+            pressed[0], pressed[1],
+            self.ldrValue[0],
+            *reportTimes,
+        )
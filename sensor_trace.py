@@ -0,0 +1,274 @@
+import json
+import mmap
+import struct
+import sys
+from math import isnan, nan
+
+from sensor_inputs import SensorSnapshot
+from traffic_controller import IntersectionConfig, TrafficController
+
+# File header: magic, format version, record size, wall clock minus monotonic clock at the
+# start and length of the intersection's configuration, which follows as JSON
+headerStruct = struct.Struct("<8sHHdI")
+traceMagic = b"TRTRACE\x00"
+traceVersion = 4
+
+# One record per tick, in SensorSnapshot field order: time, US1, US3, US4 distances,
+# PB1A and PB1B levels, PB1A and PB1B presses since the previous tick, LDR value and
+# the times US1, US3 and US4 last reported, NaN if unknown
+recordStruct = struct.Struct("<d3f4BH3d")
+
+# LDR value recorded while the reading is unknown, above any 10-bit analog reading
+unknownLdrValue = 0xFFFF
+
+# Seconds of trace time between two flushes of the recorder's file buffer
+flushInterval = 1.0
+
+
+class TraceRecorder:
+    """
+    Appends the raw sensor readings of every controller tick to a binary trace file.
+    Records have a fixed size, so the file can be memory mapped and read back by
+    TraceReader without parsing. The header keeps the intersection's configuration,
+    so a trace replays with the thresholds and timings it was recorded with.
+    """
+
+    def __init__(self, path, clock, config=None):
+        """
+        Creates a new trace file and writes its header.
+            Parameters:
+                path (str): File to write
+                clock (RealClock or VirtualClock): Clock the controller runs on
+                config (IntersectionConfig or None): Configuration of the controller, the defaults if None
+            Returns:
+                None
+        """
+        self.path = path
+        self.file = open(path, "wb")
+        configJson = json.dumps((config if config is not None else IntersectionConfig())._asdict()).encode()
+        self.file.write(headerStruct.pack(traceMagic, traceVersion, recordStruct.size,
+                                          clock.time() - clock.monotonic(), len(configJson)))
+        self.file.write(configJson)
+        self.records = 0
+        self.lastFlush = float("-inf")
+
+    def record(self, snapshot):
+        """
+        Appends one tick's readings.
+            Parameters:
+                snapshot (SensorSnapshot): Readings the controller acted on
+            Returns:
+                None
+        """
+        self.file.write(recordStruct.pack(
+            snapshot.time,
+            snapshot.distanceCm1, snapshot.distanceCm3, snapshot.distanceCm4,
+            snapshot.pb1AState, snapshot.pb1BState,
+            snapshot.pb1APressed, snapshot.pb1BPressed,
+            unknownLdrValue if snapshot.ldrValue is None else snapshot.ldrValue,
+            *(nan if reportTime is None else reportTime
+              for reportTime in (snapshot.reportTime1, snapshot.reportTime3, snapshot.reportTime4)),
+        ))
+        self.records += 1
+        if snapshot.time - self.lastFlush >= flushInterval:
+            self.file.flush()
+            self.lastFlush = snapshot.time
+
+    def close(self):
+        """
+        Flushes and closes the trace file.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.file.close()
+
+
+class TraceReader:
+    """
+    Reads a trace file through a memory map. A record cut short by a crash while
+    recording is ignored.
+    """
+
+    def __init__(self, path):
+        """
+        Opens and validates a trace file.
+            Parameters:
+                path (str): File written by TraceRecorder
+            Returns:
+                None
+        """
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < headerStruct.size:
+            self.close()
+            raise ValueError(f"{path} is not a sensor trace")
+        magic, version, recordSize, self.wallOffset, configLength = headerStruct.unpack_from(self.map, 0)
+        if magic != traceMagic or version != traceVersion or recordSize != recordStruct.size:
+            self.close()
+            raise ValueError(f"{path} is not a version {traceVersion} sensor trace")
+        self.offset = headerStruct.size + configLength
+
+        # Configuration the trace was recorded with, fields this version does not know are
+        # dropped and fields it added take their defaults
+        entries = json.loads(bytes(self.map[headerStruct.size:self.offset]))
+        self.config = IntersectionConfig(**{name: value for name, value in entries.items()
+                                            if name in IntersectionConfig._fields})
+        self.count = (len(self.map) - self.offset) // recordStruct.size
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    def __iter__(self):
+        """
+        Yields the recorded readings in order.
+            Parameters:
+                None
+            Returns:
+                iterator of SensorSnapshot: One snapshot per recorded tick
+        """
+        view = memoryview(self.map)[self.offset:self.offset + self.count * recordStruct.size]
+        records = recordStruct.iter_unpack(view)
+        try:
+            for fields in records:
+                reportTimes = tuple(None if isnan(reportTime) else reportTime for reportTime in fields[9:])
+                ldrValue = None if fields[8] == unknownLdrValue else fields[8]
+                yield SensorSnapshot._make(fields[:6] + (bool(fields[6]), bool(fields[7]), ldrValue) + reportTimes)
+        finally:
+            del records
+            view.release()
+
+    def columns(self):
+        """
+        Returns the whole trace as a NumPy structured array without copying it, for
+        batch processing such as distance_filter.filter_trace(). Unknown LDR readings
+        read as unknownLdrValue and unknown report times as NaN.
+            Parameters:
+                None
+            Returns:
+                numpy.ndarray: One row per record with a column per SensorSnapshot field
+        """
+        import numpy as np
+
+        dtype = np.dtype([
+            ("time", "<f8"),
+            ("distanceCm1", "<f4"), ("distanceCm3", "<f4"), ("distanceCm4", "<f4"),
+            ("pb1AState", "u1"), ("pb1BState", "u1"),
+            ("pb1APressed", "u1"), ("pb1BPressed", "u1"),
+            ("ldrValue", "<u2"),
+            ("reportTime1", "<f8"), ("reportTime3", "<f8"), ("reportTime4", "<f8"),
+        ])
+        return np.frombuffer(self.map, dtype=dtype, count=self.count, offset=self.offset)
+
+    def close(self):
+        """
+        Unmaps and closes the trace file.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.map.close()
+        self.file.close()
+
+
+class ReplayClock:
+    """
+    Clock set to the time of the record being replayed.
+    """
+
+    def __init__(self, wallOffset):
+        """
+        Creates a clock at time zero.
+            Parameters:
+                wallOffset (float): Wall clock minus monotonic clock when the trace was recorded
+            Returns:
+                None
+        """
+        self.now = 0.0
+        self.wallOffset = wallOffset
+
+    def time(self):
+        """
+        Returns the wall clock time at which the current record was taken.
+            Parameters:
+                None
+            Returns:
+                float: Seconds since the epoch
+        """
+        return self.now + self.wallOffset
+
+    def monotonic(self):
+        """
+        Returns the monotonic time of the current record.
+            Parameters:
+                None
+            Returns:
+                float: Seconds from the recording's monotonic origin
+        """
+        return self.now
+
+
+class ReplayBoard:
+    """
+    Stand-in for the board during a replay, the buzzer calls are the only board
+    access made by the controller's decision logic.
+    """
+
+    def play_tone_continuously(self, pin_number, frequency):
+        """
+        Ignores a tone, a replay produces LED frames only.
+            Parameters:
+                pin_number (int): Pin the buzzer is on
+                frequency (int): Frequency in Hz
+            Returns:
+                None
+        """
+
+    def play_tone_off(self, pin_number):
+        """
+        Ignores the end of a tone.
+            Parameters:
+                pin_number (int): Pin the buzzer is on
+            Returns:
+                None
+        """
+
+
+def replay(path, config=None):
+    """
+    Feeds a trace through the controller's decision logic as fast as possible.
+        Parameters:
+            path (str): File written by TraceRecorder
+            config (IntersectionConfig or None): Configuration to replay with, the one recorded in the trace if None
+        Returns:
+            list of tuple: (monotonic time, LED word) every time the resolved frame changed
+    """
+    frames = []
+    with TraceReader(path) as reader:
+        clock = ReplayClock(reader.wallOffset)
+        controller = TrafficController(ReplayBoard(), clock, config=config if config is not None else reader.config)
+        controller.reset_layers()
+        lastFrame = None
+        for snapshot in reader:
+            clock.now = snapshot.time
+            controller.process(snapshot)
+            frame = controller.compositor.resolve()
+            if frame != lastFrame:
+                frames.append((snapshot.time, frame))
+                lastFrame = frame
+    return frames
+
+
+if __name__ == "__main__":
+    # Prints the LED frames of a trace, one line per change, so two versions of the
+    # controller can be compared with diff
+    for frameTime, frame in replay(sys.argv[1]):
+        print(f"{frameTime:.3f} {frame:06x}")
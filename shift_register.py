@@ -0,0 +1,186 @@
+# Firmata command byte for a digital port message, the port number is added to it
+digitalMessage = 0x90
+
+# Length in bytes of a digital port message
+digitalMessageBytes = 3
+
+
+class ShiftRegisterDriver:
+    """
+    Drives a chain of 74HC595 shift registers from a 24-bit LED word.
+
+    The driver remembers the last frame it latched and sends nothing when asked to
+    flush the same frame again. When the data, clock and latch pins share a port,
+    each clock edge is a single Firmata port message carrying both the data and
+    the clock level, so a frame costs two messages per bit plus one for the latch.
+    Otherwise it falls back to pin-level writes, skipping data writes for bits
+    equal to the previous one.
+
+    This falls short of cutting the traffic of a changed frame by an order of
+    magnitude: FirmataExpress has no shift-out command, so every bit still needs a
+    clock low and a clock high message and a frame costs 49 messages (147 bytes)
+    instead of the 74 (222 bytes) of bit-banging pins, about 1.5 times fewer. Only
+    unchanged frames, which cost nothing, get a larger cut. Going further needs a
+    firmware with a shift-out sysex sending the whole word in one message.
+    """
+
+    def __init__(self, board, dataPin, latchPin, clockPin, bits=24):
+        """
+        Creates a driver for the shift register chain on the given pins.
+            Parameters:
+                board (Pymata4): Board the shift registers are wired to
+                dataPin (int): Serial data pin
+                latchPin (int): Storage register clock pin
+                clockPin (int): Shift register clock pin
+                bits (int): Number of outputs across the whole chain
+            Returns:
+                None
+        """
+        self.board = board
+        self.dataPin = dataPin
+        self.latchPin = latchPin
+        self.clockPin = clockPin
+        self.bits = bits
+
+        self.port = dataPin // 8
+        self.portWrites = (latchPin // 8 == self.port and clockPin // 8 == self.port
+                           and hasattr(board, "_send_command"))
+        self.dataMask = 1 << (dataPin % 8)
+        self.latchMask = 1 << (latchPin % 8)
+        self.clockMask = 1 << (clockPin % 8)
+
+        # Frame currently held by the storage registers, None until the first flush
+        self.latchedFrame = None
+
+        # Outbound traffic counters
+        self.framesSent = 0
+        self.messagesSent = 0
+        self.bytesSent = 0
+        self.lastFrameMessages = 0
+        self.lastFrameBytes = 0
+
+    def attach(self, board):
+        """
+        Switches to a new connection to the board. The storage registers may have been
+        reset with it, so the next flush sends its frame even if it was latched before.
+            Parameters:
+                board (Pymata4): Newly connected board
+            Returns:
+                None
+        """
+        self.board = board
+        self.portWrites = (self.latchPin // 8 == self.port and self.clockPin // 8 == self.port
+                           and hasattr(board, "_send_command"))
+        self.invalidate()
+
+    def port_pins(self):
+        """
+        Returns the list holding the board's digital output port images, which
+        pymata4 keeps so that pin-level writes preserve the rest of the port.
+            Parameters:
+                None
+            Returns:
+                list of int: Output level bitmap per port
+        """
+        portPins = getattr(self.board, "digital_output_port_pins", None)
+        if portPins is None:
+            from pymata4.private_constants import PrivateConstants
+            portPins = PrivateConstants.DIGITAL_OUTPUT_PORT_PINS
+        return portPins
+
+    def write_port(self, portPins, value):
+        """
+        Sends one digital port message for the shift register port.
+            Parameters:
+                portPins (list of int): Board output port images to keep in sync
+                value (int): Output level bitmap for the port
+            Returns:
+                None
+        """
+        portPins[self.port] = value
+        self.board._send_command((digitalMessage + self.port, value & 0x7f, (value >> 7) & 0x7f))
+        self.lastFrameMessages += 1
+        self.lastFrameBytes += digitalMessageBytes
+
+    def write_pin(self, pin, value):
+        """
+        Sends one pin-level digital write.
+            Parameters:
+                pin (int): Digital pin number
+                value (int): Output level, 0 or 1
+            Returns:
+                None
+        """
+        self.board.digital_write(pin, value)
+        self.lastFrameMessages += 1
+        self.lastFrameBytes += digitalMessageBytes
+
+    def flush(self, frame):
+        """
+        Shifts out and latches a frame if it differs from the one already latched.
+            Parameters:
+                frame (int): LED word, bit i drives shift register output i
+            Returns:
+                bool: True if the frame was sent, False if it was already latched
+        """
+        if frame == self.latchedFrame:
+            return False
+
+        self.lastFrameMessages = 0
+        self.lastFrameBytes = 0
+        if self.portWrites:
+            self.shift_out_port(frame)
+        else:
+            self.shift_out_pins(frame)
+        self.latchedFrame = frame
+
+        self.framesSent += 1
+        self.messagesSent += self.lastFrameMessages
+        self.bytesSent += self.lastFrameBytes
+        return True
+
+    def shift_out_port(self, frame):
+        """
+        Shifts a frame out most significant bit first using port messages.
+            Parameters:
+                frame (int): LED word to send
+            Returns:
+                None
+        """
+        portPins = self.port_pins()
+        base = portPins[self.port] & ~(self.dataMask | self.latchMask | self.clockMask)
+        for i in range(self.bits - 1, -1, -1):
+            level = base | (self.dataMask if (frame >> i) & 1 else 0)
+            # Clock low with the next data bit, then clock high to shift it in
+            self.write_port(portPins, level)
+            self.write_port(portPins, level | self.clockMask)
+        self.write_port(portPins, level | self.clockMask | self.latchMask)
+
+    def shift_out_pins(self, frame):
+        """
+        Shifts a frame out most significant bit first using pin-level writes.
+            Parameters:
+                frame (int): LED word to send
+            Returns:
+                None
+        """
+        self.write_pin(self.latchPin, 0)
+        data = None
+        for i in range(self.bits - 1, -1, -1):
+            bit = (frame >> i) & 1
+            self.write_pin(self.clockPin, 0)
+            if bit != data:
+                self.write_pin(self.dataPin, bit)
+                data = bit
+            self.write_pin(self.clockPin, 1)
+        self.write_pin(self.latchPin, 1)
+
+    def invalidate(self):
+        """
+        Forgets the latched frame so the next flush is always sent.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.latchedFrame = None
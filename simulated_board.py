@@ -0,0 +1,814 @@
+import heapq
+import time
+
+import traffic_controller
+from board_transport import endSysex, split_messages, startSysex
+from sampling_manager import analogReportBytes, sonarReportBytes
+from traffic_controller import TrafficController, create_event_log
+
+
+class VirtualClock:
+    """
+    Clock whose time only moves when the controller sleeps, so a simulation runs
+    as fast as the CPU allows. Callbacks can be scheduled at virtual times to script
+    sensor changes.
+    """
+
+    def __init__(self, start=0.0):
+        """
+        Creates a clock starting at the given virtual time.
+            Parameters:
+                start (float): Initial virtual time in seconds
+            Returns:
+                None
+        """
+        self.now = start
+        self.timers = []
+        self.timerCount = 0
+
+    def time(self):
+        """
+        Returns the current virtual time.
+            Parameters:
+                None
+            Returns:
+                float: Virtual time in seconds
+        """
+        return self.now
+
+    def monotonic(self):
+        """
+        Returns the current virtual time, which never goes backwards.
+            Parameters:
+                None
+            Returns:
+                float: Virtual time in seconds
+        """
+        return self.now
+
+    def call_at(self, when, callback):
+        """
+        Schedules a callback to run once the clock reaches the given time.
+            Parameters:
+                when (float): Virtual time at which to run the callback
+                callback (callable): Function called with no arguments
+            Returns:
+                None
+        """
+        heapq.heappush(self.timers, (when, self.timerCount, callback))
+        self.timerCount += 1
+
+    def advance_to(self, when):
+        """
+        Moves the clock forward, running every callback that falls due on the way.
+            Parameters:
+                when (float): Virtual time to advance to
+            Returns:
+                None
+        """
+        while self.timers and self.timers[0][0] <= when:
+            dueTime, _, callback = heapq.heappop(self.timers)
+            self.now = max(self.now, dueTime)
+            callback()
+        self.now = max(self.now, when)
+
+    def wait(self, event, timeout):
+        """
+        Advances virtual time until the event is set or the timeout expires.
+            Parameters:
+                event (threading.Event): Event to wait for
+                timeout (float): Maximum time to wait in seconds
+            Returns:
+                bool: True if the event was set
+        """
+        endTime = self.now + timeout
+        while not event.is_set() and self.timers and self.timers[0][0] <= endTime:
+            dueTime, _, callback = heapq.heappop(self.timers)
+            self.now = max(self.now, dueTime)
+            callback()
+        if not event.is_set():
+            self.now = max(self.now, endTime)
+        return event.is_set()
+
+    def sleep(self, seconds):
+        """
+        Advances virtual time instead of blocking.
+            Parameters:
+                seconds (float): Time to sleep
+            Returns:
+                None
+        """
+        self.advance_to(self.now + seconds)
+
+
+class SimulatedPort:
+    """
+    Serial port of a SimulatedBoard, answering the checks made by board_supervisor.board_alive.
+    """
+
+    def __init__(self, board):
+        """
+        Creates the port of a board.
+            Parameters:
+                board (SimulatedBoard): Board the port belongs to
+            Returns:
+                None
+        """
+        self.board = board
+        self.port = "simulated"
+
+    def write(self, data):
+        """
+        Delivers bytes to the board, one system call on a real port.
+            Parameters:
+                data (bytes): Firmata messages
+            Returns:
+                int: Number of bytes written
+        """
+        if not self.board.connected:
+            raise OSError("device disconnected")
+        self.board.writes += 1
+        self.board.receive(data)
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        """
+        Returns the number of bytes waiting to be read, the board never sends any.
+            Parameters:
+                None
+            Returns:
+                int: Always 0, raises OSError while the board is unplugged
+        """
+        if not self.board.connected:
+            raise OSError("device disconnected")
+        return 0
+
+    @property
+    def is_open(self):
+        """
+        Checks whether the port is still open.
+            Parameters:
+                None
+            Returns:
+                bool: False once the board was shut down
+        """
+        return not self.board.isShutdown
+
+
+class SimulatedBoard:
+    """
+    Stand-in for pymata4.Pymata4 implementing the calls made by the traffic controller.
+
+    Sensor values are set directly or scripted against a VirtualClock. Digital writes
+    to the shift register pins are decoded into the frame latched by the three
+    74HC595s, and every outbound Firmata message is counted.
+    """
+
+    # Pin types reported as the first item of a callback's data list
+    inputPinType = 0
+    analogPinType = 2
+    sonarPinType = 12
+
+    # Firmata command bytes decoded by the simulation
+    digitalMessage = 0x90
+    setPinMode = 0xF4
+    sonarConfig = 0x62
+    sonarData = 0x63
+    analogMessage = 0xE0
+    toneData = 0x5F
+    reportAnalog = 0xC0
+    samplingIntervalCommand = 0x7A
+
+    def __init__(self, clock=None, dataPin=traffic_controller.dataPin, latchPin=traffic_controller.latchPin,
+                 clockPin=traffic_controller.clockPin, registerBits=traffic_controller.ledCount):
+        """
+        Creates a board with every input at its power-on value.
+            Parameters:
+                clock (VirtualClock): Clock used to timestamp readings and script changes
+                dataPin (int): Serial data pin of the shift register chain
+                latchPin (int): Storage register clock pin of the shift register chain
+                clockPin (int): Shift register clock pin of the shift register chain
+                registerBits (int): Total number of outputs across the chain
+            Returns:
+                None
+        """
+        self.clock = clock if clock is not None else VirtualClock()
+        self.dataPin = dataPin
+        self.latchPin = latchPin
+        self.clockPin = clockPin
+        self.registerMask = (1 << registerBits) - 1
+
+        self.pinModes = {}
+        self.outputPins = {}
+        self.sonarValues = {}
+        self.digitalValues = {}
+        self.analogValues = {}
+        self.callbacks = {}
+        self.analogDifferentials = {}
+
+        # Handlers of the reports received from the board, keyed by sysex command as in
+        # pymata4, and the sonars scripted to stop reporting
+        self.report_dispatch = {self.sonarData: [self.sonar_report, 3],
+                                self.analogMessage: [self.analog_report, 2]}
+        self.silentSonars = set()
+
+        # Level on each analog input and whether the firmware reports it
+        self.analogLevels = {}
+        self.analogReporting = {}
+
+        # Firmata sampling interval in milliseconds, pymata4 sets 19 when it connects,
+        # and the estimated report traffic received from the board so far
+        self.samplingInterval = 19
+        self.receivedBytes = 0.0
+        self.accountedTime = self.clock.time()
+
+        # Output level bitmap per port, as kept by pymata4 for digital_write
+        self.digital_output_port_pins = [0] * 16
+
+        # Shift register chain
+        self.shiftRegister = 0
+        self.latchedFrame = 0
+        self.frameLog = []
+
+        # Buzzer
+        self.toneFrequencies = {}
+
+        # Outbound traffic counters, writes counts the writes to the serial port
+        self.messagesSent = 0
+        self.bytesSent = 0
+        self.writes = 0
+
+        self.isShutdown = False
+
+        # Cleared while the board is scripted as unplugged
+        self.connected = True
+        self.serial_port = SimulatedPort(self)
+        self.connections = 1
+
+    def _send_command(self, command):
+        """
+        Writes a non-sysex Firmata command to the serial port, as pymata4 does.
+            Parameters:
+                command (sequence of int): Command bytes
+            Returns:
+                int: Number of bytes sent
+        """
+        try:
+            return self.serial_port.write(bytes(command))
+        except OSError:
+            raise RuntimeError('write fail in _send_command')
+
+    def _send_sysex(self, sysex_command, sysex_data=None):
+        """
+        Writes a Firmata sysex command to the serial port, as pymata4 does.
+            Parameters:
+                sysex_command (int): Sysex command byte
+                sysex_data (list of int): Sysex payload
+            Returns:
+                None
+        """
+        self._send_command([startSysex, sysex_command] + list(sysex_data or []) + [endSysex])
+
+    def receive(self, data):
+        """
+        Decodes the bytes written to the serial port.
+            Parameters:
+                data (bytes): One or more Firmata messages
+            Returns:
+                None
+        """
+        for message in split_messages(data):
+            if message[0] == startSysex:
+                self.receive_sysex(message[1], list(message[2:-1]))
+            else:
+                self.receive_command(message)
+
+    def receive_command(self, command):
+        """
+        Acts on a non-sysex Firmata command.
+            Parameters:
+                command (bytes): Command bytes
+            Returns:
+                None
+        """
+        self.messagesSent += 1
+        self.bytesSent += len(command)
+        if self.digitalMessage <= command[0] < self.digitalMessage + 16:
+            port = command[0] - self.digitalMessage
+            value = command[1] | (command[2] << 7)
+            for pin in range(port * 8, port * 8 + 8):
+                if self.pinModes.get(pin) == "output":
+                    self.drive_pin(pin, (value >> (pin % 8)) & 1)
+        elif self.reportAnalog <= command[0] < self.reportAnalog + 16:
+            pin = command[0] - self.reportAnalog
+            self.account_received()
+            self.analogReporting[pin] = bool(command[1])
+            # The firmware sends the current level on its next sampling interval
+            self.report_analog(pin)
+
+    def receive_sysex(self, sysex_command, sysex_data):
+        """
+        Acts on a Firmata sysex command.
+            Parameters:
+                sysex_command (int): Sysex command byte
+                sysex_data (list of int): Sysex payload
+            Returns:
+                None
+        """
+        self.messagesSent += 1
+        self.bytesSent += len(sysex_data) + 3
+        if sysex_command == self.samplingIntervalCommand:
+            self.account_received()
+            self.samplingInterval = sysex_data[0] | (sysex_data[1] << 7)
+        elif sysex_command == self.toneData:
+            if len(sysex_data) > 2:
+                self.toneFrequencies[sysex_data[1]] = sysex_data[2] | (sysex_data[3] << 7)
+            else:
+                self.toneFrequencies[sysex_data[1]] = 0
+
+    # Pin configuration
+
+    def set_pin_mode_digital_output(self, pin_number):
+        """
+        Configures a pin as a digital output.
+            Parameters:
+                pin_number (int): Digital pin number
+            Returns:
+                None
+        """
+        self.pinModes[pin_number] = "output"
+        self.outputPins.setdefault(pin_number, 0)
+        self._send_command([self.setPinMode, pin_number, 1])
+
+    def set_pin_mode_digital_input(self, pin_number, callback=None):
+        """
+        Configures a pin as a digital input reporting its changes.
+            Parameters:
+                pin_number (int): Digital pin number
+                callback (callable or None): Called with [pin type, pin, value, time stamp] on a change
+            Returns:
+                None
+        """
+        self.pinModes[pin_number] = "input"
+        self.digitalValues.setdefault(pin_number, [0, 0])
+        self.callbacks[("digital", pin_number)] = callback
+        self._send_command([self.setPinMode, pin_number, 0])
+
+    def set_pin_mode_pwm_output(self, pin_number):
+        """
+        Configures a pin as a PWM output, as needed for the buzzer tones.
+            Parameters:
+                pin_number (int): Digital pin number
+            Returns:
+                None
+        """
+        self.pinModes[pin_number] = "pwm"
+        self._send_command([self.setPinMode, pin_number, 3])
+
+    def set_pin_mode_analog_input(self, pin_number, callback=None, differential=1):
+        """
+        Configures an analog input and starts its reporting.
+            Parameters:
+                pin_number (int): Analog pin number
+                callback (callable or None): Called with [pin type, pin, value, time stamp] on a change
+                differential (int): Smallest change of the value that is reported
+            Returns:
+                None
+        """
+        self.pinModes[("analog", pin_number)] = "analog"
+        self.analogValues.setdefault(pin_number, [0, 0])
+        self.callbacks[("analog", pin_number)] = callback
+        self.analogDifferentials[pin_number] = differential
+        self._send_command([self.setPinMode, pin_number, 2])
+        self.account_received()
+        self.analogReporting[pin_number] = True
+        self.report_analog(pin_number)
+
+    def set_pin_mode_sonar(self, trigger_pin, echo_pin, callback=None, timeout=80000):
+        """
+        Configures an HC-SR04 sonar.
+            Parameters:
+                trigger_pin (int): Trigger pin, identifies the sonar
+                echo_pin (int): Echo pin
+                callback (callable or None): Called with [pin type, trigger pin, distance, time stamp] on a change
+                timeout (int): Echo timeout in microseconds
+            Returns:
+                None
+        """
+        self.pinModes[trigger_pin] = "sonar"
+        self.pinModes[echo_pin] = "sonar"
+        self.sonarValues.setdefault(trigger_pin, [0, 0])
+        self.callbacks[("sonar", trigger_pin)] = callback
+        self._send_sysex(self.sonarConfig, [trigger_pin, echo_pin, timeout & 0x7f, (timeout >> 7) & 0x7f])
+
+    # Reads, matching the [value, time_stamp] lists returned by pymata4
+
+    def sonar_report(self, data):
+        """
+        Handles a sonar report, pymata4 updates its cache and calls back on a change,
+        which set_distance() already does.
+            Parameters:
+                data (list of int): Trigger pin and the distance's 7-bit halves, least significant first
+            Returns:
+                None
+        """
+
+    def analog_report(self, data):
+        """
+        Handles an analog report, pymata4 calls back past the pin's differential,
+        which report_analog() already does.
+            Parameters:
+                data (list of int): Pin and the value's 7-bit halves, least significant first
+            Returns:
+                None
+        """
+
+    def sonar_read(self, trigger_pin):
+        """
+        Returns the last distance of a sonar.
+            Parameters:
+                trigger_pin (int): Trigger pin identifying the sonar
+            Returns:
+                list: [distance in cm, time stamp of the last change]
+        """
+        # The firmware reports every sonar continuously, the report due is delivered when
+        # the distance is read rather than scheduling one event per sampling interval
+        distanceCm = self.sonarValues[trigger_pin][0]
+        if self.connected and trigger_pin not in self.silentSonars and self.pinModes.get(trigger_pin) == "sonar":
+            self.report_dispatch[self.sonarData][0]([trigger_pin, distanceCm & 0x7f, distanceCm >> 7])
+        return list(self.sonarValues[trigger_pin])
+
+    def digital_read(self, pin):
+        """
+        Returns the last level of a digital input.
+            Parameters:
+                pin (int): Digital pin number
+            Returns:
+                list: [level, time stamp of the last change]
+        """
+        return list(self.digitalValues[pin])
+
+    def analog_read(self, pin):
+        """
+        Returns the last reported value of an analog input.
+            Parameters:
+                pin (int): Analog pin number
+            Returns:
+                list: [value, time stamp of the last report]
+        """
+        # As for the sonars, the report due from a reporting pin is delivered when read
+        if self.connected and self.analogReporting.get(pin) and ("analog", pin) in self.pinModes:
+            value = self.analogLevels.get(pin, self.analogValues[pin][0])
+            self.report_dispatch[self.analogMessage][0]([pin, value & 0x7f, value >> 7])
+        return list(self.analogValues[pin])
+
+    # Writes
+
+    def digital_write(self, pin, value):
+        """
+        Sets one output pin, sent as a message for its whole port as pymata4 does.
+            Parameters:
+                pin (int): Digital pin number
+                value (int): Output level, 0 or 1
+            Returns:
+                None
+        """
+        port = pin // 8
+        mask = 1 << (pin % 8)
+        if value == 1:
+            self.digital_output_port_pins[port] |= mask
+        else:
+            self.digital_output_port_pins[port] &= ~mask
+        portValue = self.digital_output_port_pins[port]
+        self._send_command((self.digitalMessage + port, portValue & 0x7f, (portValue >> 7) & 0x7f))
+
+    def drive_pin(self, pin, value):
+        """
+        Applies a new output level and emulates the shift register chain on edges.
+            Parameters:
+                pin (int): Digital pin number
+                value (int): New level, 0 or 1
+            Returns:
+                None
+        """
+        previous = self.outputPins.get(pin, 0)
+        self.outputPins[pin] = value
+        if previous == 0 and value == 1:
+            if pin == self.clockPin:
+                data = self.outputPins.get(self.dataPin, 0)
+                self.shiftRegister = ((self.shiftRegister << 1) | data) & self.registerMask
+            elif pin == self.latchPin:
+                self.latchedFrame = self.shiftRegister
+                self.frameLog.append((self.clock.time(), self.latchedFrame))
+
+    def set_sampling_interval(self, interval):
+        """
+        Sets the Firmata sampling interval.
+            Parameters:
+                interval (int): Milliseconds between two samples
+            Returns:
+                None
+        """
+        self._send_sysex(self.samplingIntervalCommand, [interval & 0x7f, (interval >> 7) & 0x7f])
+
+    def play_tone_continuously(self, pin_number, frequency):
+        """
+        Starts a tone on a PWM pin.
+            Parameters:
+                pin_number (int): Pin the buzzer is on
+                frequency (int): Frequency in Hz
+            Returns:
+                None
+        """
+        self._send_sysex(self.toneData, [0, pin_number, frequency & 0x7f, (frequency >> 7) & 0x7f, 0, 0])
+
+    def play_tone_off(self, pin_number):
+        """
+        Stops the tone on a pin.
+            Parameters:
+                pin_number (int): Pin the buzzer is on
+            Returns:
+                None
+        """
+        self._send_sysex(self.toneData, [1, pin_number])
+
+    def shutdown(self):
+        """
+        Closes the connection to the board.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.isShutdown = True
+
+    def reopen(self):
+        """
+        Connects to the board again after it was unplugged. The board comes back from
+        a reset, with its pins unconfigured and the buzzer silent, while the shift
+        registers still hold the last latched frame.
+            Parameters:
+                None
+            Returns:
+                SimulatedBoard: This board
+        """
+        if not self.connected:
+            raise RuntimeError('No Arduino Found or User Aborted Program')
+        self.account_received()
+        self.pinModes = {}
+        self.outputPins = {}
+        self.callbacks = {}
+        self.toneFrequencies = {}
+        self.analogReporting = {}
+        self.samplingInterval = 19
+        self.isShutdown = False
+        self.connections += 1
+        return self
+
+    # Inbound traffic
+
+    def account_received(self):
+        """
+        Adds the reports the firmware sent since the last call at the current settings:
+        one sonar per sampling interval and every reporting analog input.
+            Parameters:
+                None
+            Returns:
+                float: Estimated bytes received so far
+        """
+        now = self.clock.time()
+        sonars = 1 if self.sonarValues else 0
+        analogs = sum(1 for pin, reporting in self.analogReporting.items()
+                      if reporting and ("analog", pin) in self.pinModes)
+        perInterval = sonars * sonarReportBytes + analogs * analogReportBytes
+        self.receivedBytes += (now - self.accountedTime) * 1000 / self.samplingInterval * perInterval
+        self.accountedTime = now
+        return self.receivedBytes
+
+    def report_analog(self, pin):
+        """
+        Passes an analog level to pymata4's callback if the pin reports and the change
+        reaches the pin's differential.
+            Parameters:
+                pin (int): Analog pin number
+            Returns:
+                None
+        """
+        if not self.analogReporting.get(pin) or pin not in self.analogLevels or not self.connected:
+            return
+        value = self.analogLevels[pin]
+        previous = self.analogValues.get(pin, [0, 0])[0]
+        if abs(value - previous) < self.analogDifferentials.get(pin, 1):
+            return
+        self.analogValues[pin] = [value, self.clock.time()]
+        callback = self.callbacks.get(("analog", pin))
+        if callback:
+            callback([self.analogPinType, pin, value, self.clock.time()])
+
+    # Scenario scripting
+
+    def led(self, index):
+        """
+        Returns the level currently latched on one shift register output.
+            Parameters:
+                index (int): LED index as used by ledState
+            Returns:
+                int: 1 if the LED is lit, otherwise 0
+        """
+        return (self.latchedFrame >> index) & 1
+
+    def schedule(self, at, action):
+        """
+        Runs an action now, or at a virtual time if one is given.
+            Parameters:
+                at (float or None): Virtual time of the change
+                action (callable): Function applying the change
+            Returns:
+                None
+        """
+        if at is None:
+            action()
+        else:
+            self.clock.call_at(at, action)
+
+    def set_distance(self, trigger_pin, distanceCm, at=None):
+        """
+        Sets the distance reported by a sonar.
+            Parameters:
+                trigger_pin (int): Trigger pin identifying the sonar
+                distanceCm (int): Distance in centimetres, 0 for no echo
+                at (float or None): Virtual time of the change, immediate if None
+            Returns:
+                None
+        """
+        def apply():
+            changed = self.sonarValues.get(trigger_pin, [0, 0])[0] != distanceCm
+            self.sonarValues[trigger_pin] = [distanceCm, self.clock.time()]
+            # Like pymata4, only report changes and never report a missing echo
+            callback = self.callbacks.get(("sonar", trigger_pin))
+            if changed and distanceCm and callback and self.connected and trigger_pin not in self.silentSonars:
+                callback([self.sonarPinType, trigger_pin, distanceCm, self.clock.time()])
+        self.schedule(at, apply)
+
+    def set_digital(self, pin, value, at=None):
+        """
+        Sets the level seen on a digital input.
+            Parameters:
+                pin (int): Digital pin number
+                value (int): Input level, 0 or 1
+                at (float or None): Virtual time of the change, immediate if None
+            Returns:
+                None
+        """
+        def apply():
+            changed = self.digitalValues.get(pin, [0, 0])[0] != value
+            self.digitalValues[pin] = [value, self.clock.time()]
+            callback = self.callbacks.get(("digital", pin))
+            if changed and callback and self.connected:
+                callback([self.inputPinType, pin, value, self.clock.time()])
+        self.schedule(at, apply)
+
+    def set_analog(self, pin, value, at=None):
+        """
+        Sets the value seen on an analog input.
+            Parameters:
+                pin (int): Analog pin number
+                value (int): ADC reading, 0-1023
+                at (float or None): Virtual time of the change, immediate if None
+            Returns:
+                None
+        """
+        def apply():
+            self.analogLevels[pin] = value
+            self.report_analog(pin)
+        self.schedule(at, apply)
+
+    def disconnect(self, at, duration):
+        """
+        Scripts the board being unplugged and plugged back in.
+            Parameters:
+                at (float): Virtual time the board is unplugged
+                duration (float): Time until it can be connected again
+            Returns:
+                None
+        """
+        def unplug():
+            self.connected = False
+
+        def plug():
+            self.connected = True
+        self.schedule(at, unplug)
+        self.schedule(at + duration, plug)
+
+    def silence_sonar(self, trigger_pin, at=None):
+        """
+        Scripts a sonar that stops reporting, as a dead sensor does, while pymata4
+        keeps its last distance.
+            Parameters:
+                trigger_pin (int): Trigger pin identifying the sonar
+                at (float or None): Virtual time the sonar stops, immediate if None
+            Returns:
+                None
+        """
+        self.schedule(at, lambda: self.silentSonars.add(trigger_pin))
+
+    def press_button(self, pin, at, duration=0.2):
+        """
+        Scripts a button press and release.
+            Parameters:
+                pin (int): Digital pin of the button
+                at (float): Virtual time of the press
+                duration (float): Time the button is held down
+            Returns:
+                None
+        """
+        self.set_digital(pin, 1, at)
+        self.set_digital(pin, 0, at + duration)
+
+
+def overheight_scenario(board):
+    """
+    Overheight vehicle stops under US1 for 40 seconds, then drives off.
+        Parameters:
+            board (SimulatedBoard): Board to script
+        Returns:
+            float: Length of the scenario in seconds
+    """
+    board.set_distance(traffic_controller.trigPin1, 15, at=1.0)
+    board.set_distance(traffic_controller.trigPin1, 80, at=41.0)
+    return 50.0
+
+
+def pedestrian_scenario(board):
+    """
+    PB1A is pressed, then PB1B is pressed inside the 30 second lockout, latching a call
+    served when the lockout ends, and again while that crossing clears.
+        Parameters:
+            board (SimulatedBoard): Board to script
+        Returns:
+            float: Length of the scenario in seconds
+    """
+    board.press_button(traffic_controller.pb1A, at=1.0)
+    board.press_button(traffic_controller.pb1B, at=15.0)
+    board.press_button(traffic_controller.pb1B, at=45.0)
+    return 60.0
+
+
+def tunnel_override_scenario(board):
+    """
+    Overheight vehicle drives through US1, US3 and into the tunnel under US4.
+        Parameters:
+            board (SimulatedBoard): Board to script
+        Returns:
+            float: Length of the scenario in seconds
+    """
+    board.set_analog(traffic_controller.ldrPin, 400)
+    board.set_distance(traffic_controller.trigPin1, 15, at=1.0)
+    board.set_distance(traffic_controller.trigPin1, 80, at=5.0)
+    board.set_distance(traffic_controller.trigPin3, 12, at=6.0)
+    board.set_distance(traffic_controller.trigPin3, 80, at=16.0)
+    board.set_distance(traffic_controller.trigPin4, 10, at=17.0)
+    board.set_distance(traffic_controller.trigPin4, 80, at=30.0)
+    return 60.0
+
+
+scenarios = {
+    "overheight": overheight_scenario,
+    "pedestrian": pedestrian_scenario,
+    "tunnel_override": tunnel_override_scenario,
+}
+
+
+def run_scenario(scenario, quiet=True):
+    """
+    Runs a scripted scenario headless against a simulated board.
+        Parameters:
+            scenario (callable): Function scripting the board and returning its duration
+            quiet (bool): Discard the controller's events if True, print them otherwise
+        Returns:
+            tuple: The controller and simulated board after the run, and the wall time taken
+    """
+    clock = VirtualClock()
+    board = SimulatedBoard(clock)
+    events = create_event_log(clock, echo=not quiet)
+    controller = TrafficController(board, clock, events)
+    duration = scenario(board)
+
+    startTime = time.perf_counter()
+    controller.setup_board()
+    controller.initialise_leds()
+    controller.run(duration)
+    wallTime = time.perf_counter() - startTime
+    events.close()
+    return controller, board, wallTime
+
+
+if __name__ == "__main__":
+    for name, scenario in scenarios.items():
+        controller, board, wallTime = run_scenario(scenario)
+        simulatedTime = board.clock.time()
+        print(f"{name}: {simulatedTime:.1f} s simulated in {wallTime:.3f} s "
+              f"({simulatedTime / wallTime:.0f}x real time), {len(board.frameLog)} frames, "
+              f"{board.messagesSent} messages, {board.bytesSent} bytes in {board.writes} writes, "
+              f"{board.account_received():.0f} bytes received")
@@ -0,0 +1,580 @@
+import argparse
+import os
+import selectors
+import socket
+import struct
+import threading
+from collections import namedtuple
+
+# Controller state streamed after every tick: monotonic time in milliseconds, LED word,
+# smoothed US1, US3 and US4 distances in millimetres (0 without a reading), LDR value,
+# buzzer frequency (0 while off) and the phase of Subsystems 1-4 (0 while idle, else
+# the index of the running phase plus one)
+StateFrame = namedtuple("StateFrame", [
+    "timeMs", "ledState",
+    "distanceMm1", "distanceMm3", "distanceMm4",
+    "ldrValue", "buzzerFreq",
+    "s1Phase", "s2Phase", "s3Phase", "s4Phase",
+])
+
+# Sent once by a client after connecting: magic and the shortest interval between two
+# frames it wants in milliseconds, 0 for every tick
+subscribeStruct = struct.Struct("<2sI")
+subscribeMagic = b"TS"
+
+# Sent once by the server in reply: magic, format version, field count and wall clock
+# minus monotonic clock, so timeMs can be turned into wall clock time
+headerStruct = struct.Struct("<8sHHd")
+streamMagic = b"TRSTREAM"
+streamVersion = 1
+
+# A key frame carries every field, a delta frame a bit mask of the fields that changed
+# followed by one varint per changed field: the XOR for the LED word, the zigzag encoded
+# difference for the others
+keyFrameType = 0x4B
+deltaFrameType = 0x44
+keyFrameStruct = struct.Struct("<BQI5H4B")
+deltaMaskStruct = struct.Struct("<BH")
+ledField = StateFrame._fields.index("ledState")
+
+# Frames between two key frames sent to a subscriber, so a client can resynchronise
+keyFrameInterval = 100
+
+# Bytes read from a socket at a time
+readSize = 4096
+
+
+def capture(controller, now):
+    """
+    Reads the streamed state of a controller.
+        Parameters:
+            controller (TrafficController): Controller that just finished a tick
+            now (float): Monotonic time of the tick
+        Returns:
+            tuple: Field values in StateFrame order
+    """
+    return (
+        int(now * 1000), controller.ledState,
+        int((controller.distanceCm1 or 0) * 10),
+        int((controller.distanceCm3 or 0) * 10),
+        int((controller.distanceCm4 or 0) * 10),
+        controller.ldrValue or 0,
+        controller.buzzerFreq if controller.buzzerOn else 0,
+        phase_id(controller.s1Sequence), phase_id(controller.s2Sequence), phase_id(controller.s3Sequence),
+        1 if controller.s4Active else 0,
+    )
+
+
+def phase_id(sequence):
+    """
+    Returns the streamed phase of a light sequence.
+        Parameters:
+            sequence (PhaseSequence): Sequence of a subsystem
+        Returns:
+            int: 0 while idle, else the index of the current phase plus one
+    """
+    return 0 if sequence.index is None else sequence.index + 1
+
+
+def write_varint(out, value):
+    """
+    Appends an unsigned integer in 7-bit groups, least significant first.
+        Parameters:
+            out (bytearray): Buffer to append to
+            value (int): Non-negative integer
+        Returns:
+            None
+    """
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, position):
+    """
+    Reads an unsigned integer written by write_varint().
+        Parameters:
+            data (bytes): Buffer to read from
+            position (int): Offset of the first byte
+        Returns:
+            tuple: The value and the offset after it
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_key_frame(fields):
+    """
+    Encodes a frame carrying every field.
+        Parameters:
+            fields (tuple): Field values in StateFrame order
+        Returns:
+            bytes: The encoded frame
+    """
+    return keyFrameStruct.pack(keyFrameType, *fields)
+
+
+def encode_delta_frame(previous, fields):
+    """
+    Encodes the fields that changed since the previous frame sent to a client.
+        Parameters:
+            previous (tuple): Field values the client last received
+            fields (tuple): New field values
+        Returns:
+            bytes: The encoded frame
+    """
+    mask = 0
+    out = bytearray(deltaMaskStruct.size)
+    for i, (old, new) in enumerate(zip(previous, fields)):
+        if old == new:
+            continue
+        mask |= 1 << i
+        if i == ledField:
+            write_varint(out, old ^ new)
+        else:
+            difference = new - old
+            write_varint(out, difference << 1 if difference >= 0 else ((-difference) << 1) - 1)
+    deltaMaskStruct.pack_into(out, 0, deltaFrameType, mask)
+    return bytes(out)
+
+
+class StreamDecoder:
+    """
+    Turns the bytes received from a StateStreamServer back into frames.
+    """
+
+    def __init__(self):
+        """
+        Creates a decoder expecting the stream header.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.buffer = b""
+        self.wallOffset = None
+        self.previous = None
+
+    def feed(self, data):
+        """
+        Decodes every complete frame in the received bytes.
+            Parameters:
+                data (bytes): Bytes received from the server
+            Returns:
+                list of StateFrame: Frames completed by the data
+        """
+        buffer = self.buffer + data
+        position = 0
+        frames = []
+        if self.wallOffset is None:
+            if len(buffer) < headerStruct.size:
+                self.buffer = buffer
+                return frames
+            magic, version, fieldCount, self.wallOffset = headerStruct.unpack_from(buffer, 0)
+            if magic != streamMagic or version != streamVersion or fieldCount != len(StateFrame._fields):
+                raise ValueError(f"not a version {streamVersion} state stream")
+            position = headerStruct.size
+
+        while position < len(buffer):
+            frameType = buffer[position]
+            if frameType == keyFrameType:
+                if len(buffer) - position < keyFrameStruct.size:
+                    break
+                fields = keyFrameStruct.unpack_from(buffer, position)[1:]
+                position += keyFrameStruct.size
+            elif frameType == deltaFrameType:
+                try:
+                    fields, position = self.decode_delta(buffer, position)
+                except IndexError:
+                    break
+            else:
+                raise ValueError(f"unknown frame type {frameType:#x}")
+            self.previous = fields
+            frames.append(StateFrame._make(fields))
+        self.buffer = buffer[position:]
+        return frames
+
+    def decode_delta(self, buffer, position):
+        """
+        Applies a delta frame to the previous frame.
+            Parameters:
+                buffer (bytes): Received bytes
+                position (int): Offset of the delta frame
+            Returns:
+                tuple: The new field values and the offset after the frame
+        """
+        if self.previous is None:
+            raise ValueError("delta frame before the first key frame")
+        if len(buffer) - position < deltaMaskStruct.size:
+            raise IndexError("delta frame cut short")
+        _, mask = deltaMaskStruct.unpack_from(buffer, position)
+        position += deltaMaskStruct.size
+        fields = list(self.previous)
+        for i in range(len(fields)):
+            if not mask >> i & 1:
+                continue
+            value, position = read_varint(buffer, position)
+            if i == ledField:
+                fields[i] ^= value
+            else:
+                fields[i] += -((value + 1) >> 1) if value & 1 else value >> 1
+        return tuple(fields), position
+
+
+class Subscriber:
+    """
+    Connection of one client with its rate and the last frame it was sent.
+    """
+
+    def __init__(self, connection):
+        """
+        Creates the state of a newly accepted client.
+            Parameters:
+                connection (socket.socket): Non-blocking client socket
+            Returns:
+                None
+        """
+        self.connection = connection
+        self.request = b""
+        # Shortest time between two frames in milliseconds, None until subscribed
+        self.intervalMs = None
+        # Sequence number and fields of the last frame queued for the client
+        self.sentSeq = -1
+        self.sent = None
+        self.sentFrames = 0
+        # Bytes the socket did not take yet, no new frame is queued while there are any
+        self.pending = b""
+
+
+class StateStreamServer:
+    """
+    Streams the controller's state to local clients over TCP or a Unix domain socket.
+
+    After every tick the controller hands its state to publish(), which only stores
+    a tuple and, if the server thread is not already awake, wakes it; with no
+    subscribers it returns straight away. The server thread encodes and sends the
+    frames: each client gets a key frame, then delta frames against the last frame
+    it received, at most one per the interval it subscribed with. Clients on the
+    same footing share one encoding per tick, and a client that cannot keep up is
+    simply sent fewer frames, since each delta is taken against what it last got.
+    """
+
+    def __init__(self, controller, port=0, path=None, host="127.0.0.1"):
+        """
+        Creates the server without starting it.
+            Parameters:
+                controller (TrafficController): Controller whose state is streamed
+                port (int): TCP port to listen on, any free port if 0
+                path (str or None): Unix domain socket to listen on instead of TCP
+                host (str): Address to listen on, local only by default
+            Returns:
+                None
+        """
+        self.controller = controller
+        self.port = port
+        self.path = path
+        self.host = host
+
+        self.selector = None
+        self.listener = None
+        self.thread = None
+        self.running = False
+
+        # Newest (sequence number, fields) published by the controller
+        self.latest = None
+        self.sequence = 0
+        self.subscriberCount = 0
+        self.woken = False
+        self.wakeReader, self.wakeWriter = socket.socketpair()
+        self.wakeReader.setblocking(False)
+        self.wakeWriter.setblocking(False)
+
+        self.framesSent = 0
+        self.bytesSent = 0
+
+        metrics = controller.metrics
+        metrics.add_source("traffic_stream_subscribers", "gauge", "Clients subscribed to the state stream",
+                           None, lambda: self.subscriberCount)
+        metrics.add_source("traffic_stream_bytes_total", "counter", "Bytes sent to state stream clients",
+                           None, lambda: self.bytesSent)
+
+    def publish(self, controller, now):
+        """
+        Hands the state of a finished tick to the server thread, called by the controller.
+            Parameters:
+                controller (TrafficController): Controller that just finished a tick
+                now (float): Monotonic time of the tick
+            Returns:
+                None
+        """
+        if not self.subscriberCount:
+            return
+        self.latest = (self.sequence, capture(controller, now))
+        self.sequence += 1
+        if not self.woken:
+            self.woken = True
+            try:
+                self.wakeWriter.send(b"\0")
+            except BlockingIOError:
+                pass
+
+    def start(self):
+        """
+        Starts listening and serving in a daemon thread.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        if self.path is not None:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.listener.bind(self.path)
+        else:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind((self.host, self.port))
+            self.port = self.listener.getsockname()[1]
+        self.listener.listen()
+        self.listener.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ, "listener")
+        self.selector.register(self.wakeReader, selectors.EVENT_READ, "wake")
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, name="stateStream", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the server and disconnects every client.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.running = False
+        try:
+            self.wakeWriter.send(b"\0")
+        except BlockingIOError:
+            pass
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for key in list(self.selector.get_map().values()):
+            if isinstance(key.data, Subscriber):
+                key.fileobj.close()
+        self.selector.close()
+        self.listener.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+        self.subscriberCount = 0
+
+    def serve(self):
+        """
+        Server thread body: accepts clients, reads their subscriptions and sends them frames.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        timeout = None
+        while self.running:
+            for key, events in self.selector.select(timeout):
+                if key.data == "listener":
+                    self.accept()
+                elif key.data == "wake":
+                    try:
+                        self.wakeReader.recv(readSize)
+                    except BlockingIOError:
+                        pass
+                    self.woken = False
+                elif events & selectors.EVENT_READ:
+                    self.receive(key.data)
+                elif events & selectors.EVENT_WRITE:
+                    self.send(key.data, b"")
+            timeout = self.broadcast()
+
+    def accept(self):
+        """
+        Accepts a new client, which is sent nothing until it subscribes.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        try:
+            connection, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        connection.setblocking(False)
+        self.selector.register(connection, selectors.EVENT_READ, Subscriber(connection))
+
+    def receive(self, subscriber):
+        """
+        Reads a client's subscription, or notices it disconnected.
+            Parameters:
+                subscriber (Subscriber): Client with data to read
+            Returns:
+                None
+        """
+        try:
+            data = subscriber.connection.recv(readSize)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.drop(subscriber)
+            return
+        if subscriber.intervalMs is not None:
+            return
+        subscriber.request += data
+        if len(subscriber.request) < subscribeStruct.size:
+            return
+        magic, intervalMs = subscribeStruct.unpack_from(subscriber.request)
+        if magic != subscribeMagic:
+            self.drop(subscriber)
+            return
+        subscriber.intervalMs = intervalMs
+        self.subscriberCount += 1
+        clock = self.controller.clock
+        self.send(subscriber, headerStruct.pack(streamMagic, streamVersion, len(StateFrame._fields),
+                                                clock.time() - clock.monotonic()))
+
+    def drop(self, subscriber):
+        """
+        Disconnects a client.
+            Parameters:
+                subscriber (Subscriber): Client to drop
+            Returns:
+                None
+        """
+        self.selector.unregister(subscriber.connection)
+        subscriber.connection.close()
+        if subscriber.intervalMs is not None:
+            self.subscriberCount -= 1
+
+    def send(self, subscriber, data):
+        """
+        Sends bytes to a client, keeping what the socket does not take for later.
+            Parameters:
+                subscriber (Subscriber): Client to send to
+                data (bytes): Bytes to add after any still pending
+            Returns:
+                None
+        """
+        data = subscriber.pending + data
+        try:
+            sent = subscriber.connection.send(data) if data else 0
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.drop(subscriber)
+            return
+        self.bytesSent += sent
+        subscriber.pending = data[sent:]
+        self.selector.modify(subscriber.connection,
+                             selectors.EVENT_READ | (selectors.EVENT_WRITE if subscriber.pending else 0),
+                             subscriber)
+
+    def broadcast(self):
+        """
+        Sends the newest frame to every client that is due one.
+            Parameters:
+                None
+            Returns:
+                float or None: Seconds until a client held back by its interval is due, None if none is
+        """
+        if self.latest is None:
+            return None
+        sequence, fields = self.latest
+        timeMs = fields[0]
+        encodings = {}
+        timeout = None
+        for key in list(self.selector.get_map().values()):
+            subscriber = key.data
+            if not isinstance(subscriber, Subscriber) or subscriber.intervalMs is None:
+                continue
+            if subscriber.sentSeq == sequence or subscriber.pending:
+                continue
+            if subscriber.sent is not None:
+                wait = subscriber.sent[0] + subscriber.intervalMs - timeMs
+                if wait > 0:
+                    timeout = wait / 1000.0 if timeout is None else min(timeout, wait / 1000.0)
+                    continue
+
+            # Clients sent the same previous frame share the encoding of this one
+            keyFrame = subscriber.sent is None or subscriber.sentFrames % keyFrameInterval == 0
+            encodingKey = None if keyFrame else subscriber.sentSeq
+            data = encodings.get(encodingKey)
+            if data is None:
+                data = encode_key_frame(fields) if keyFrame else encode_delta_frame(subscriber.sent, fields)
+                encodings[encodingKey] = data
+            subscriber.sentSeq = sequence
+            subscriber.sent = fields
+            subscriber.sentFrames += 1
+            self.framesSent += 1
+            self.send(subscriber, data)
+        return timeout
+
+
+def parse_address(address):
+    """
+    Parses a server address given on the command line.
+        Parameters:
+            address (str): "host:port", a port on the local host, or the path of a Unix domain socket
+        Returns:
+            tuple: (socket family, address for connect())
+    """
+    host, _, port = address.rpartition(":")
+    if port.isdigit():
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+
+def subscribe(address, interval=0.0):
+    """
+    Connects to a StateStreamServer and yields its frames as they arrive.
+        Parameters:
+            address (str): Server address, see parse_address()
+            interval (float): Shortest time between two frames in seconds, 0 for every tick
+        Returns:
+            iterator of tuple: (decoder, StateFrame), the decoder holding the wall clock offset
+    """
+    family, target = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as connection:
+        connection.connect(target)
+        connection.sendall(subscribeStruct.pack(subscribeMagic, int(interval * 1000)))
+        decoder = StreamDecoder()
+        while True:
+            data = connection.recv(readSize)
+            if not data:
+                return
+            for frame in decoder.feed(data):
+                yield decoder, frame
+
+
+if __name__ == "__main__":
+    # Prints the frames streamed by a running controller, one line per frame
+    parser = argparse.ArgumentParser(description="Prints the state streamed by a running controller.")
+    parser.add_argument("address", help="host:port, port or Unix domain socket path of the stream")
+    parser.add_argument("--interval", type=float, default=0.0, help="shortest time between two frames")
+    args = parser.parse_args()
+    try:
+        for decoder, frame in subscribe(args.address, args.interval):
+            print(f"{frame.timeMs / 1000.0:.3f} {frame.ledState:06x} "
+                  f"us1={frame.distanceMm1 / 10:.1f} us3={frame.distanceMm3 / 10:.1f} "
+                  f"us4={frame.distanceMm4 / 10:.1f} ldr={frame.ldrValue} buzzer={frame.buzzerFreq} "
+                  f"phases={frame.s1Phase},{frame.s2Phase},{frame.s3Phase},{frame.s4Phase}")
+    except KeyboardInterrupt:
+        pass
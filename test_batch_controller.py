@@ -0,0 +1,21 @@
+import numpy as np
+
+from batch_controller import BatchController, check_conformance
+
+
+def test_batch_matches_scalar_controller():
+    result = check_conformance(sites=10, duration=60.0)
+
+    assert result.ticks == 1200
+    assert result.mismatches == 0, result.firstMismatch
+
+
+def test_latched_press_released_between_ticks_starts_crossing():
+    batch = BatchController(2)
+    distances = np.full((2, 3), 100.0)
+    buttons = np.zeros((2, 2), dtype=int)
+    presses = np.array([[True, False], [False, False]])
+
+    batch.step(1.0, distances, buttons, presses=presses)
+
+    assert batch.s2Active.tolist() == [True, False]
@@ -0,0 +1,38 @@
+import numpy as np
+
+from demand_simulator import pedestrian_kpis
+
+
+def test_call_during_walk_is_served_at_once():
+    walkOnsets = np.array([100.0, 200.0])
+    walkEnds = np.array([103.0, 203.0])
+    calls = np.array([101.5, 150.0])
+
+    kpis = pedestrian_kpis(calls, walkOnsets, walkEnds, 3600.0)
+
+    assert kpis["served"] == 2
+    assert kpis["maxWait"] == 50.0
+    assert kpis["meanWait"] == 25.0
+
+
+def test_call_after_walk_waits_for_next_walk():
+    walkOnsets = np.array([100.0, 200.0])
+    walkEnds = np.array([103.0, 203.0])
+
+    kpis = pedestrian_kpis(np.array([103.0]), walkOnsets, walkEnds, 3600.0)
+
+    assert kpis["maxWait"] == 97.0
+
+
+def test_call_during_walk_running_at_end_of_period():
+    kpis = pedestrian_kpis(np.array([3599.0, 3599.5]), np.array([3598.0]), np.array([]), 3600.0)
+
+    assert kpis["served"] == 2
+    assert kpis["maxWait"] == 0.0
+
+
+def test_call_after_last_walk_is_not_served():
+    kpis = pedestrian_kpis(np.array([50.0, 300.0]), np.array([100.0]), np.array([103.0]), 3600.0)
+
+    assert kpis["served"] == 1
+    assert kpis["maxWait"] == 50.0
@@ -0,0 +1,88 @@
+from pipeline import SnapshotBuffer
+from sensor_inputs import SensorSnapshot
+from sensor_trace import ReplayBoard, ReplayClock
+from simulated_board import SimulatedBoard, VirtualClock
+from traffic_controller import TrafficController
+
+
+def make_snapshot(time, pb1APressed=False, pb1BPressed=False):
+    return SensorSnapshot(time, 80, 80, 80, 0, 0, pb1APressed, pb1BPressed, 400)
+
+
+def test_press_in_superseded_snapshot_survives():
+    buffer = SnapshotBuffer()
+    buffer.publish(make_snapshot(1.0, pb1APressed=True))
+    buffer.publish(make_snapshot(1.05))
+
+    snapshot = buffer.latest()
+
+    assert snapshot.time == 1.05
+    assert snapshot.pb1APressed
+    assert not snapshot.pb1BPressed
+    assert buffer.superseded == 1
+
+
+def test_presses_carried_across_several_snapshots():
+    buffer = SnapshotBuffer()
+    buffer.publish(make_snapshot(1.0, pb1APressed=True))
+    buffer.publish(make_snapshot(1.05, pb1BPressed=True))
+    buffer.publish(make_snapshot(1.1))
+
+    snapshot = buffer.latest()
+
+    assert snapshot.pb1APressed and snapshot.pb1BPressed
+
+
+def test_taken_press_is_not_carried():
+    buffer = SnapshotBuffer()
+    buffer.publish(make_snapshot(1.0, pb1APressed=True))
+    assert buffer.latest().pb1APressed
+    buffer.publish(make_snapshot(1.05))
+
+    assert not buffer.latest().pb1APressed
+
+
+def test_press_in_superseded_snapshot_starts_crossing():
+    clock = ReplayClock(0.0)
+    controller = TrafficController(ReplayBoard(), clock)
+    buffer = SnapshotBuffer()
+    buffer.publish(make_snapshot(1.0, pb1APressed=True))
+    buffer.publish(make_snapshot(1.05))
+
+    clock.now = 1.05
+    controller.process(buffer.latest())
+
+    assert controller.s2Active
+
+
+
+class RecordingLog:
+    store = None
+
+    def __init__(self):
+        self.records = []
+
+    def log(self, eventType, subsystem, value=None, storeOnly=False):
+        self.records.append((eventType, subsystem, value))
+
+
+def test_press_acted_on_once_when_deadline_fires_between_snapshots():
+    clock = VirtualClock()
+    events = RecordingLog()
+    controller = TrafficController(SimulatedBoard(clock), clock, events)
+    controller.setup_board()
+    # A crossing just ended, so the call waits for the lockout instead of starting one
+    controller.lastCrossingTime = 1.0
+    buffer = SnapshotBuffer()
+
+    buffer.publish(make_snapshot(1.0, pb1APressed=True))
+    for now in (1.0, 1.02):
+        # The second pass is a deadline wakeup, nothing was published since the first
+        clock.advance_to(now)
+        controller.decide(buffer.latest()._replace(time=now))
+    buffer.publish(make_snapshot(1.05))
+    clock.advance_to(1.05)
+    controller.decide(buffer.latest()._replace(time=1.05))
+
+    assert events.records.count(("buttonPressed", "s2", "A")) == 1
+    assert controller.pedestrianCall == 1.0
@@ -0,0 +1,1324 @@
+import time
+from collections import namedtuple
+
+from blink_engine import BlinkEngine
+from board_transport import CoalescingTransport
+from debouncer import Debouncer
+from distance_filter import DistanceFilter, is_valid_distance
+from event_log import EventLog
+from led_compositor import LedCompositor, normalPriority, overridePriority, pedestrianPriority
+from metrics import LoopMetrics
+from phase_table import Phase, PhaseSequence, led_mask
+from pipeline import Pipeline
+from sampling_manager import SamplingManager
+from scheduler import DeadlineScheduler
+from sensor_inputs import SensorInputs
+from shift_register import ShiftRegisterDriver
+
+# Shift register control pins
+dataPin = 8
+latchPin = 9
+clockPin = 10
+
+# Ultrasonic sensor pins for subsystems
+trigPin1, echoPin1 = 2, 3  # US1
+trigPin3, echoPin3 = 6, 7  # US3
+trigPin4, echoPin4 = 12, 13  # US2
+
+# Push button pins
+pb1A = 4
+pb1B = 5
+pa1Buzzer = 11
+
+# Console messages of the events logged by the controller, keyed by (event type, subsystem)
+eventMessages = {
+    ("overheightDetected", "s1"): "Overheight vehicle detected! Height: {value:.2f} m at {wall}",
+    ("vehiclePresent", "s1"): "Overheight vehicle still present. TL2 stays red.",
+    ("overrideStart", "s1"): "Subsystem 4 detected overheight vehicle. Overriding subsystem 1.",
+    ("overrideRelease", "s1"): "Subsystem 4 no longer detects overheight vehicle. Releasing override.",
+    ("overrideStart", "s2"): "Subsystem 4 detected overheight vehicle. TL4 turns RED override active.",
+    ("overrideRelease", "s2"): "Subsystem 4 no longer detects overheight vehicle. Releasing TL4 red override.",
+    ("buttonPressed", "s2"): "Pedestrian button PB1 {value} pressed.",
+    ("callLatched", "s2"): "Pedestrian call registered, waiting for the next crossing.",
+    ("callServed", "s2"): "Serving pedestrian call after {value:.1f}s wait.",
+    ("overheightDetected", "s3"): "Exit-Overheight Vehicle Detected in Tunnel.",
+    ("detectedDuringS1", "s3"): "Subsystem 1 active, Subsystem 3 enters new state due to US3 detection.",
+    ("vehicleLeft", "s3"): "US3 no longer detects overheight vehicle, resetting Subsystem 1 and TL5.",
+    ("tunnelHold", "s4"): "Overheight Vehicle Detected in Tunnel (Subsystem 4).",
+    ("tunnelCleared", "s4"): "Tunnel cleared (Subsystem 4).",
+    ("boardLost", "board"): "Board connection lost ({value}), reconnecting...",
+    ("boardRecovered", "board"): "Board reconnected after {value}s, outputs restored.",
+}
+
+# Seconds between two records of an event that keeps repeating
+eventRateLimits = {"vehiclePresent": 10.0}
+
+# Bytes of the Firmata tone messages switching the buzzer on and off
+toneOnBytes = 9
+toneOffBytes = 5
+
+# Light dependant resistor pin
+ldrPin = 0
+
+# LED pin for shift register indexes
+tl1Green = 0 # U1pin15
+tl1Yellow = 1 # U1pin1
+tl1Red = 2 # U1pin2
+tl2Green = 3 # U1pin3
+tl2Yellow = 4 # U1pin4
+tl2Red = 5 # U1in5
+tl4Green = 6 # U1pin6
+tl4Yellow = 7 # U1pin7
+tl4Red = 8 # U1pin8
+pl1AGreen = 9 # U2pin1
+pl1ARed = 10 # U2pin2
+pl1BGreen = 11 # U2pin4
+pl1BRed = 12 # U2pin3
+tl5Green = 13 # U2pin5
+tl5Yellow = 14 # U2pin6
+tl5Red = 15 # U2pin7
+tl3Green = 16 # U3pin15
+tl3Red = 17 # U3pin1
+wl1A = 18 # U3pin2
+wl1B = 19 # U3pin3
+fl1 = 20 # U3pin4
+fl2 = 21 # U3pin5
+wl2A = 22 # U3pin6
+wl2B = 23 # U3pin7
+
+# Number of LEDs driven through the three shift registers
+ledCount = 24
+
+# Precomputed (set, clear) LED masks applied outside the transition tables
+s1ResetLeds = (led_mask(tl1Green, tl2Green), led_mask(tl1Yellow, tl1Red, tl2Yellow, tl2Red, wl1A, wl1B))
+s1OverrideLeds = (led_mask(tl1Red, tl2Red), led_mask(tl1Green, tl1Yellow, tl2Green, tl2Yellow))
+tl4RedLeds = (led_mask(tl4Red), led_mask(tl4Green, tl4Yellow))
+s2FinishLeds = (led_mask(pl1ARed, pl1BRed), led_mask(pl1AGreen, pl1BGreen))
+s3FinishLeds = (led_mask(tl5Red), led_mask(tl5Green, tl5Yellow))
+nightLeds = (led_mask(fl1, fl2), 0)
+dayLeds = (0, led_mask(fl1, fl2))
+s4HoldLeds = (led_mask(tl3Red), led_mask(tl3Green))
+s4ReleaseLeds = (led_mask(tl3Green, tl4Green), led_mask(tl3Red, tl4Yellow, tl4Red, wl2A, wl2B))
+
+# (even, odd) half period LEDs of the alternating warning lights
+wl1FlashLeds = (led_mask(wl1A), led_mask(wl1B))
+wl2FlashLeds = (led_mask(wl2A), led_mask(wl2B))
+
+# LEDs a layer hands back when its subsystem stops driving them
+tl1Tl2Leds = led_mask(tl1Green, tl1Yellow, tl1Red, tl2Green, tl2Yellow, tl2Red)
+tl4Leds = led_mask(tl4Green, tl4Yellow, tl4Red)
+
+class RealClock:
+    """
+    Wall clock used when the controller drives real hardware.
+    """
+
+    def time(self):
+        """
+        Returns the current time.
+            Parameters:
+                None
+            Returns:
+                float: Seconds since the epoch
+        """
+        return time.time()
+
+    def monotonic(self):
+        """
+        Returns a time that is not affected by changes to the system clock.
+            Parameters:
+                None
+            Returns:
+                float: Seconds from an arbitrary starting point
+        """
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        """
+        Blocks the calling thread for the given number of seconds.
+            Parameters:
+                seconds (float): Time to sleep
+            Returns:
+                None
+        """
+        time.sleep(seconds)
+
+    def wait(self, event, timeout):
+        """
+        Blocks until the event is set or the timeout expires.
+            Parameters:
+                event (threading.Event): Event to wait for
+                timeout (float): Maximum time to wait in seconds
+            Returns:
+                bool: True if the event was set
+        """
+        return event.wait(timeout)
+
+
+# Settings of one intersection: its board, the Arduino pins of its sensors and outputs,
+# detection thresholds and phase timings in seconds. The LED indexes above describe the
+# shift register wiring, which is the same for every intersection.
+configDefaults = {
+    "name": "intersection",
+    "comPort": None,
+    "arduinoInstanceId": 1,
+    "metricsPort": 9108,
+    "streamPort": 0,
+    "streamSocket": None,
+    "boardCacheFile": "board_cache.json",
+    "eventStoreDir": None,
+    "connectTimeout": 4.0,
+    "healthCheckInterval": 0.25,
+    "reconnectInterval": 0.2,
+    "dataPin": dataPin,
+    "latchPin": latchPin,
+    "clockPin": clockPin,
+    "trigPin1": trigPin1, "echoPin1": echoPin1,
+    "trigPin3": trigPin3, "echoPin3": echoPin3,
+    "trigPin4": trigPin4, "echoPin4": echoPin4,
+    "us1Timeout": 200000,
+    "pb1A": pb1A,
+    "pb1B": pb1B,
+    "buzzerPin": pa1Buzzer,
+    "ldrPin": ldrPin,
+    "ldrDifferential": 8,
+    "idleSamplingInterval": 100,
+    "activeSamplingInterval": 15,
+    "samplingHoldTime": 5.0,
+    "activityCm": 50,
+    "tickInterval": 0.05,
+    "pipelined": False,
+    "coalesceWrites": True,
+    "maxHeight": 0.2,
+    "sensorHeight": 0.6,
+    "exitDetectCm": 20,
+    "nightLdrValue": 700,
+    "hysteresisCm": 3,
+    "us1AssertMs": 100,
+    "us1ReleaseMs": 300,
+    "us3AssertMs": 100,
+    "us3ReleaseMs": 300,
+    "us4AssertMs": 200,
+    "us4ReleaseMs": 200,
+    "buttonAssertMs": 30,
+    "buttonReleaseMs": 30,
+    "smoothingWindowSize": 5,
+    "readingMaxAge": 3.0,
+    "hampelThreshold": 3.0,
+    "s1StepTime": 1,
+    "s1MinRedTime": 5,
+    "s1MaxRedTime": 30,
+    "s1GapTime": 3,
+    "s1GreenTime": 1,
+    "s2GreenTime": 2,
+    "s2YellowTime": 2,
+    "s2WalkTime": 3,
+    "s2FlashTime": 2,
+    "crossingLockout": 30,
+    "callAckTime": 1.0,
+    "callAckInterval": 0.125,
+    "s3YellowTime": 2,
+    "s3GreenTime": 5,
+    "flashInterval": 0.5,
+    "overrideBuzzerFrequency": 1200,
+    "normalBuzzerFrequency": 600,
+    "alarmBuzzerFrequency": 2700,
+}
+IntersectionConfig = namedtuple("IntersectionConfig", configDefaults, defaults=configDefaults.values())
+
+
+def create_event_log(clock, path=None, echo=False, source=None, store=None):
+    """
+    Creates an event log with the controller's messages and rate limits.
+        Parameters:
+            clock (RealClock or VirtualClock): Clock the controller runs on
+            path (str or None): File to write JSON lines to, no file if None
+            echo (bool): Also print each message to the console
+            source (str or None): Name of the intersection, added to every record
+            store (EventStore or None): Columnar store also receiving every event
+        Returns:
+            EventLog: The log, disabled if it has neither a file, echo nor a store
+    """
+    return EventLog(clock, path, echo, eventMessages, eventRateLimits, source=source, store=store)
+
+
+class TrafficController:
+    """
+    Runs the four traffic light subsystems against a board and a clock.
+
+    The board may be a pymata4.Pymata4 instance or any object implementing the same
+    calls (see simulated_board.SimulatedBoard). The clock provides time(), monotonic(),
+    sleep() and wait(). All state timers run on the monotonic clock.
+
+    The light sequences of Subsystems 1-4 are transition tables (see phase_table),
+    so entering a phase is a single mask operation. Each subsystem renders into its
+    own LED layer and the layers are resolved into ledState once per tick, with
+    override taking priority over pedestrian and pedestrian over the normal sequences
+    (see led_compositor).
+    """
+
+    def __init__(self, board, clock=None, events=None, config=None):
+        """
+        Creates a controller with every subsystem in its initial state.
+            Parameters:
+                board (Pymata4): The board the LEDs, buzzer and sensors are attached to
+                clock (RealClock or VirtualClock): Time source, defaults to the wall clock
+                events (EventLog or None): Log receiving the controller's events, none are kept if None
+                config (IntersectionConfig or None): Pins, thresholds and timings, the defaults if None
+            Returns:
+                None
+        """
+        self.config = config = config if config is not None else IntersectionConfig()
+        self.board = board
+        # Receives the buzzer and sampling commands, the board itself unless a Pipeline
+        # queues them for its actuation thread
+        self.output = board
+        self.clock = clock if clock is not None else RealClock()
+        self.events = events if events is not None else create_event_log(self.clock)
+
+        # Sampling period used while sensor readings are still being smoothed or
+        # debounced, otherwise the loop sleeps until the next phase deadline or
+        # until a sensor callback delivers a new reading
+        self.tickInterval = config.tickInterval
+        self.scheduler = DeadlineScheduler(self.clock)
+
+        # Loop timings and event counters, the budget is the sampling period
+        self.metrics = LoopMetrics(self.tickInterval)
+
+        # Sensor readings pushed by board callbacks
+        self.inputs = SensorInputs(board, self.clock,
+                                   [(config.trigPin1, config.echoPin1, config.us1Timeout),
+                                    (config.trigPin3, config.echoPin3, None),
+                                    (config.trigPin4, config.echoPin4, None)],
+                                   [config.pb1A, config.pb1B], config.ldrPin, config.ldrDifferential)
+
+        # Board sampling rate and LDR reporting, following the activity on the road
+        self.sampling = SamplingManager(["us1", "us3", "us4"], config.ldrPin, config.idleSamplingInterval,
+                                        config.activeSamplingInterval, config.samplingHoldTime)
+
+        # ledState word for all LEDs, bit i drives shift register output i
+        self.ledState = 0
+        self.outputDriver = ShiftRegisterDriver(board, config.dataPin, config.latchPin, config.clockPin, ledCount)
+
+        # Serial port stand-in keeping the writes of a tick and writing them at once when
+        # it ends, the shift register ports carry clock edges that must all be sent
+        self.transport = None
+        if config.coalesceWrites:
+            self.transport = CoalescingTransport({pin // 8 for pin in (config.dataPin, config.latchPin,
+                                                                       config.clockPin)})
+            self.transport.attach(board)
+
+        # LED layers of the subsystems, resolved into ledState by the compositor
+        self.compositor = LedCompositor()
+        self.s1Layer = self.compositor.add_layer("s1", normalPriority)
+        self.s3Layer = self.compositor.add_layer("s3", normalPriority)
+        self.s4Layer = self.compositor.add_layer("s4", normalPriority)
+        self.s2Layer = self.compositor.add_layer("s2", pedestrianPriority)
+        self.overrideLayer = self.compositor.add_layer("override", overridePriority)
+
+        # Every flashing LED blinks on one phase-locked clock, so the toggles due at an
+        # instant are resolved into one frame
+        self.blinker = BlinkEngine()
+
+        # Smoothed readings of the latest iteration
+        self.distanceCm1 = None
+        self.distanceCm3 = None
+        self.distanceCm4 = None
+        self.ldrValue = None
+        # Latest valid US1 reading, the debouncer holds a detection after the filter expired
+        self.lastDistanceCm1 = None
+
+        # State variables for Subsystem 1
+        self.s1Active = False
+        self.wl1FlashActive = False
+        # Last time US1 or US3 saw the vehicle, the red hold gaps out s1GapTime after it
+        self.s1LastOccupied = float("-inf")
+
+        # State variables for Subsystem 2
+        self.s2Active = False
+        self.sequenceRunning = False
+        self.lastCrossingTime = float("-inf")
+        # Time and button of the pedestrian call waiting to be served, None without a call
+        self.pedestrianCall = None
+        self.pedestrianCallButton = None
+
+        # State variables for Subsystem 3
+        self.s3Active = False
+        self.s3SequenceComplete = False
+
+        # State variables for Subsystem 4
+        self.s4Active = False
+
+        # Overriding state variables for Subsystem 2
+        self.overrideSub2Overheight = False
+        self.overrideSub1BySub4 = False
+
+        # Cooldown flag for Subsystem 1
+        self.s1SequenceCooldown = True
+
+        # Maximum height for overheight vehicle
+        self.maxHeight = config.maxHeight
+
+        # Buzzer frequency constants
+        self.overrideBuzzerFrequency = config.overrideBuzzerFrequency
+        self.normalBuzzerFrequency = config.normalBuzzerFrequency
+        self.alarmBuzzerFrequency = config.alarmBuzzerFrequency
+
+        # Buzzer state tracking for less flicker
+        self.buzzerOn = False
+        self.buzzerFreq = 0
+        self.buzzerMessages = 0
+        self.buzzerBytes = 0
+
+        # Streaming filters smoothing the ultrasonic sensors: average of the last
+        # readings with outliers rejected, readings are dropped after readingMaxAge so
+        # a sensor that stops answering no longer holds a detection
+        self.us1Filter = DistanceFilter(config.smoothingWindowSize, config.readingMaxAge, config.hampelThreshold)
+        self.us3Filter = DistanceFilter(config.smoothingWindowSize, config.readingMaxAge, config.hampelThreshold)
+        self.us4Filter = DistanceFilter(config.smoothingWindowSize, config.readingMaxAge, config.hampelThreshold)
+
+        # Detections and button levels debounced in time, the distances with hysteresis
+        # of hysteresisCm between the detection and the release thresholds
+        detectCm = self.maxHeight * 100
+        self.us1Debouncer = Debouncer(config.us1AssertMs, config.us1ReleaseMs, detectCm,
+                                      detectCm + config.hysteresisCm)
+        self.us3Debouncer = Debouncer(config.us3AssertMs, config.us3ReleaseMs, config.exitDetectCm,
+                                      config.exitDetectCm + config.hysteresisCm)
+        self.us4Debouncer = Debouncer(config.us4AssertMs, config.us4ReleaseMs, detectCm,
+                                      detectCm + config.hysteresisCm)
+        self.pb1ADebouncer = Debouncer(config.buttonAssertMs, config.buttonReleaseMs, 0.5, 0.5, below=False)
+        self.pb1BDebouncer = Debouncer(config.buttonAssertMs, config.buttonReleaseMs, 0.5, 0.5, below=False)
+        self.debouncers = [self.us1Debouncer, self.us3Debouncer, self.us4Debouncer,
+                           self.pb1ADebouncer, self.pb1BDebouncer]
+
+        # Optional sensor_trace.TraceRecorder receiving the readings of every tick
+        self.recorder = None
+
+        # Optional state_stream.StateStreamServer receiving the state after every tick
+        self.monitor = None
+
+        # Cleared by stop() to end run()
+        self.running = False
+
+        # Optional callable run after every iteration, raising if the board was lost
+        self.healthCheck = None
+
+        # Acquisition, decision and actuation threads used by run() if config.pipelined,
+        # and the actuation stage receiving the LED frames while they run
+        self.pipeline = None
+        self.actuation = None
+
+        self.build_sequences()
+        if self.events.store is not None:
+            for sequence in (self.s1Sequence, self.s2Sequence, self.s3Sequence):
+                sequence.observer = self.record_phase
+        if config.pipelined:
+            self.pipeline = Pipeline(self)
+        self.register_metrics()
+
+    def build_sequences(self):
+        """
+        Builds the transition tables of Subsystems 1-4.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        config = self.config
+
+        # Subsystem 1: stop TL1 then TL2, hold both red for s1MinRedTime and then until US1
+        # and US3 have been clear for s1GapTime, or for s1MaxRedTime at most
+        self.s1Sequence = PhaseSequence("s1", [
+            Phase("TL1 yellow", on=(tl1Yellow,), off=(tl1Green, tl1Red, tl2Green, tl2Yellow, tl2Red),
+                  duration=config.s1StepTime),
+            Phase("TL1 red, TL2 yellow", on=(tl1Red, tl2Yellow), off=(tl1Green, tl1Yellow, tl2Green, tl2Red),
+                  duration=config.s1StepTime),
+            Phase("TL1 and TL2 red", on=(tl1Red, tl2Red), off=(tl1Green, tl1Yellow, tl2Green, tl2Yellow),
+                  duration=config.s1MinRedTime, guard=self.s1_red_released),
+            Phase("TL1 green", on=(tl1Green,), off=(tl1Yellow, tl1Red, tl2Green, tl2Yellow, tl2Red),
+                  duration=config.s1GreenTime, guard=self.us1_clear, onHold=self.report_vehicle_present),
+        ], self.s1Layer, onFinish=self.finish_subsystem1)
+        self.s1AllRedPhase = 2
+
+        # Subsystem 2: stop TL4, let pedestrians cross, then flash the pedestrian reds
+        self.s2Sequence = PhaseSequence("s2", [
+            Phase("TL4 green", on=(tl4Green, pl1ARed, pl1BRed), off=(tl4Yellow, tl4Red, pl1AGreen, pl1BGreen),
+                  duration=config.s2GreenTime),
+            Phase("TL4 yellow", on=(tl4Yellow, pl1ARed, pl1BRed), off=(tl4Green, tl4Red, pl1AGreen, pl1BGreen),
+                  duration=config.s2YellowTime),
+            Phase("PL1 green", on=(tl4Red, pl1AGreen, pl1BGreen), off=(tl4Green, tl4Yellow, pl1ARed, pl1BRed),
+                  duration=config.s2WalkTime),
+            Phase("PL1 flashing red", on=(tl4Red, pl1ARed, pl1BRed), off=(tl4Green, tl4Yellow, pl1AGreen, pl1BGreen),
+                  duration=config.s2FlashTime, flash=(pl1ARed, pl1BRed),
+                  flashInterval=config.flashInterval),
+        ], self.s2Layer, onFinish=self.finish_subsystem2, blinker=self.blinker)
+        self.s2ClearancePhase = 3
+
+        # Call received indication: the pressed side's pedestrian red blinks quickly
+        self.callAck = PhaseSequence("callAck", [
+            Phase("PL1A call received", on=(pl1ARed,), off=(pl1AGreen,), duration=config.callAckTime,
+                  flash=(pl1ARed,), flashInterval=config.callAckInterval, nextPhase=2),
+            Phase("PL1B call received", on=(pl1BRed,), off=(pl1BGreen,), duration=config.callAckTime,
+                  flash=(pl1BRed,), flashInterval=config.callAckInterval),
+        ], self.s2Layer, onFinish=self.finish_call_ack, blinker=self.blinker)
+
+        # Subsystem 3: let the overheight vehicle out of the tunnel through TL5
+        self.s3Sequence = PhaseSequence("s3", [
+            Phase("TL5 yellow", on=(tl5Yellow,), off=(tl5Red, tl5Green), duration=config.s3YellowTime),
+            Phase("TL5 green", on=(tl5Green,), off=(tl5Red, tl5Yellow), duration=config.s3GreenTime,
+                  nextPhase=self.tl5_after_green),
+            Phase("TL5 flashing green", on=(tl5Green,), off=(tl5Red, tl5Yellow), guard=self.us3_clear,
+                  flash=(tl5Green,), flashInterval=config.flashInterval),
+        ], self.s3Layer, onFinish=self.finish_subsystem3, blinker=self.blinker)
+
+        self.sequences = [self.s1Sequence, self.s2Sequence, self.callAck, self.s3Sequence]
+
+    def register_metrics(self):
+        """
+        Exposes the counters kept by the controller's components through the loop metrics.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        metrics = self.metrics
+        driver = self.outputDriver
+        sampling = self.sampling
+        metrics.add_source("traffic_phase_transitions_total", "counter", "Phases entered by each light sequence",
+                           "sequence", lambda: {sequence.name: sequence.transitions for sequence in self.sequences})
+        metrics.add_source("traffic_firmata_messages_total", "counter", "Firmata messages sent to the board",
+                           "output", lambda: {"leds": driver.messagesSent, "buzzer": self.buzzerMessages,
+                                              "sampling": sampling.messagesSent})
+        metrics.add_source("traffic_firmata_bytes_total", "counter", "Firmata bytes sent to the board",
+                           "output", lambda: {"leds": driver.bytesSent, "buzzer": self.buzzerBytes,
+                                              "sampling": sampling.bytesSent})
+        transport = self.transport
+        if transport is not None:
+            metrics.add_source("traffic_serial_writes_total", "counter",
+                               "Writes to the board's serial port, one system call each", None,
+                               lambda: transport.writes)
+            metrics.add_source("traffic_serial_messages_total", "counter",
+                               "Firmata messages written to the serial transport, by what became of them",
+                               "outcome", lambda: {"sent": transport.messagesSent,
+                                                   "superseded": transport.messagesSuperseded})
+            metrics.add_source("traffic_serial_bytes_total", "counter", "Bytes written to the board's serial port",
+                               None, lambda: transport.bytesSent)
+        metrics.add_source("traffic_sampling_interval_ms", "gauge", "Sampling interval set on the board",
+                           None, lambda: sampling.interval or 0)
+        metrics.add_source("traffic_sensor_fast_sampling", "gauge", "Sonars currently wanting the fast rate",
+                           "sensor", lambda: {name: int(sampling.sensor_active(name, self.clock.monotonic()))
+                                              for name in sampling.sensors})
+        metrics.add_source("traffic_received_bytes_per_second", "gauge",
+                           "Estimated report traffic from the board at the current settings", None,
+                           sampling.received_rate)
+        metrics.add_source("traffic_frames_latched_total", "counter", "LED frames latched by the shift registers",
+                           None, lambda: driver.framesSent)
+        metrics.add_source("traffic_contested_frames_total", "counter",
+                           "Resolved frames in which LED layers disagreed", None,
+                           lambda: self.compositor.contestedFrames)
+        pipeline = self.pipeline
+        if pipeline is not None:
+            metrics.add_source("traffic_pipeline_depth", "gauge", "Items waiting between pipeline stages",
+                               "stage", lambda: {"decide": pipeline.buffer.depth(),
+                                                 "actuate": pipeline.actuation.depth()})
+            metrics.add_source("traffic_pipeline_superseded_total", "counter",
+                               "Snapshots and frames replaced by newer ones before their stage used them",
+                               "stage", lambda: {"decide": pipeline.buffer.superseded,
+                                                 "actuate": pipeline.actuation.framesSuperseded})
+        metrics.add_source("traffic_wakeups_total", "counter", "Wakeups of the control loop",
+                           None, lambda: self.scheduler.wakeups)
+        metrics.add_source("traffic_deadline_lateness_max_seconds", "gauge",
+                           "Worst delay between a deadline and the wakeup serving it", "deadline",
+                           lambda: {tag: stats["maxLateness"] for tag, stats in self.scheduler.report().items()})
+
+    def setup_board(self):
+        """
+        Configures every pin used by the controller on the board.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        board = self.board
+        config = self.config
+        board.set_pin_mode_digital_output(config.dataPin)
+        board.set_pin_mode_digital_output(config.latchPin)
+        board.set_pin_mode_digital_output(config.clockPin)
+        board.set_pin_mode_pwm_output(config.buzzerPin)
+
+        # Sonars, buttons and the LDR report through callbacks
+        self.inputs.attach()
+        self.sampling.attach(board)
+
+    def attach_board(self, board):
+        """
+        Switches to a new connection to the board, configures its pins and latches
+        the current LED word and buzzer tone straight away. The sequences, timers and
+        sensor filters are left as they are.
+            Parameters:
+                board (Pymata4): Newly connected board
+            Returns:
+                None
+        """
+        self.board = board
+        self.output = board
+        self.inputs.board = board
+        if self.transport is not None:
+            self.transport.attach(board)
+        self.outputDriver.attach(board)
+        self.setup_board()
+        self.toggle_led()
+        if self.buzzerOn:
+            self.buzzerOn = False
+            self.set_buzzer(self.buzzerFreq)
+        else:
+            board.play_tone_off(self.config.buzzerPin)
+            self.buzzerMessages += 1
+            self.buzzerBytes += toneOffBytes
+
+    def reset_layers(self):
+        """
+        Renders the boot LED pattern of every subsystem into its layer.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.s1Layer.apply_mask(*s1ResetLeds)
+        self.s2Layer.apply_mask(*s2FinishLeds)
+        self.s3Layer.apply_mask(*s3FinishLeds)
+        self.s3Layer.apply_mask(*dayLeds)
+        self.s4Layer.apply_mask(*s4ReleaseLeds)
+
+    def initialise_leds(self):
+        """
+        Latches the boot LED pattern onto the shift registers.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.reset_layers()
+        self.ledState = self.compositor.resolve()
+        self.toggle_led()
+
+    def toggle_led(self):
+        """
+        Updates the shift register output to reflect the current LED states, or hands
+        them to the actuation thread while a Pipeline runs.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        if self.actuation is not None:
+            self.actuation.submit_frame(self.ledState)
+        else:
+            self.outputDriver.flush(self.ledState)
+
+    def set_buzzer(self, freq):
+        """
+        Activates the buzzer with a specified frequency, if it's not already playing or if the frequency has changed.
+            Parameters:
+                freq (int): The frequency in Hz at which the buzzer should play
+            Returns:
+                None
+        """
+        if not self.buzzerOn or self.buzzerFreq != freq:
+            self.output.play_tone_continuously(self.config.buzzerPin, freq)
+            self.buzzerMessages += 1
+            self.buzzerBytes += toneOnBytes
+            self.buzzerOn = True
+            self.buzzerFreq = freq
+
+    def stop_buzzer(self):
+        """
+        Turns off the buzzer if it is currently active.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        if self.buzzerOn:
+            self.output.play_tone_off(self.config.buzzerPin)
+            self.buzzerMessages += 1
+            self.buzzerBytes += toneOffBytes
+            self.buzzerOn = False
+            self.buzzerFreq = 0
+
+    def us1_detected(self):
+        """
+        Checks whether US1 sees an overheight vehicle.
+            Parameters:
+                None
+            Returns:
+                bool: True if the debounced US1 distance is under maxHeight
+        """
+        return self.us1Debouncer.active
+
+    def us1_clear(self):
+        """
+        Checks that US1 no longer sees an overheight vehicle.
+            Parameters:
+                None
+            Returns:
+                bool: True if US1 does not detect a vehicle
+        """
+        return not self.us1Debouncer.active
+
+    def us3_detected(self):
+        """
+        Checks whether US3 sees an overheight vehicle at the tunnel exit.
+            Parameters:
+                None
+            Returns:
+                bool: True if the debounced US3 distance is under exitDetectCm
+        """
+        return self.us3Debouncer.active
+
+    def us3_clear(self):
+        """
+        Checks that US3 no longer sees an overheight vehicle.
+            Parameters:
+                None
+            Returns:
+                bool: True if US3 does not detect a vehicle
+        """
+        return not self.us3_detected()
+
+    def us4_detected(self):
+        """
+        Checks whether US4 sees an overheight vehicle in the tunnel.
+            Parameters:
+                None
+            Returns:
+                bool: True if the debounced US4 distance is under maxHeight
+        """
+        return self.us4Debouncer.active
+
+    def s1_red_deadline(self):
+        """
+        Returns the time at which the red hold of Subsystem 1 gaps out or maxes out.
+            Parameters:
+                None
+            Returns:
+                float: Monotonic time, the gap out only counts while US1 and US3 are clear
+        """
+        maxOut = self.s1Sequence.enteredAt + self.config.s1MaxRedTime
+        if self.us1_detected() or self.us3_detected():
+            return maxOut
+        return min(self.s1LastOccupied + self.config.s1GapTime, maxOut)
+
+    def s1_red_released(self):
+        """
+        Checks whether TL1 and TL2 may leave the red hold once s1MinRedTime has passed.
+        Every detection by US1 or US3 restarts the gap, extending the hold.
+            Parameters:
+                None
+            Returns:
+                bool: True once the hold gapped out or reached s1MaxRedTime
+        """
+        now = self.clock.monotonic()
+        if now < self.s1_red_deadline():
+            return False
+        if self.us1_clear() and self.us3_clear() and now - self.s1LastOccupied >= self.config.s1GapTime:
+            self.metrics.count("s1_red_releases", "gapOut")
+        else:
+            self.metrics.count("s1_red_releases", "maxOut")
+        return True
+
+    def record_phase(self, sequence, index):
+        """
+        Records a phase change of Subsystems 1-3 in the event store.
+            Parameters:
+                sequence (PhaseSequence): Sequence that changed phase
+                index (int): Phase entered, -1 once the sequence is idle
+            Returns:
+                None
+        """
+        self.events.log("phaseEntered", sequence.name, index, storeOnly=True)
+
+    def report_vehicle_present(self):
+        """
+        Reports that TL2 is held red because the vehicle has not left US1.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.events.log("vehiclePresent", "s1")
+
+    def tl5_after_green(self):
+        """
+        Chooses the phase following TL5 green.
+            Parameters:
+                None
+            Returns:
+                int: Flashing green while US3 still detects the vehicle, otherwise the end of the sequence
+        """
+        return 2 if self.us3_detected() else len(self.s3Sequence.phases)
+
+    def reset_subsystem1(self):
+        """
+        Resets Subsystem 1 to its initial state.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.s1Active = False
+        self.s1Sequence.stop()
+        self.blinker.withdraw("wl1")
+        self.s1Layer.apply_mask(*s1ResetLeds)
+
+    def finish_subsystem1(self, now):
+        """
+        Releases TL1 and TL2 once the overheight vehicle has left.
+            Parameters:
+                now (float): Time the sequence finished
+            Returns:
+                None
+        """
+        self.s1Layer.apply_mask(*s1ResetLeds)
+        self.blinker.withdraw("wl1")
+        self.stop_buzzer()
+        self.s1Active = False
+
+    def start_subsystem2(self, now):
+        """
+        Starts the pedestrian crossing sequence for the latched call. TL4 stays green for
+        s2GreenTime after the call, so a call that already waited that long goes straight
+        to TL4 yellow.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                None
+        """
+        self.callAck.stop()
+        self.s2Active = True
+        self.sequenceRunning = True
+        if now - self.pedestrianCall >= self.config.s2GreenTime:
+            self.s2Sequence.enter(1, now)
+        else:
+            self.s2Sequence.start(now)
+        self.pedestrianCall = None
+        self.pedestrianCallButton = None
+
+    def crossing_permitted(self, now):
+        """
+        Checks whether a pedestrian crossing may start.
+            Parameters:
+                now (float): Current monotonic time
+            Returns:
+                bool: True if no crossing runs, TL4 is not overridden and the last
+                    crossing ended at least crossingLockout seconds ago
+        """
+        return (not self.s2Active and not self.overrideSub2Overheight
+                and now - self.lastCrossingTime >= self.config.crossingLockout)
+
+    def register_call(self, button, now):
+        """
+        Latches a pedestrian call. Presses while a crossing is about to let pedestrians
+        walk belong to that crossing, later ones call the next crossing.
+            Parameters:
+                button (str): "A" or "B"
+                now (float): Time of the press
+            Returns:
+                None
+        """
+        if self.s2Active and self.s2Sequence.index < self.s2ClearancePhase:
+            return
+        self.events.log("buttonPressed", "s2", button)
+        if self.pedestrianCall is None:
+            self.pedestrianCall = now
+            self.pedestrianCallButton = button
+            if not self.crossing_permitted(now):
+                self.metrics.count("pedestrian_calls", "latched")
+                self.events.log("callLatched", "s2")
+        # Acknowledge every press the crossing cannot serve at once
+        if not self.s2Active and not self.crossing_permitted(now):
+            self.s2Layer.apply_mask(*s2FinishLeds)
+            self.callAck.enter(0 if button == "A" else 1, now)
+
+    def finish_call_ack(self, now):
+        """
+        Returns the pedestrian reds to steady once the call indication ends.
+            Parameters:
+                now (float): Time the indication finished
+            Returns:
+                None
+        """
+        self.s2Layer.apply_mask(*s2FinishLeds)
+
+    def finish_subsystem2(self, now):
+        """
+        Hands TL4 back to its normal green and starts the lockout before the next crossing.
+            Parameters:
+                now (float): Time the sequence finished
+            Returns:
+                None
+        """
+        self.s2Layer.apply_mask(*s2FinishLeds)
+        self.s2Layer.release(tl4Leds)
+        self.sequenceRunning = False
+        self.lastCrossingTime = now
+        self.s2Active = False
+
+    def finish_subsystem3(self, now):
+        """
+        Returns TL5 to red once the overheight vehicle has left US3.
+            Parameters:
+                now (float): Time the sequence finished
+            Returns:
+                None
+        """
+        self.s3Layer.apply_mask(*s3FinishLeds)
+        self.s3SequenceComplete = True
+        self.s1SequenceCooldown = True
+
+    def update(self):
+        """
+        Runs one iteration of the control loop: takes the latest sensor readings,
+        advances Subsystems 1-4, resolves their LED layers into one frame and flushes
+        it to the shift registers. Every write of the iteration reaches the serial port
+        in one go at its end when writes are coalesced.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        timer = self.metrics.timer
+        transport = self.transport
+        start = timer()
+        if transport is not None:
+            transport.hold()
+        try:
+            snapshot = self.acquire()
+            acquired = timer()
+            self.decide(snapshot)
+            decided = timer()
+            self.toggle_led()
+        finally:
+            # Also sends what the iteration wrote before failing, and stops holding writes
+            if transport is not None:
+                transport.flush()
+        self.metrics.tick(start, acquired, decided, timer())
+
+    def acquire(self):
+        """
+        Takes the latest sensor readings.
+            Parameters:
+                None
+            Returns:
+                SensorSnapshot: Readings at the current time
+        """
+        return self.inputs.snapshot()
+
+    def decide(self, snapshot):
+        """
+        Records a snapshot to the trace, advances Subsystems 1-4 for it, schedules
+        their next deadlines and resolves the LED layers into ledState.
+            Parameters:
+                snapshot (SensorSnapshot): Readings to act on
+            Returns:
+                None
+        """
+        if self.recorder is not None:
+            self.recorder.record(snapshot)
+        self.process(snapshot)
+        self.update_sampling(snapshot)
+        self.schedule_deadlines(snapshot)
+        self.ledState = self.compositor.resolve()
+        if self.monitor is not None:
+            self.monitor.publish(self, snapshot.time)
+
+    def sensor_activity(self, snapshot):
+        """
+        Checks which sonars see a vehicle or belong to a subsystem that is running.
+            Parameters:
+                snapshot (SensorSnapshot): Readings just processed
+            Returns:
+                list of bool: Activity of US1, US3 and US4
+        """
+        limit = self.config.activityCm
+        return [
+            self.s1Active or 0 < snapshot.distanceCm1 < limit,
+            self.s3Active or 0 < snapshot.distanceCm3 < limit,
+            self.s4Active or self.overrideSub1BySub4 or 0 < snapshot.distanceCm4 < limit,
+        ]
+
+    def update_sampling(self, snapshot):
+        """
+        Speeds up the board's sampling while there is activity and reports the LDR
+        only while Subsystem 3 runs, since it only decides the flood lights. The LDR
+        reading is unknown from when reporting resumes until the board reports it.
+            Parameters:
+                snapshot (SensorSnapshot): Readings just processed
+            Returns:
+                None
+        """
+        wasReporting = self.sampling.ldrReporting
+        self.sampling.update(snapshot.time, self.sensor_activity(snapshot), self.s3Active)
+        if self.sampling.ldrReporting and not wasReporting:
+            self.inputs.forget_ldr()
+
+    def sampling_pending(self, snapshot):
+        """
+        Checks whether readings must keep being sampled every tick because a
+        distance filter has not settled, because Subsystem 3 waits for an LDR
+        reading, or because Subsystem 3 finished its sequence and is released on
+        the next iteration.
+            Parameters:
+                snapshot (SensorSnapshot): Readings just processed
+            Returns:
+                bool: True if another sample is needed after tickInterval
+        """
+        if self.s3Active and self.us3_clear() and (self.s3SequenceComplete or not self.s3Sequence.active):
+            return True
+        if self.s3Active and snapshot.ldrValue is None:
+            return True
+        for rawDistance, distanceFilter in ((snapshot.distanceCm1, self.us1Filter),
+                                            (snapshot.distanceCm3, self.us3Filter),
+                                            (snapshot.distanceCm4, self.us4Filter)):
+            if is_valid_distance(rawDistance) and not distanceFilter.settled(rawDistance):
+                return True
+        return False
+
+    def schedule_deadlines(self, snapshot):
+        """
+        Registers the time at which each running sequence next needs attention.
+            Parameters:
+                snapshot (SensorSnapshot): Readings just processed
+            Returns:
+                None
+        """
+        now = snapshot.time
+        if self.sampling_pending(snapshot):
+            self.scheduler.schedule("sample", now + self.tickInterval)
+        else:
+            self.scheduler.cancel("sample")
+
+        # Wake up when expiry changes a filtered distance. A filter fed without report times
+        # full of the reading the sensor still reports would only take the same reading in
+        # again, so only the others need waking up for; with report times a sonar that stops
+        # reporting must be noticed, so every filter is
+        expiries = [distanceFilter.next_change()
+                    for rawDistance, reportTime, distanceFilter in (
+                        (snapshot.distanceCm1, snapshot.reportTime1, self.us1Filter),
+                        (snapshot.distanceCm3, snapshot.reportTime3, self.us3Filter),
+                        (snapshot.distanceCm4, snapshot.reportTime4, self.us4Filter))
+                    if reportTime is not None or not distanceFilter.settled(rawDistance)]
+        expiries = [expiry for expiry in expiries if expiry is not None]
+        if expiries:
+            self.scheduler.schedule("expiry", min(expiries))
+        else:
+            self.scheduler.cancel("expiry")
+
+        # Wake up when a debounced detection or button is due to change
+        changes = [deadline for deadline in (debouncer.next_deadline() for debouncer in self.debouncers)
+                   if deadline is not None]
+        if changes:
+            self.scheduler.schedule("debounce", min(changes))
+        else:
+            self.scheduler.cancel("debounce")
+
+        # Serve a latched pedestrian call when the lockout ends, the end of a TL4 override
+        # arrives as a sensor change
+        lockoutEnd = self.lastCrossingTime + self.config.crossingLockout
+        if self.pedestrianCall is not None and not self.s2Active and lockoutEnd > now:
+            self.scheduler.schedule("call", lockoutEnd)
+        else:
+            self.scheduler.cancel("call")
+
+        # Go back to the idle sampling rate on time
+        backoff = self.sampling.next_change()
+        if backoff is None:
+            self.scheduler.cancel("backoff")
+        else:
+            self.scheduler.schedule("backoff", backoff)
+
+        # Wake up when the red hold of Subsystem 1 gaps out or maxes out, the sequence
+        # itself only knows about the minimum red time
+        if (self.s1Sequence.index == self.s1AllRedPhase and self.s1Sequence.holding(now)
+                and not self.overrideSub1BySub4):
+            self.scheduler.schedule("gap", self.s1_red_deadline())
+        else:
+            self.scheduler.cancel("gap")
+
+        # Wake up when the flashing LEDs switch, once for all of them
+        blink = self.blinker.next_deadline(now)
+        if blink is None:
+            self.scheduler.cancel("blink")
+        else:
+            self.scheduler.schedule("blink", blink)
+
+        for sequence in self.sequences:
+            deadline = sequence.next_deadline(now)
+            # Subsystem 1 is frozen while Subsystem 4 overrides it
+            if sequence is self.s1Sequence and self.overrideSub1BySub4:
+                deadline = None
+            if deadline is None:
+                self.scheduler.cancel(sequence.name)
+            else:
+                self.scheduler.schedule(sequence.name, deadline)
+
+    def filter_distance(self, distanceFilter, rawDistance, reportTime, now):
+        """
+        Feeds a sonar reading through its filter. A reading with a report time enters
+        the filter once, at that time, so a sonar that stopped reporting ages out; one
+        without is taken as just reported.
+            Parameters:
+                distanceFilter (DistanceFilter): Filter of the sonar
+                rawDistance (float or None): Latest distance of the sonar
+                reportTime (float or None): Time the sonar reported it, None if unknown
+                now (float): Current monotonic time
+            Returns:
+                float or None: The filtered distance, None if no valid sample is left
+        """
+        if reportTime is None:
+            return distanceFilter.update(rawDistance, now)
+        return distanceFilter.observe(rawDistance, reportTime, now)
+
+    def process(self, snapshot):
+        """
+        Advances Subsystems 1-4 for one set of sensor readings.
+            Parameters:
+                snapshot (SensorSnapshot): Readings to act on
+            Returns:
+                None
+        """
+        now = snapshot.time
+
+        # Smoothen readings from all ultrasonic sensors
+        self.distanceCm1 = distanceCm1 = self.filter_distance(self.us1Filter, snapshot.distanceCm1,
+                                                              snapshot.reportTime1, now)
+        if distanceCm1 is not None:
+            self.lastDistanceCm1 = distanceCm1
+        self.distanceCm3 = self.filter_distance(self.us3Filter, snapshot.distanceCm3, snapshot.reportTime3, now)
+        self.distanceCm4 = self.filter_distance(self.us4Filter, snapshot.distanceCm4, snapshot.reportTime4, now)
+        self.ldrValue = snapshot.ldrValue
+
+        # Debounce the detections and the buttons, a press counts once the button is held down
+        self.us1Debouncer.update(distanceCm1, now)
+        self.us3Debouncer.update(self.distanceCm3, now)
+        self.us4Debouncer.update(self.distanceCm4, now)
+        pb1AWasDown = self.pb1ADebouncer.active
+        pb1APressed = self.pb1ADebouncer.update(snapshot.pb1AState, now) and not pb1AWasDown
+        pb1BWasDown = self.pb1BDebouncer.active
+        pb1BPressed = self.pb1BDebouncer.update(snapshot.pb1BState, now) and not pb1BWasDown
+        # A press latched by the inputs and already released was never sampled down, so the
+        # debouncer cannot see it: it counts as a press unless the button was down already.
+        # A press still held is left to the debouncer, so it is not counted twice
+        pb1APressed = pb1APressed or (snapshot.pb1APressed and not snapshot.pb1AState and not pb1AWasDown)
+        pb1BPressed = pb1BPressed or (snapshot.pb1BPressed and not snapshot.pb1BState and not pb1BWasDown)
+        if self.us1_detected() or self.us3_detected():
+            self.s1LastOccupied = now
+
+        # Inititiate Subsytem 3 light sequence when Subsystem 1 light sequence is active
+        if self.s1Active and not self.s3Active:
+            if self.us3_detected():
+                self.events.log("detectedDuringS1", "s3")
+                self.s3Active = True
+                self.s3Sequence.stop()
+                self.s3SequenceComplete = False
+                self.s1SequenceCooldown = True
+
+        # Subsystem 4 overriding logic
+        if not self.overrideSub1BySub4 and self.us4_detected():
+            self.events.log("overrideStart", "s1")
+            self.overrideSub1BySub4 = True
+            self.wl1FlashActive = True
+            self.metrics.count("override_activations", "s1BySub4")
+
+            # Reset Subsystem 1 when both US1 AND US3 do not detect overheight vehicle
+            if self.us1_clear() and self.us3_clear():
+                self.reset_subsystem1()
+
+        elif self.overrideSub1BySub4 and not self.us4_detected():
+            self.events.log("overrideRelease", "s1")
+            self.overrideSub1BySub4 = False
+            self.wl1FlashActive = False
+            if not self.s1Active:
+                self.blinker.withdraw("wl1")
+
+            # Reset Subsystem 1 when both US1 AND US3 do not detect overheight vehicle
+            if self.us1_clear() and self.us3_clear():
+                self.reset_subsystem1()
+
+        # Determine override state
+        if self.us4_detected():
+            if not self.overrideSub2Overheight:
+                self.events.log("overrideStart", "s2")
+                self.overrideSub2Overheight = True
+                self.metrics.count("override_activations", "tl4Overheight")
+        else:
+            if self.overrideSub2Overheight:
+                self.events.log("overrideRelease", "s2")
+                self.overrideSub2Overheight = False
+
+        # Reset Subsystem 1 if US3 no longer detects an overheight vehicle
+        if self.us3_clear():
+            if self.s3Active:
+                # Ensure Subsystem 1 light sequence will run until detection of another overheight vehicle
+                if self.s1SequenceCooldown:
+                    self.reset_subsystem1()
+                    self.s1SequenceCooldown = False
+
+        # Independant light sequence of Subsystem 1
+        if not self.overrideSub1BySub4:
+
+            # Log height of overheight vehicle, the log adds the current time
+            if self.us1_detected() and not self.s1Active:
+                heightM = self.config.sensorHeight - self.lastDistanceCm1 / 100.0
+                self.events.log("overheightDetected", "s1", heightM)
+                self.s1Active = True
+                self.s1Sequence.start(now)
+
+            if self.s1Active:
+                # Flash sequence for wl1 upon detection of overheight vehicle
+                self.blinker.declare("wl1", self.s1Layer, *wl1FlashLeds, self.config.flashInterval)
+                self.s1Sequence.update(now)
+
+            self.overrideLayer.release(tl1Tl2Leds)
+            if self.s1Active:
+                # Sound the alarm while the vehicle stays under US1 past the minimum red time,
+                # and once the hold maxed out while it keeps TL2 red
+                if (self.s1Sequence.index is not None and self.s1Sequence.index >= self.s1AllRedPhase
+                        and self.s1Sequence.holding(now) and self.us1_detected()):
+                    self.set_buzzer(self.alarmBuzzerFrequency)
+                else:
+                    self.set_buzzer(self.normalBuzzerFrequency)
+            else:
+                self.stop_buzzer()
+
+        else:
+            self.overrideLayer.apply_mask(*s1OverrideLeds)
+            self.set_buzzer(self.overrideBuzzerFrequency)
+
+            if self.wl1FlashActive:
+                self.blinker.declare("wl1", self.s1Layer, *wl1FlashLeds, self.config.flashInterval)
+
+        # Independant light sequence of Subsystem 2
+        # Latch the calls of pb1A and pb1B, they are served as soon as TL4 is not overridden
+        # and the last crossing ended at least crossingLockout seconds ago
+        if pb1APressed:
+            self.register_call("A", now)
+        if pb1BPressed:
+            self.register_call("B", now)
+        if self.pedestrianCall is not None and self.crossing_permitted(now):
+            if self.pedestrianCall < now:
+                self.events.log("callServed", "s2", now - self.pedestrianCall)
+            self.start_subsystem2(now)
+
+        if self.s2Active:
+            self.s2Sequence.update(now)
+        self.callAck.update(now)
+
+        # Independant light sequence of Subsystem 3
+        # Detects for overheight vehicle
+        if self.us3_detected(): # Scaled height of overheight vehicle down to 20cm
+            if not self.s3Active:
+                self.events.log("overheightDetected", "s3")
+                self.s3Active = True
+                self.s3Sequence.stop()
+                self.s3SequenceComplete = False
+                self.s1SequenceCooldown = True
+
+        # Resets Subsystem 1 if no overheight vehicle is detected
+        else:
+            if self.s3Active:
+                if self.s3SequenceComplete or not self.s3Sequence.active:
+                    self.events.log("vehicleLeft", "s3")
+                    self.s3Active = False
+                    # Ensure Subsystem 1 light sequence will run until detection of another overheight vehicle
+                    if self.s1SequenceCooldown:
+                        self.reset_subsystem1()
+                        self.s1SequenceCooldown = False
+
+        if self.s3Active:
+            # Check if it is nighttime or daytime to trigger flood lights
+            if self.us3_detected() and self.ldrValue is not None and self.ldrValue < self.config.nightLdrValue:
+                self.s3Layer.apply_mask(*nightLeds)
+            else:
+                self.s3Layer.apply_mask(*dayLeds)
+
+            # Start light sequence upon detection of overheight vehicle
+            if not self.s3Sequence.active:
+                self.s3SequenceComplete = False
+                self.s3Sequence.start(now)
+            self.s3Sequence.update(now)
+
+        # Independant light sequence of Subsystem 4
+
+        # Determine condition for override
+        if not self.s4Active and self.us4_detected(): # Scaled height of overheight vehicle down to 20cm
+            self.events.log("tunnelHold", "s4")
+            self.s4Active = True
+            self.metrics.count("override_activations", "tunnelHold")
+            self.blinker.declare("wl2", self.s4Layer, *wl2FlashLeds, self.config.flashInterval)
+            self.s4Layer.apply_mask(*s4HoldLeds)
+        elif self.s4Active and not self.us4_detected():
+            self.events.log("tunnelCleared", "s4")
+            self.s4Active = False
+            self.blinker.withdraw("wl2")
+            self.s4Layer.apply_mask(*s4ReleaseLeds)
+
+        # Override TL4 red when US2 detects overheight vehicle or the tunnel is held,
+        # this wins over the pedestrian sequence
+        if self.overrideSub2Overheight or self.s4Active:
+            self.overrideLayer.apply_mask(*tl4RedLeds)
+        else:
+            self.overrideLayer.release(tl4Leds)
+
+        # Render every flashing LED for the current half period, all in this frame
+        self.blinker.update(now)
+
+    def run(self, duration=None):
+        """
+        Runs the control loop until interrupted, stopped or, if given, for a fixed time,
+        as a threaded Pipeline if config.pipelined is set.
+            Parameters:
+                duration (float or None): Seconds of clock time to run for, forever if None
+            Returns:
+                None
+        """
+        if self.pipeline is not None:
+            self.pipeline.run(duration)
+            return
+        self.running = True
+        endTime = None if duration is None else self.clock.monotonic() + duration
+        while self.running and (endTime is None or self.clock.monotonic() < endTime):
+            self.update()
+            if self.healthCheck is not None:
+                self.healthCheck()
+            self.scheduler.wait(self.inputs.changed)
+
+    def stop(self):
+        """
+        Makes run() return after the current iteration, may be called from another thread.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.running = False
+        self.inputs.changed.set()
+
+    def shutdown(self):
+        """
+        Switches every LED and the buzzer off and releases the board.
+            Parameters:
+                None
+            Returns:
+                None
+        """
+        self.ledState = 0
+        self.toggle_led()
+        self.board.play_tone_off(self.config.buzzerPin)
+        if self.recorder is not None:
+            self.recorder.close()
+        self.events.close()
+        print("Exiting program...")
+        self.clock.sleep(1)
+
+        self.board.shutdown()